@@ -1,8 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import logging
-from traceback import format_exc
-import datetime
+import time
+import uuid
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+import sqlite3
 from flask_login import LoginManager
 import os, sys
 from dotenv import load_dotenv
@@ -17,8 +20,122 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'tajny_klic')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or f'sqlite:///{DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['WTF_CSRF_ENABLED'] = True
+# Pool sizing matters for evented (gevent) workers, which run many requests
+# per process concurrently; see gunicorn.conf.py.
+if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('FITTRACK_DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv('FITTRACK_DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': int(os.getenv('FITTRACK_DB_POOL_TIMEOUT', '30')),
+    }
+
+# Optional sharding of workout tables across several databases, see backend/sharding.py
+from backend import sharding  # noqa: E402
+app.config['SQLALCHEMY_BINDS'] = sharding.bind_config(app.instance_path)
+
+db = SQLAlchemy(app, session_options={'class_': sharding.RoutingSession})
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers proceed while a writer holds the lock, and the busy
+    # timeout makes concurrent writers wait instead of failing immediately.
+    if isinstance(dbapi_conn, sqlite3.Connection):
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA busy_timeout=5000')
+        # SQLite ignores ON DELETE CASCADE unless foreign keys are enforced,
+        # which is off by default and has to be set on every connection
+        cur.execute('PRAGMA foreign_keys=ON')
+        cur.close()
+
+
+def rebuild_sqlite_tables(engine, tables):
+    """Recreate SQLite tables whose definition differs from `tables` in their constraints.
+
+    Covers foreign keys (e.g. missing ON DELETE CASCADE), the primary key
+    columns, AUTOINCREMENT (sqlite_autoincrement=True, so ids of deleted
+    rows are never handed out again) and the column sets that are unique
+    (an inline UNIQUE cannot be dropped). SQLite cannot alter those, so each
+    stale table is copied into a new one with the current definition, the
+    old one is dropped and the copy renamed; copied ids seed the
+    AUTOINCREMENT counter. Indexes and the triggers on the rebuilt tables
+    are recreated by the callers' usual schema setup. Returns the names of the rebuilt tables.
+    """
+    from sqlalchemy.schema import CreateTable, UniqueConstraint
+    if engine.dialect.name != 'sqlite':
+        return []
+    rebuilt = []
+    with engine.connect() as conn:
+        existing = {r[0]: r[1] or '' for r in conn.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table'")}
+        stale = []
+        for table in tables:
+            if table.name not in existing:
+                continue
+            have = {(r[2], r[3], r[6].upper()) for r in conn.exec_driver_sql(f'PRAGMA foreign_key_list("{table.name}")')}
+            want = {(fk.column.table.name, fk.parent.name, (fk.ondelete or 'NO ACTION').upper())
+                    for fk in table.foreign_keys}
+            info = list(conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")'))
+            have_pk = [r[1] for r in sorted((r for r in info if r[5]), key=lambda r: r[5])]
+            want_pk = [c.name for c in table.primary_key.columns]
+            autoincrement = bool(table.dialect_options['sqlite'].get('autoincrement'))
+            have_unique = {tuple(c[2] for c in conn.exec_driver_sql(f'PRAGMA index_info("{r[1]}")'))
+                           for r in conn.exec_driver_sql(f'PRAGMA index_list("{table.name}")')
+                           if r[2] and r[3] != 'pk'}
+            want_unique = ({tuple(c.name for c in u.columns) for u in table.constraints
+                            if isinstance(u, UniqueConstraint)}
+                           | {tuple(c.name for c in i.columns) for i in table.indexes if i.unique})
+            if (have != want or have_pk != want_pk or have_unique != want_unique
+                    or autoincrement != ('AUTOINCREMENT' in existing[table.name].upper())):
+                stale.append(table)
+        if not stale:
+            return []
+        # must be switched off outside a transaction, or dropping the old
+        # tables would cascade into their children; legacy renames leave
+        # triggers of other tables that name the rebuilt one alone
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.exec_driver_sql('PRAGMA legacy_alter_table=ON')
+        conn.commit()
+        try:
+            for table in stale:
+                tmp = f'_rebuild_{table.name}'
+                ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+                quoted = conn.dialect.identifier_preparer.format_table(table)
+                ddl = ddl.replace(f'CREATE TABLE {quoted} (', f'CREATE TABLE {tmp} (', 1)
+                # columns added to the model since are left to their defaults
+                present = {r[1] for r in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+                cols = ', '.join(f'"{c.name}"' for c in table.columns if c.name in present)
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS {tmp}')
+                conn.exec_driver_sql(ddl)
+                conn.exec_driver_sql(f'INSERT INTO {tmp} ({cols}) SELECT {cols} FROM "{table.name}"')
+                conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+                conn.exec_driver_sql(f'ALTER TABLE {tmp} RENAME TO "{table.name}"')
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+                rebuilt.append(table.name)
+            conn.commit()
+        finally:
+            conn.exec_driver_sql('PRAGMA legacy_alter_table=OFF')
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+    return rebuilt
+
+
+def reserve_ids(engine, floors):
+    """Make the id counters of {table: id} hand out only ids above it (ids still used elsewhere)."""
+    with engine.begin() as conn:
+        for table, floor in floors.items():
+            if not floor:
+                continue
+            if engine.dialect.name == 'sqlite':
+                if conn.exec_driver_sql('UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?',
+                                        (floor, table)).rowcount == 0:
+                    conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, floor))
+            elif engine.dialect.name == 'postgresql':
+                seq = conn.exec_driver_sql("SELECT pg_get_serial_sequence(%s, 'id')", (table,)).scalar()
+                conn.exec_driver_sql(f"SELECT setval('{seq}', GREATEST(%s, (SELECT last_value FROM {seq})))",
+                                     (int(floor),))
 
-db = SQLAlchemy(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -38,7 +155,25 @@ def _ensure_schema():
     try:
         from sqlalchemy import text
         with app.app_context():
+            fresh = not sa_inspect(db.engine).has_table('user')
             db.create_all()
+            if fresh:
+                # cached values are keyed by data versions, which start over
+                from backend.cache import cache
+                cache.clear()
+            # ON DELETE CASCADE, AUTOINCREMENT and unique columns for databases created before they were declared
+            from backend.models import RevokedToken, SetLog, User, Workout, WorkoutExercise, WorkoutSession
+            rebuilt = rebuild_sqlite_tables(db.engines[None], [User.__table__, Workout.__table__,
+                                                               WorkoutExercise.__table__, WorkoutSession.__table__,
+                                                               RevokedToken.__table__, SetLog.__table__])
+            if 'user' in rebuilt:
+                # ids of deleted accounts may have been handed out again before
+                from backend.cache import cache
+                cache.clear()
+            if 'workout' in rebuilt:
+                # the counter restarts at the highest hot id; archived ids may lie above it
+                from backend import archive
+                reserve_ids(db.engines[None], archive.max_ids())
             insp_cols = []
             try:
                 rows = db.session.execute(text("PRAGMA table_info(user)")).fetchall()
@@ -60,6 +195,14 @@ def _ensure_schema():
                 to_add.append("ALTER TABLE user ADD COLUMN height_cm FLOAT")
             if 'weight_kg' not in insp_cols:
                 to_add.append("ALTER TABLE user ADD COLUMN weight_kg FLOAT")
+            if 'data_version' not in insp_cols:
+                to_add.append("ALTER TABLE user ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0")
+            if 'history_version' not in insp_cols:
+                to_add.append("ALTER TABLE user ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0")
+            if 'shard' not in insp_cols:
+                to_add.append("ALTER TABLE user ADD COLUMN shard INTEGER")
+            if 'sync_floor' not in insp_cols:
+                to_add.append("ALTER TABLE user ADD COLUMN sync_floor INTEGER NOT NULL DEFAULT 0")
             for stmt in to_add:
                 try:
                     db.session.execute(text(stmt))
@@ -69,7 +212,41 @@ def _ensure_schema():
                 db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uix_user_email ON user(email)"))
             except Exception:
                 pass
+            for stmt in ("CREATE INDEX IF NOT EXISTS ix_workout_user_date ON workout(user_id, date)",
+                         "CREATE INDEX IF NOT EXISTS ix_workout_exercise_workout_id ON workout_exercise(workout_id)",
+                         "CREATE INDEX IF NOT EXISTS ix_set_log_user_workout ON set_log(user_id, workout_id, logged_at)",
+                         "CREATE UNIQUE INDEX IF NOT EXISTS uix_set_log_session_uid ON set_log(user_id, workout_id, uid)",
+                         "DROP INDEX IF EXISTS ix_set_log_workout_id"):
+                try:
+                    db.session.execute(text(stmt))
+                except Exception:
+                    pass
             db.session.commit()
+            if db.engine.dialect.name == 'postgresql':
+                # set uids used to be unique across the table, not per session
+                with db.engine.begin() as conn:
+                    conn.exec_driver_sql('ALTER TABLE set_log DROP CONSTRAINT IF EXISTS set_log_uid_key')
+            if sharding.enabled():
+                sharding.create_shard_tables()
+                sharding.pin_users()
+            # summary columns on workout + their triggers, see backend/summaries.py
+            try:
+                from backend.summaries import ensure_summaries
+                ensure_summaries()
+            except Exception:
+                db.session.rollback()
+            # Full-text search table + sync triggers (FTS5 / tsvector), see backend/search.py
+            try:
+                from backend.search import ensure_search_index
+                ensure_search_index()
+            except Exception:
+                db.session.rollback()
+            # one-off backfill of the materialized leaderboards, see backend/leaderboards.py
+            try:
+                from backend.leaderboards import ensure_backfilled
+                ensure_backfilled()
+            except Exception:
+                db.session.rollback()
     except Exception:
         pass
 
@@ -88,6 +265,32 @@ try:
 except Exception:
     pass
 
+# Bearer tokens as an alternative to the session cookie, see backend/tokens.py
+try:
+    from backend.tokens import init_app as init_tokens
+    init_tokens(app)
+except Exception:
+    pass
+
+# Offline stand-in OAuth provider (FITTRACK_OAUTH_PROVIDER=local), see backend/oauth_local.py
+if os.getenv('FITTRACK_OAUTH_PROVIDER', 'google') == 'local':
+    from backend.oauth_local import PREFIX, provider_bp
+    app.register_blueprint(provider_bp, url_prefix=PREFIX)
+
+# Negotiated gzip/brotli compression of large responses
+try:
+    from backend.compression import init_app as init_compression
+    init_compression(app)
+except Exception:
+    pass
+
+# Periodic online snapshots (FITTRACK_BACKUP_INTERVAL), see backend/backup.py
+try:
+    from backend.backup import init_app as init_backup
+    init_backup(app)
+except Exception:
+    pass
+
 # Add a simple root route so the server root is not 404.
 @app.route('/')
 def index():
@@ -99,46 +302,55 @@ def index():
 
 
 # --- Error logging -------------------------------------------------
-# Ensure instance path exists and add a file handler for error logging
+# Records go through a queue to a background listener (see backend/logs.py),
+# so logging never does file I/O on the request thread.
 try:
-    log_path = os.path.join(app.instance_path, 'error.log')
-    fh = logging.FileHandler(log_path)
-    fh.setLevel(logging.DEBUG)
-    fmt = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    fh.setFormatter(fmt)
-    logger = logging.getLogger('fittrack')
-    logger.setLevel(logging.DEBUG)
-    if not logger.handlers:
-        logger.addHandler(fh)
+    from backend.logs import setup_logging
+    logger = setup_logging(os.path.join(app.instance_path, 'error.log'))
 except Exception:
     logger = logging.getLogger('fittrack')
 
 
+@app.before_request
+def _start_request_timer():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _add_request_id(response):
+    rid = g.get('request_id')
+    if rid:
+        response.headers.setdefault('X-Request-ID', rid)
+    return response
+
+
+def _request_log_extra():
+    try:
+        start = g.get('request_start')
+        return {
+            'request_id': g.get('request_id'),
+            'latency_ms': round((time.perf_counter() - start) * 1000, 2) if start else None,
+            'method': request.method,
+            'path': request.path,
+        }
+    except Exception:
+        return {}
+
+
 @app.errorhandler(Exception)
 def handle_unhandled_exception(e):
-    """Log full traceback to instance/error.log and return minimal response.
+    """Log the full traceback to instance/error.log and return a minimal response.
 
     For API routes we return JSON {'ok': False, 'error': 'Internal Server Error'} to
-    keep the frontend from trying to parse HTML error pages. The full traceback is
-    saved to instance/error.log for inspection.
+    keep the frontend from trying to parse HTML error pages. The record is queued
+    together with the request id and latency; the listener thread writes it.
     """
-    tb = format_exc()
     try:
-        logger.exception('Unhandled exception: %s', str(e))
-        logger.debug(tb)
+        logger.error('Unhandled exception: %s', str(e), exc_info=True, extra=_request_log_extra())
     except Exception:
         pass
 
-    # Always append the full traceback to the instance error.log file as a fallback
-    try:
-        log_path = os.path.join(app.instance_path, 'error.log')
-        with open(log_path, 'a', encoding='utf-8') as fh:
-            fh.write(f"=== {datetime.datetime.utcnow().isoformat()} UTC ===\n")
-            fh.write(tb)
-            fh.write("\n\n")
-    except Exception:
-        # If we can't write to the file, silently continue — at least the logger above ran
-        pass
     # If request is an API call, return JSON
     try:
         if request.path.startswith('/api'):
@@ -0,0 +1,96 @@
+"""Aggregations over a user's training history.
+
+Each function issues a small, fixed number of grouped queries regardless of
+how many workouts the user has; results are cached by the callers in
+backend/api.py keyed on the user's data version (see backend/cache.py).
+"""
+import datetime
+
+from sqlalchemy import distinct, func
+
+from backend import archive, db
+from backend.downsample import downsample
+from backend.models import Workout, WorkoutExercise
+
+
+def exercise_volume():
+    """SQL expression for the training volume of one exercise row (sets x reps x kg)."""
+    return WorkoutExercise.sets * WorkoutExercise.reps * func.coalesce(WorkoutExercise.weight, 0)
+
+
+def calendar_year(user_id, year):
+    """Per-day workout count and volume for one year, from a single GROUP BY."""
+    start = datetime.date(year, 1, 1)
+    end = datetime.date(year + 1, 1, 1)
+    rows = (db.session.query(Workout.date,
+                             func.count(distinct(Workout.id)),
+                             func.coalesce(func.sum(exercise_volume()), 0))
+            .outerjoin(WorkoutExercise, WorkoutExercise.workout_id == Workout.id)
+            .filter(Workout.user_id == user_id, Workout.date >= start, Workout.date < end)
+            .group_by(Workout.date)
+            .order_by(Workout.date)
+            .all())
+    merged = {d: [n, float(v)] for d, n, v in rows}
+    for d, (n, v) in archive.day_stats(user_id, start, end).items():
+        day = merged.setdefault(d, [0, 0.0])
+        day[0] += n
+        day[1] += v
+    days = [{'date': d.isoformat(), 'workouts': n, 'volume': round(v, 1)} for d, (n, v) in sorted(merged.items())]
+    return {
+        'year': year,
+        'days': days,
+        'total_workouts': sum(d['workouts'] for d in days),
+        'total_volume': round(sum(d['volume'] for d in days), 1),
+        'active_days': len(days),
+    }
+
+
+PROGRESS_METRICS = ('weight', 'volume')
+
+
+def exercise_progress(user_id, name, metric):
+    """{date: value} over every training day of one exercise.
+
+    `weight` is the heaviest weight lifted that day (days without a weight
+    are left out), `volume` the day's sets x reps x kg.
+    """
+    agg = func.max(WorkoutExercise.weight) if metric == 'weight' else func.sum(exercise_volume())
+    rows = (db.session.query(Workout.date, agg)
+            .join(WorkoutExercise, WorkoutExercise.workout_id == Workout.id)
+            .filter(Workout.user_id == user_id, WorkoutExercise.name == name)
+            .group_by(Workout.date)
+            .all())
+    days = {d: float(v) for d, v in rows if v is not None}
+    for n, d, _eid, sets, reps, weight in archive.exercise_facts(user_id):
+        if n != name:
+            continue
+        if metric == 'weight':
+            if weight is not None:
+                days[d] = max(days.get(d, weight), weight)
+        else:
+            days[d] = days.get(d, 0.0) + (sets or 0) * (reps or 0) * (weight or 0)
+    return days
+
+
+def progress_series(user_id, name, metric, points):
+    """Progress of one exercise downsampled to at most `points` points (see backend/downsample.py).
+
+    Days that set a new record (and the lowest day) are always among them,
+    so the chart shows the true PRs even for a years-long history.
+    """
+    series = sorted(exercise_progress(user_id, name, metric).items())
+    prs, best = [], None
+    for i, (_d, v) in enumerate(series):
+        if best is None or v > best:
+            prs.append(i)
+            best = v
+    keep = prs + ([min(range(len(series)), key=lambda i: series[i][1])] if series else [])
+    chosen = downsample([(d.toordinal(), v) for d, v in series], points, keep)
+    pr_set = set(prs)
+    return {
+        'exercise': name,
+        'metric': metric,
+        'total': len(series),
+        'points': [{'date': series[i][0].isoformat(), 'value': round(series[i][1], 1), 'pr': i in pr_set}
+                   for i in chosen],
+    }
@@ -1,8 +1,15 @@
-from flask import Blueprint, jsonify, request, session, url_for, redirect
+from flask import Blueprint, jsonify, request, session, url_for, redirect, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from backend import db, app
-from backend.models import User, Workout, WorkoutExercise
+from backend.models import User, Workout, WorkoutExercise, WorkoutSession
+from backend.serialization import (json_response, workout_summaries, workout_page, workout_detail,
+                                   export_rows, iter_export_rows, admin_user_rows)
+from backend.search import search_workouts, MAX_PER_PAGE
+from backend.cache import bump_data_version, cache
+from backend.analytics import PROGRESS_METRICS, calendar_year, progress_series
+from backend.idempotency import idempotent
+from backend import archive, changes, events, leaderboards, setlog, sharding, streaks, tokens
 from flask_cors import CORS
 import datetime
 import os
@@ -10,10 +17,31 @@ import io
 import csv
 
 api_bp = Blueprint('api', __name__)
+MAX_BULK_IDS = 10000
+BULK_CHUNK = 500  # ids per IN (...) list
+MAX_WORKOUTS_PER_PAGE = 200
+PROGRESS_POINTS = 300  # default chart resolution
+MAX_PROGRESS_POINTS = 2000
 CORS(api_bp, supports_credentials=True, origins=['http://localhost:8501', 'http://127.0.0.1:8501'])
 
 
+@api_bp.after_request
+def _add_data_version(response):
+    """Tell the client the user's data version, so it can key its own cache on it.
+
+    After a mutation the user row was expired by the commit and is reloaded,
+    so the header carries the version including the write.
+    """
+    try:
+        if current_user.is_authenticated:
+            response.headers['X-Data-Version'] = str(current_user.data_version or 0)
+    except Exception:  # e.g. the account was just deleted
+        pass
+    return response
+
+
 @api_bp.route('/register', methods=['POST'])
+@idempotent
 def api_register():
     data = request.get_json() or {}
     username = data.get('username')
@@ -28,14 +56,13 @@ def api_register():
     return jsonify({'ok': True, 'message': 'registered successfully'})
 
 
-@api_bp.route('/login', methods=['POST'])
-def api_login():
-    data = request.get_json() or {}
+def _authenticate(data):
+    """(user, None) for valid credentials in the JSON body, else (None, error response)."""
     username = data.get('username')
     password = data.get('password')
     if not username or not password:
-        return jsonify({'ok': False, 'error': 'username and password required'}), 400
-    
+        return None, (jsonify({'ok': False, 'error': 'username and password required'}), 400)
+
     # Check for admin
     admin_password = os.getenv('ADMIN_PASSWORD', 'Admin&4')
     if username.lower() == 'admin' and password == admin_password:
@@ -44,19 +71,50 @@ def api_login():
             admin = User(username='admin', password=generate_password_hash(password, method='pbkdf2:sha256'))
             db.session.add(admin)
             db.session.commit()
-        login_user(admin)
-        return jsonify({'ok': True, 'message': 'logged in as admin', 'is_admin': True})
-    
+        return admin, None
+
     user = User.query.filter_by(username=username).first()
     if not user or not check_password_hash(user.password, password):
-        return jsonify({'ok': False, 'error': 'invalid credentials'}), 401
+        return None, (jsonify({'ok': False, 'error': 'invalid credentials'}), 401)
+    return user, None
+
+
+@api_bp.route('/login', methods=['POST'])
+def api_login():
+    user, error = _authenticate(request.get_json() or {})
+    if error:
+        return error
     login_user(user)
+    if user.username == 'admin':
+        return jsonify({'ok': True, 'message': 'logged in as admin', 'is_admin': True})
     return jsonify({'ok': True, 'message': 'logged in', 'is_admin': False})
 
 
+@api_bp.route('/token', methods=['POST'])
+def api_token():
+    """Bearer-token login: an access and a refresh token instead of the session cookie."""
+    user, error = _authenticate(request.get_json() or {})
+    if error:
+        return error
+    return jsonify(dict(tokens.issue(user), ok=True, is_admin=user.username == 'admin'))
+
+
+@api_bp.route('/token/refresh', methods=['POST'])
+def api_token_refresh():
+    token = (request.get_json() or {}).get('refresh_token')
+    if not token:
+        return jsonify({'ok': False, 'error': 'refresh_token required'}), 400
+    pair = tokens.refresh(token)
+    if pair is None:
+        return jsonify({'ok': False, 'error': 'invalid or expired refresh token'}), 401
+    return jsonify(dict(pair, ok=True))
+
+
 @api_bp.route('/logout', methods=['POST'])
 @login_required
 def api_logout():
+    if isinstance(current_user._get_current_object(), tokens.TokenUser):
+        tokens.revocations.add(family=current_user.family)
     logout_user()
     return jsonify({'ok': True, 'message': 'logged out'})
 
@@ -81,8 +139,48 @@ def api_me():
     }})
 
 
+@api_bp.route('/version', methods=['GET'])
+@login_required
+def api_version():
+    """The user's data version: a cheap check whether cached responses are still current."""
+    return jsonify({'ok': True, 'data_version': current_user.data_version or 0})
+
+
+@api_bp.route('/me', methods=['DELETE'])
+@login_required
+@idempotent
+def api_me_delete():
+    """Delete the account and all its data.
+
+    Requires the password; accounts created through OAuth confirm with their
+    username instead. Workouts, exercises and the per-user tables go with
+    ON DELETE CASCADE in the database.
+    """
+    data = request.get_json() or {}
+    if current_user.oauth_provider:
+        confirmed = data.get('confirm') == current_user.username
+    else:
+        confirmed = check_password_hash(current_user.password, data.get('password') or '')
+    if not confirmed:
+        return jsonify({'ok': False, 'error': 'invalid credentials'}), 401
+    uid = current_user.id
+    leaderboards.on_user_removed(uid)
+    setlog.on_user_removed(uid)
+    if sharding.enabled():
+        # the shard has no user row to cascade from
+        db.session.query(Workout).filter(Workout.user_id == uid).delete(synchronize_session=False)
+    user = db.session.get(User, uid)
+    logout_user()
+    db.session.delete(user)
+    db.session.commit()
+    tokens.revocations.add(user_id=uid)
+    archive.remove_user(uid)
+    return jsonify({'ok': True, 'message': 'account deleted'})
+
+
 @api_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def api_profile():
     """GET returns current profile fields. POST updates age/height/weight."""
     if request.method == 'GET':
@@ -122,27 +220,34 @@ def api_profile():
 @api_bp.route('/workouts', methods=['GET'])
 @login_required
 def api_workouts_list():
-    items = Workout.query.filter_by(user_id=current_user.id).order_by(Workout.date.desc()).all()
-    out = []
-    for w in items:
-        out.append({'id': w.id, 'date': w.date.isoformat(), 'note': w.note or '', 'exercise_count': len(w.exercises)})
-    return jsonify({'ok': True, 'workouts': out})
+    """All workouts newest first, or one page of them with `page` (and `per_page`)."""
+    if 'page' not in request.args:
+        out = [w.to_dict() for w in workout_summaries(current_user.id)]
+        return json_response({'ok': True, 'workouts': out})
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 50))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid page'}), 400
+    per_page = max(1, min(per_page, MAX_WORKOUTS_PER_PAGE))
+    page = max(1, page)
+    total, rows = workout_page(current_user.id, page, per_page)
+    return json_response({'ok': True, 'page': page, 'per_page': per_page, 'total': total,
+                          'workouts': [w.to_dict() for w in rows]})
 
 
 @api_bp.route('/workouts/<int:wid>', methods=['GET'])
 @login_required
 def api_workout_detail(wid):
-    w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
-    if not w:
+    workout = workout_detail(current_user.id, wid)
+    if workout is None:
         return jsonify({'ok': False, 'error': 'not found'}), 404
-    exercises = []
-    for e in w.exercises:
-        exercises.append({'id': e.id, 'name': e.name, 'sets': e.sets, 'reps': e.reps, 'weight': e.weight})
-    return jsonify({'ok': True, 'workout': {'id': w.id, 'date': w.date.isoformat(), 'note': w.note or '', 'exercises': exercises}})
+    return json_response({'ok': True, 'workout': workout})
 
 
 @api_bp.route('/workouts', methods=['POST'])
 @login_required
+@idempotent
 def api_workout_create():
     data = request.get_json() or {}
     date_s = data.get('date')
@@ -155,45 +260,131 @@ def api_workout_create():
     w = Workout(user_id=current_user.id, date=date_obj, note=note)
     db.session.add(w)
     db.session.flush()
+    added = []
     for ex in exercises:
-        name = ex.get('name')
-        sets = ex.get('sets', 3)
-        reps = ex.get('reps', 10)
-        weight = ex.get('weight')
-        db.session.add(WorkoutExercise(workout_id=w.id, name=name, sets=sets, reps=reps, weight=weight))
+        added.append(WorkoutExercise(workout_id=w.id, name=ex.get('name'), sets=ex.get('sets', 3),
+                                     reps=ex.get('reps', 10), weight=ex.get('weight')))
+    db.session.add_all(added)
+    db.session.flush()
+    streaks.on_workout_added(current_user.id, date_obj)
+    leaderboards.on_exercises_added(current_user.id, date_obj,
+                                    [(e.name, e.sets, e.reps, e.weight) for e in added], new_workout=True)
+    changes.record(current_user.id, [changes.workout_upsert(w.id)]
+                   + [changes.exercise_upsert(e.id, w.id) for e in added])
+    bump_data_version(current_user.id, date_obj)
     db.session.commit()
     return jsonify({'ok': True, 'id': w.id}), 201
 
 
+def _delete_workouts(user_id, wids=None, start=None, end=None):
+    """Delete the user's workouts by id list or date range (start <= date <= end) with set-based SQL.
+
+    Exercises go with ON DELETE CASCADE and archived matches are dropped from
+    the archive; the derived-data hooks run once for the whole set. Returns
+    the deleted ids, or None when the archive changed concurrently. The
+    caller commits.
+    """
+    cond = [Workout.user_id == user_id]
+    if wids is not None:
+        cond.append(Workout.id.in_(wids))
+    else:
+        cond += [Workout.date >= start, Workout.date <= end]
+    removed = {wid: (d, []) for wid, d in db.session.query(Workout.id, Workout.date).filter(*cond)}
+    hot = list(removed)
+    for i in range(0, len(hot), BULK_CHUNK):
+        chunk = hot[i:i + BULK_CHUNK]
+        rows = (db.session.query(WorkoutExercise.workout_id, WorkoutExercise.name, WorkoutExercise.sets,
+                                 WorkoutExercise.reps, WorkoutExercise.weight)
+                .filter(WorkoutExercise.workout_id.in_(chunk)))
+        for wid, *facts in rows:
+            removed[wid][1].append(tuple(facts))
+        db.session.query(Workout).filter(Workout.id.in_(chunk)).delete(synchronize_session=False)
+    if wids is not None:
+        missing = set(wids) - removed.keys()
+        archived = archive.discard(user_id, wids=missing) if missing else []
+    else:
+        archived = archive.discard(user_id, start=start, end=end)
+    if archived is None:
+        return None
+    gone = [(wid, d, ex) for wid, (d, ex) in removed.items()] + archived
+    if not gone:
+        return []
+    setlog.on_workouts_removed(user_id, [wid for wid, _, _ in gone])
+    streaks.on_workouts_removed(user_id, [d for _, d, _ in gone])
+    leaderboards.on_workouts_removed(user_id, [(d, ex) for _, d, ex in gone])
+    changes.record(user_id, [changes.workout_delete(wid) for wid, _, _ in gone])
+    bump_data_version(user_id, min(d for _, d, _ in gone))
+    return sorted(wid for wid, _, _ in gone)
+
+
 @api_bp.route('/workouts/<int:wid>', methods=['DELETE'])
 @login_required
+@idempotent
 def api_workout_delete(wid):
-    w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
-    if not w:
+    deleted = _delete_workouts(current_user.id, wids=[wid])
+    if deleted is None:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': 'conflict, try again'}), 409
+    if not deleted:
         return jsonify({'ok': False, 'error': 'not found'}), 404
-    db.session.delete(w)
     db.session.commit()
     return jsonify({'ok': True, 'message': 'deleted'})
 
 
+@api_bp.route('/workouts/bulk-delete', methods=['POST'])
+@login_required
+@idempotent
+def api_workouts_bulk_delete():
+    """Delete workouts by `ids` or by an inclusive `from`/`to` date range in one transaction."""
+    data = request.get_json() or {}
+    if 'ids' in data:
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return jsonify({'ok': False, 'error': 'ids must be a list of integers'}), 400
+        if len(ids) > MAX_BULK_IDS:
+            return jsonify({'ok': False, 'error': f'at most {MAX_BULK_IDS} ids'}), 400
+        deleted = _delete_workouts(current_user.id, wids=set(ids))
+    else:
+        try:
+            start = datetime.date.fromisoformat(data.get('from') or '')
+            end = datetime.date.fromisoformat(data.get('to') or '')
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'ids or from/to dates required'}), 400
+        if end < start:
+            return jsonify({'ok': False, 'error': 'from must not be after to'}), 400
+        deleted = _delete_workouts(current_user.id, start=start, end=end)
+    if deleted is None:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': 'conflict, try again'}), 409
+    db.session.commit()
+    return jsonify({'ok': True, 'deleted': len(deleted), 'ids': deleted})
+
+
 @api_bp.route('/exercises/<int:eid>', methods=['DELETE'])
 @login_required
+@idempotent
 def api_exercise_delete(eid):
     ex = WorkoutExercise.query.join(Workout).filter(Workout.user_id==current_user.id, WorkoutExercise.id==eid).first()
+    if not ex and archive.restore_exercise(current_user.id, eid):
+        ex = WorkoutExercise.query.join(Workout).filter(Workout.user_id==current_user.id, WorkoutExercise.id==eid).first()
     if not ex:
         return jsonify({'ok': False, 'error': 'not found'}), 404
     wid = ex.workout_id
+    wdate = ex.workout.date
+    removed = [(ex.name, ex.sets, ex.reps, ex.weight)]
     db.session.delete(ex)
+    db.session.flush()
+    leaderboards.on_exercises_removed(current_user.id, wdate, removed)
+    changes.record(current_user.id, [changes.exercise_delete(eid, wid), changes.workout_upsert(wid)])
+    bump_data_version(current_user.id, wdate)
     db.session.commit()
     return jsonify({'ok': True, 'workout_id': wid})
 
 
 @api_bp.route('/exercises/<int:wid>/add', methods=['POST'])
 @login_required
+@idempotent
 def api_exercise_add(wid):
-    w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
-    if not w:
-        return jsonify({'ok': False, 'error': 'workout not found'}), 404
     data = request.get_json() or {}
     name = data.get('name')
     sets = data.get('sets', 3)
@@ -201,12 +392,147 @@ def api_exercise_add(wid):
     weight = data.get('weight')
     if not name:
         return jsonify({'ok': False, 'error': 'name required'}), 400
+    w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
+    if not w and archive.restore(current_user.id, wid):
+        w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
+    if not w:
+        return jsonify({'ok': False, 'error': 'workout not found'}), 404
     ex = WorkoutExercise(workout_id=w.id, name=name, sets=sets, reps=reps, weight=weight)
     db.session.add(ex)
+    db.session.flush()
+    leaderboards.on_exercises_added(current_user.id, w.date, [(name, sets, reps, weight)])
+    changes.record(current_user.id, [changes.exercise_upsert(ex.id, w.id), changes.workout_upsert(w.id)])
+    bump_data_version(current_user.id, w.date)
     db.session.commit()
     return jsonify({'ok': True, 'id': ex.id}), 201
 
 
+@api_bp.route('/sessions', methods=['POST'])
+@login_required
+@idempotent
+def api_session_start():
+    """Start a live session: an empty workout whose sets are logged one by one (backend/setlog.py)."""
+    data = request.get_json() or {}
+    try:
+        date_obj = datetime.date.fromisoformat(data['date']) if data.get('date') else datetime.date.today()
+    except Exception:
+        return jsonify({'ok': False, 'error': 'invalid date'}), 400
+    w = Workout(user_id=current_user.id, date=date_obj, note=data.get('note'))
+    db.session.add(w)
+    db.session.flush()
+    db.session.add(WorkoutSession(workout_id=w.id, user_id=current_user.id))
+    streaks.on_workout_added(current_user.id, date_obj)
+    leaderboards.on_exercises_added(current_user.id, date_obj, [], new_workout=True)
+    changes.record(current_user.id, [changes.workout_upsert(w.id)])
+    bump_data_version(current_user.id, date_obj)
+    db.session.commit()
+    return jsonify({'ok': True, 'id': w.id}), 201
+
+
+def _live_session(wid):
+    """The user's WorkoutSession wid, or an error response."""
+    sess = db.session.get(WorkoutSession, (current_user.id, wid))
+    if sess is None:
+        return None, (jsonify({'ok': False, 'error': 'session not found'}), 404)
+    if sess.finished_at is not None:
+        return None, (jsonify({'ok': False, 'error': 'session already finished'}), 409)
+    return sess, None
+
+
+@api_bp.route('/sessions/<int:wid>/sets', methods=['POST'])
+@login_required
+def api_session_sets(wid):
+    """Log one set ({exercise, reps, weight, rpe, rest_s, id}) or {"sets": [...]}.
+
+    Answered with 202 once the sets are in this worker's write-ahead file;
+    they reach the database in batches. Resending a set with the same `id`
+    stores it once, so this endpoint needs no Idempotency-Key.
+    """
+    _, error = _live_session(wid)
+    if error:
+        return error
+    data = request.get_json() or {}
+    items = data['sets'] if isinstance(data.get('sets'), list) else [data]
+    if not items or len(items) > setlog.MAX_BATCH:
+        return jsonify({'ok': False, 'error': f'1-{setlog.MAX_BATCH} sets per request'}), 400
+    try:
+        rows = [setlog.parse_set(item if isinstance(item, dict) else {}, current_user.id, wid) for item in items]
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    setlog.buffer.append(rows)
+    return jsonify({'ok': True, 'ids': [r['uid'].hex() for r in rows]}), 202
+
+
+@api_bp.route('/sessions/<int:wid>', methods=['GET'])
+@login_required
+def api_session_detail(wid):
+    sess = db.session.get(WorkoutSession, (current_user.id, wid))
+    if sess is None:
+        return jsonify({'ok': False, 'error': 'session not found'}), 404
+    return json_response({'ok': True, 'id': wid, 'started_at': sess.started_at.isoformat(),
+                          'finished_at': sess.finished_at.isoformat() if sess.finished_at else None,
+                          'sets': [setlog.to_dict(r) for r in setlog.session_sets(current_user.id, wid)]})
+
+
+@api_bp.route('/sessions/<int:wid>/finish', methods=['POST'])
+@login_required
+@idempotent
+def api_session_finish(wid):
+    """Write all logged sets to the set log and add them to the workout as exercises."""
+    sess, error = _live_session(wid)
+    if error:
+        return error
+    w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
+    if not w and archive.restore(current_user.id, wid):
+        w = Workout.query.filter_by(id=wid, user_id=current_user.id).first()
+    if not w:
+        return jsonify({'ok': False, 'error': 'workout not found'}), 404
+    sets = setlog.session_sets(current_user.id, wid, flush=True)
+    added = [WorkoutExercise(workout_id=wid, name=name, sets=n, reps=reps, weight=weight)
+             for name, n, reps, weight in setlog.rollup(sets)]
+    db.session.add_all(added)
+    db.session.flush()
+    sess.finished_at = datetime.datetime.utcnow()
+    if added:
+        leaderboards.on_exercises_added(current_user.id, w.date, [(e.name, e.sets, e.reps, e.weight) for e in added])
+        changes.record(current_user.id, [changes.exercise_upsert(e.id, wid) for e in added]
+                       + [changes.workout_upsert(wid)])
+        bump_data_version(current_user.id, w.date)
+    db.session.commit()
+    return jsonify({'ok': True, 'sets': len(sets), 'exercises': len(added)})
+
+
+@api_bp.route('/sync', methods=['GET'])
+@login_required
+def api_sync():
+    """Workouts and exercises changed after `since` (a cursor from an earlier response).
+
+    `full: true` means the payload is a complete snapshot that replaces the
+    local copy; otherwise apply `workouts`/`exercises` as upserts and drop the
+    ids in `deleted` (a deleted workout takes its exercises with it). With
+    `more: true` call again with the new cursor. See backend/changes.py.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid cursor'}), 400
+    payload, cursor = changes.delta(current_user.id, since)
+    return json_response(dict(payload, ok=True, cursor=cursor))
+
+
+@api_bp.route('/events', methods=['GET'])
+@login_required
+def api_events():
+    """Server-sent events with the user's workout/exercise changes, see backend/events.py."""
+    last = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last = int(last) if last else None
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid Last-Event-ID'}), 400
+    return Response(stream_with_context(events.stream(current_user.id, last)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @api_bp.route('/catalog', methods=['GET'])
 @login_required
 def api_exercise_catalog():
@@ -225,26 +551,143 @@ def api_export_csv():
     cw = csv.writer(si)
     # Lokalizované hlavičky v češtině
     cw.writerow(['ID','Datum','Poznámka','Cvik','Série','Opakování','Váha (kg)'])
-    workouts = Workout.query.filter_by(user_id=current_user.id).all()
-    for w in workouts:
-        for e in w.exercises:
-            # Datum v českém formátu dd.mm.YYYY
-            cw.writerow([w.id, w.date.strftime('%d.%m.%Y'), w.note or '', e.name, e.sets, e.reps, e.weight or ''])
+    for wid, wdate, note, name, sets, reps, weight in export_rows(current_user.id):
+        # Datum v českém formátu dd.mm.YYYY
+        cw.writerow([wid, wdate.strftime('%d.%m.%Y'), note or '', name, sets, reps, weight or ''])
     output = si.getvalue()
-    return jsonify({'ok': True, 'csv': output})
+    return json_response({'ok': True, 'csv': output})
+
+
+@api_bp.route('/export/csv/stream', methods=['GET'])
+@login_required
+def api_export_csv_stream():
+    """Same CSV as /export/csv, streamed as text/csv in chunks instead of one JSON string."""
+    user_id = current_user.id
+
+    def generate():
+        si = io.StringIO()
+        cw = csv.writer(si)
+        cw.writerow(['ID','Datum','Poznámka','Cvik','Série','Opakování','Váha (kg)'])
+        for wid, wdate, note, name, sets, reps, weight in iter_export_rows(user_id):
+            cw.writerow([wid, wdate.strftime('%d.%m.%Y'), note or '', name, sets, reps, weight or ''])
+            if si.tell() >= 64 * 1024:
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate()
+        yield si.getvalue()
+
+    filename = f"fittrack_export_{datetime.date.today().isoformat()}.csv"
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@api_bp.route('/search', methods=['GET'])
+@login_required
+def api_search():
+    """Ranked full-text search over the user's workout notes and exercise names."""
+    q = (request.args.get('q') or '').strip()
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid page'}), 400
+    if not q:
+        return jsonify({'ok': False, 'error': 'q required'}), 400
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    total, hits = search_workouts(current_user.id, q, page=page, per_page=per_page)
+    return json_response({'ok': True, 'query': q, 'page': page, 'per_page': per_page,
+                          'total': total, 'results': hits})
 
 
 @api_bp.route('/stats', methods=['GET'])
 @login_required
 def api_stats():
-    recent = Workout.query.filter_by(user_id=current_user.id).order_by(Workout.date.desc()).limit(5).all()
-    total_workouts = Workout.query.filter_by(user_id=current_user.id).count()
-    total_exercises = sum(len(w.exercises) for w in recent)
-    return jsonify({'ok': True, 'stats': {'total_workouts': total_workouts, 'recent_exercises': total_exercises}})
+    # the streak metrics depend on today as well as on the data
+    key = ('stats', current_user.id, current_user.data_version, datetime.date.today())
+    return jsonify({'ok': True, 'stats': cache.get_or_compute(key, lambda: _stats(current_user.id))})
+
+
+def _stats(user_id):
+    recent = workout_summaries(user_id, limit=5)
+    total_exercises = sum(w.exercise_count for w in recent)
+    # streak/consistency metrics come from the incrementally maintained user_stats row
+    consistency = streaks.read_stats(user_id)
+    total_workouts = consistency.pop('total_workouts')
+    return {'total_workouts': total_workouts, 'recent_exercises': total_exercises, **consistency}
+
+
+@api_bp.route('/calendar', methods=['GET'])
+@login_required
+def api_calendar():
+    """Per-day workout count and volume for a whole year (heatmap data).
+
+    Cached per (user, year, data version); past years are keyed on the history
+    version instead, so they stay cached until a write touches an older date.
+    """
+    today = datetime.date.today()
+    try:
+        year = int(request.args.get('year', today.year))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid year'}), 400
+    if year < 1900 or year > today.year + 1:
+        return jsonify({'ok': False, 'error': 'invalid year'}), 400
+    if year < today.year:
+        key = ('calendar', current_user.id, year, 'h', current_user.history_version)
+    else:
+        key = ('calendar', current_user.id, year, 'd', current_user.data_version)
+    data = cache.get_or_compute(key, lambda: calendar_year(current_user.id, year))
+    return json_response({'ok': True, 'calendar': data})
+
+
+@api_bp.route('/progress', methods=['GET'])
+@login_required
+def api_progress():
+    """Per-day progress of one exercise (`metric` weight or volume), at most `points` points.
+
+    Long histories are downsampled server-side (LTTB) with every PR day kept;
+    cached per (user, exercise, metric, points, data version).
+    """
+    name = (request.args.get('exercise') or '').strip()
+    if not name:
+        return jsonify({'ok': False, 'error': 'exercise required'}), 400
+    metric = request.args.get('metric', 'weight')
+    if metric not in PROGRESS_METRICS:
+        return jsonify({'ok': False, 'error': 'invalid metric'}), 400
+    try:
+        points = int(request.args.get('points', PROGRESS_POINTS))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid points'}), 400
+    points = max(10, min(points, MAX_PROGRESS_POINTS))
+    key = ('progress', current_user.id, name, metric, points, current_user.data_version)
+    data = cache.get_or_compute(key, lambda: progress_series(current_user.id, name, metric, points))
+    return json_response({'ok': True, 'progress': data})
+
+
+@api_bp.route('/leaderboards', methods=['GET'])
+@login_required
+def api_leaderboards():
+    """Top K and the caller's rank for the requested boards (default: PRs and this month).
+
+    `board` may be repeated (e.g. board=volume:Dřep&board=workouts:2024-05).
+    Served from the materialized scores, see backend/leaderboards.py.
+    """
+    try:
+        k = int(request.args.get('k', leaderboards.TOP_K))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid k'}), 400
+    k = max(1, min(k, leaderboards.MAX_TOP_K))
+    boards = request.args.getlist('board') or leaderboards.default_boards()
+    if len(boards) > 20:
+        return jsonify({'ok': False, 'error': 'too many boards'}), 400
+    return json_response({'ok': True,
+                          'boards': [leaderboards.board_payload(b, current_user.id, k) for b in boards],
+                          'available': leaderboards.available_boards()})
 
 
 @api_bp.route('/quickstart/<level>', methods=['POST'])
 @login_required
+@idempotent
 def api_quickstart_level(level):
     level = level.lower()
     presets = {
@@ -259,8 +702,16 @@ def api_quickstart_level(level):
     db.session.add(w)
     db.session.flush()
     defaults = ['Dřep', 'Bench press', 'Veslování']
-    for name in defaults:
-        db.session.add(WorkoutExercise(workout_id=w.id, name=name, sets=cfg['sets'], reps=cfg['reps']))
+    added = [WorkoutExercise(workout_id=w.id, name=name, sets=cfg['sets'], reps=cfg['reps']) for name in defaults]
+    db.session.add_all(added)
+    db.session.flush()
+    streaks.on_workout_added(current_user.id, w.date)
+    leaderboards.on_exercises_added(current_user.id, w.date,
+                                    [(name, cfg['sets'], cfg['reps'], None) for name in defaults],
+                                    new_workout=True)
+    changes.record(current_user.id, [changes.workout_upsert(w.id)]
+                   + [changes.exercise_upsert(e.id, w.id) for e in added])
+    bump_data_version(current_user.id, w.date)
     db.session.commit()
     return jsonify({'ok': True, 'id': w.id})
 
@@ -270,18 +721,7 @@ def api_quickstart_level(level):
 def api_admin_users():
     if current_user.username != 'admin':
         return jsonify({'ok': False, 'error': 'unauthorized'}), 403
-    users = User.query.order_by(User.id.asc()).all()
-    data = []
-    for u in users:
-        data.append({
-            'id': u.id,
-            'username': u.username,
-            'email': u.email or '',
-            'oauth_provider': u.oauth_provider or '',
-            'created_at': u.created_at.isoformat() if u.created_at else '',
-            'workout_count': Workout.query.filter_by(user_id=u.id).count()
-        })
-    return jsonify({'ok': True, 'users': data})
+    return json_response({'ok': True, 'users': admin_user_rows()})
 
 
 @api_bp.route('/google/login', methods=['GET'])
@@ -292,8 +732,10 @@ def api_google_login():
         if not is_configured() or oauth is None:
             return jsonify({'ok': False, 'error': 'Google OAuth is not configured on the server.'}), 501
         redirect_uri = url_for('api.api_google_callback', _external=True)
-        auth_url = oauth.google.create_authorization_url(redirect_uri)
-        return jsonify({'ok': True, 'auth_url': auth_url[0], 'state': auth_url[1]})
+        rv = oauth.google.create_authorization_url(redirect_uri)
+        # state and nonce go to the session, where the callback checks them
+        oauth.google.save_authorize_data(redirect_uri=redirect_uri, **rv)
+        return jsonify({'ok': True, 'auth_url': rv['url'], 'state': rv['state']})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
 
@@ -0,0 +1,569 @@
+"""Cold storage for old workouts.
+
+`scripts/archive_workouts.py` moves workouts older than
+FITTRACK_ARCHIVE_AFTER_DAYS (default 730) out of the hot `workout` /
+`workout_exercise` tables into one compressed columnar file per user under
+instance/archive/<user id>/ (FITTRACK_ARCHIVE_DIR overrides the location).
+The `workout_archive` table records which file version is current and a few
+totals.
+
+File layout: a magic line, a JSON header and one zlib-compressed block per
+column. Integer columns are little-endian int64 (ids delta-encoded), weights
+float64 with NaN for missing values, exercise names dictionary-encoded and
+notes length-prefixed UTF-8. Readers decode only the columns they need, and
+decoded segments are kept in each worker's local cache keyed by (user, file
+version).
+
+Readers in serialization.py, analytics.py, streaks.py and leaderboards.py
+combine the hot rows with the segment, so list/detail/export/stats/calendar
+output does not change when workouts are archived. Archived workouts are not
+part of full-text search. Editing an archived workout (adding or deleting an
+exercise, deleting the workout) first restores it into the hot tables with
+its original ids, see `restore`.
+
+A new file version is written next to the old one and the index row is
+switched in the main database; a crash in between leaves either the old
+version current or a workout in both places, in which case the hot row wins
+and the next archive run drops the stale copy. That relies on ids being
+unique per user: workout ids come from AUTOINCREMENT counters, and where a
+counter starts over (table rebuild, move to another shard) `max_ids` makes
+it skip the archived ones.
+"""
+import array
+import bisect
+import datetime
+import json
+import os
+import shutil
+import struct
+import sys
+import zlib
+from collections import Counter
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from backend import app, db, sharding
+from backend.cache import local_cache
+from backend.models import Workout, WorkoutArchive, WorkoutExercise
+
+MAGIC = b'FTARCH1\n'
+ARCHIVE_DIR = os.getenv('FITTRACK_ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('FITTRACK_ARCHIVE_AFTER_DAYS', '730'))
+
+WORKOUT_COLUMNS = ('w_id', 'w_date', 'w_note')
+EXERCISE_COLUMNS = ('e_id', 'e_wid', 'e_name', 'e_sets', 'e_reps', 'e_weight')
+_KINDS = {'w_id': 'delta', 'w_date': 'int', 'w_note': 'str', 'e_id': 'int', 'e_wid': 'delta',
+          'e_name': 'dict', 'e_sets': 'int', 'e_reps': 'int', 'e_weight': 'float'}
+
+
+# --- column codecs -------------------------------------------------------
+
+def _le(a):
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_le(typecode, raw):
+    a = array.array(typecode)
+    a.frombytes(raw)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def _encode(kind, values):
+    if kind == 'int':
+        return _le(array.array('q', values))
+    if kind == 'delta':
+        prev, out = 0, array.array('q')
+        for v in values:
+            out.append(v - prev)
+            prev = v
+        return _le(out)
+    if kind == 'float':
+        return _le(array.array('d', (float('nan') if v is None else float(v) for v in values)))
+    if kind == 'dict':
+        vocab = sorted(set(values))
+        codes = {v: i for i, v in enumerate(vocab)}
+        head = json.dumps(vocab, ensure_ascii=False).encode('utf-8')
+        return struct.pack('<I', len(head)) + head + _le(array.array('I', (codes[v] for v in values)))
+    if kind == 'str':
+        parts = [None if v is None else v.encode('utf-8') for v in values]
+        lengths = array.array('i', (-1 if p is None else len(p) for p in parts))
+        return struct.pack('<I', len(parts)) + _le(lengths) + b''.join(p for p in parts if p)
+    raise ValueError(kind)
+
+
+def _decode(kind, raw):
+    if kind == 'int':
+        return _from_le('q', raw).tolist()
+    if kind == 'delta':
+        out, acc = [], 0
+        for d in _from_le('q', raw):
+            acc += d
+            out.append(acc)
+        return out
+    if kind == 'float':
+        return [None if v != v else v for v in _from_le('d', raw)]
+    if kind == 'dict':
+        (n,) = struct.unpack_from('<I', raw)
+        vocab = json.loads(raw[4:4 + n].decode('utf-8'))
+        return [vocab[c] for c in _from_le('I', raw[4 + n:])]
+    if kind == 'str':
+        (n,) = struct.unpack_from('<I', raw)
+        lengths = _from_le('i', raw[4:4 + 4 * n])
+        out, pos, blob = [], 0, raw[4 + 4 * n:]
+        for ln in lengths:
+            if ln < 0:
+                out.append(None)
+            else:
+                out.append(blob[pos:pos + ln].decode('utf-8'))
+                pos += ln
+        return out
+    raise ValueError(kind)
+
+
+def pack(workouts, exercises):
+    """Serialize workout/exercise dicts (hot-table column names) into archive bytes."""
+    workouts = sorted(workouts, key=lambda w: w['id'])
+    exercises = sorted(exercises, key=lambda e: (e['workout_id'], e['id']))
+    columns = {
+        'w_id': [w['id'] for w in workouts],
+        'w_date': [w['date'].toordinal() for w in workouts],
+        'w_note': [w['note'] for w in workouts],
+        'e_id': [e['id'] for e in exercises],
+        'e_wid': [e['workout_id'] for e in exercises],
+        'e_name': [e['name'] for e in exercises],
+        'e_sets': [e['sets'] for e in exercises],
+        'e_reps': [e['reps'] for e in exercises],
+        'e_weight': [e['weight'] for e in exercises],
+    }
+    blocks, header, offset = [], {}, 0
+    for name, values in columns.items():
+        block = zlib.compress(_encode(_KINDS[name], values), 6)
+        header[name] = [_KINDS[name], offset, len(block)]
+        blocks.append(block)
+        offset += len(block)
+    head = json.dumps({'columns': header, 'workouts': len(workouts), 'exercises': len(exercises)}).encode()
+    return MAGIC + struct.pack('<I', len(head)) + head + b''.join(blocks)
+
+
+class Segment:
+    """One user's archived workouts; columns are decoded on first access."""
+
+    def __init__(self, data):
+        if not data.startswith(MAGIC):
+            raise ValueError('not a FitTrack archive')
+        (n,) = struct.unpack_from('<I', data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self._header = json.loads(data[start:start + n])
+        self._data = data
+        self._base = start + n
+        self._cols = {}
+        self._sorted_dates = None
+
+    def col(self, name):
+        values = self._cols.get(name)
+        if values is None:
+            kind, offset, length = self._header['columns'][name]
+            raw = zlib.decompress(self._data[self._base + offset:self._base + offset + length])
+            values = self._cols[name] = _decode(kind, raw)
+        return values
+
+    def dates(self):
+        return [datetime.date.fromordinal(o) for o in self.col('w_date')]
+
+    def sorted_ordinals(self):
+        if self._sorted_dates is None:
+            self._sorted_dates = sorted(self.col('w_date'))
+        return self._sorted_dates
+
+    def workout_rows(self):
+        return [{'id': i, 'date': d, 'note': n}
+                for i, d, n in zip(self.col('w_id'), self.dates(), self.col('w_note'))]
+
+    def exercise_rows(self):
+        return [{'id': i, 'workout_id': w, 'name': n, 'sets': s, 'reps': r, 'weight': wt}
+                for i, w, n, s, r, wt in zip(*(self.col(c) for c in EXERCISE_COLUMNS))]
+
+
+# --- reading -------------------------------------------------------------
+
+def _path(user_id, version):
+    return os.path.join(ARCHIVE_DIR, str(int(user_id)), f'v{int(version)}.ftarch')
+
+
+def _read(user_id, version):
+    with open(_path(user_id, version), 'rb') as fh:
+        return Segment(fh.read())
+
+
+def segment(user_id):
+    """The user's current archive Segment, or None when nothing is archived."""
+    row = db.session.get(WorkoutArchive, user_id)
+    if row is None or not row.workouts:
+        return None
+    return local_cache.get_or_compute(('archive', user_id, row.version), lambda: _read(user_id, row.version))
+
+
+def _hot_overlap(user_id, seg):
+    """Archived ids that also exist in the hot table (the hot copy wins)."""
+    last = datetime.date.fromordinal(seg.sorted_ordinals()[-1])
+    hot = {r[0] for r in db.session.query(Workout.id).filter(Workout.user_id == user_id, Workout.date <= last)}
+    return hot & set(seg.col('w_id')) if hot else set()
+
+
+def _totals(seg):
+    """workout id -> (exercise_count, total_sets, total_volume, max_weight), like the hot summary columns."""
+    totals = {}
+    for wid, sets, reps, weight in zip(*(seg.col(c) for c in ('e_wid', 'e_sets', 'e_reps', 'e_weight'))):
+        n, s, v, m = totals.get(wid, (0, 0, 0.0, None))
+        totals[wid] = (n + 1, s + sets, v + sets * reps * (weight or 0.0),
+                       weight if m is None or (weight is not None and weight > m) else m)
+    return totals
+
+
+def summaries(user_id):
+    """(id, date, note, exercise_count, total_sets, total_volume, max_weight) for archived workouts,
+    excluding ids shadowed by hot rows."""
+    seg = segment(user_id)
+    if seg is None:
+        return []
+    shadow = _hot_overlap(user_id, seg)
+    totals = _totals(seg)
+    empty = (0, 0, 0.0, None)
+    return [(i, d, n) + totals.get(i, empty) for i, d, n in zip(seg.col('w_id'), seg.dates(), seg.col('w_note'))
+            if i not in shadow]
+
+
+def detail(user_id, wid):
+    """Detail payload in the shape of serialization.workout_detail, or None."""
+    seg = segment(user_id)
+    if seg is None:
+        return None
+    ids = seg.col('w_id')
+    pos = bisect.bisect_left(ids, wid)
+    if pos == len(ids) or ids[pos] != wid:
+        return None
+    exercises = [{'id': e['id'], 'name': e['name'], 'sets': e['sets'], 'reps': e['reps'], 'weight': e['weight']}
+                 for e in _exercises_of(seg, wid)]
+    return {'id': wid, 'date': datetime.date.fromordinal(seg.col('w_date')[pos]).isoformat(),
+            'note': seg.col('w_note')[pos] or '', 'exercises': exercises}
+
+
+def _exercises_of(seg, wid):
+    wids = seg.col('e_wid')
+    lo, hi = bisect.bisect_left(wids, wid), bisect.bisect_right(wids, wid)
+    return [{'id': seg.col('e_id')[i], 'workout_id': wid, 'name': seg.col('e_name')[i],
+             'sets': seg.col('e_sets')[i], 'reps': seg.col('e_reps')[i], 'weight': seg.col('e_weight')[i]}
+            for i in range(lo, hi)]
+
+
+def export_rows(user_id):
+    """(workout id, date, note, name, sets, reps, weight) tuples ordered by workout and exercise id."""
+    seg = segment(user_id)
+    if seg is None:
+        return []
+    shadow = _hot_overlap(user_id, seg)
+    head = {i: (d, n) for i, d, n in zip(seg.col('w_id'), seg.dates(), seg.col('w_note'))}
+    return [(w, head[w][0], head[w][1], n, s, r, wt)
+            for w, n, s, r, wt in zip(*(seg.col(c) for c in EXERCISE_COLUMNS[1:]))
+            if w not in shadow]
+
+
+def count_between(user_id, start, end):
+    """Archived workouts with start <= date < end."""
+    seg = segment(user_id)
+    if seg is None:
+        return 0
+    o = seg.sorted_ordinals()
+    return bisect.bisect_left(o, end.toordinal()) - bisect.bisect_left(o, start.toordinal())
+
+
+def dates_between(user_id, start, end):
+    seg = segment(user_id)
+    if seg is None:
+        return set()
+    o = seg.sorted_ordinals()
+    lo, hi = bisect.bisect_left(o, start.toordinal()), bisect.bisect_left(o, end.toordinal())
+    return {datetime.date.fromordinal(x) for x in o[lo:hi]}
+
+
+def first_date(user_id):
+    seg = segment(user_id)
+    return datetime.date.fromordinal(seg.sorted_ordinals()[0]) if seg is not None else None
+
+
+def date_counts(user_id):
+    """Counter {date: workouts} over the whole archive."""
+    seg = segment(user_id)
+    if seg is None:
+        return Counter()
+    return Counter(seg.dates())
+
+
+def day_stats(user_id, start, end):
+    """{date: [workouts, volume]} for archived workouts with start <= date < end."""
+    seg = segment(user_id)
+    out = {}
+    if seg is None:
+        return out
+    lo, hi = start.toordinal(), end.toordinal()
+    in_range = {i: o for i, o in zip(seg.col('w_id'), seg.col('w_date')) if lo <= o < hi}
+    if not in_range:
+        return out
+    for o in in_range.values():
+        day = out.setdefault(datetime.date.fromordinal(o), [0, 0.0])
+        day[0] += 1
+    for w, s, r, wt in zip(seg.col('e_wid'), seg.col('e_sets'), seg.col('e_reps'), seg.col('e_weight')):
+        o = in_range.get(w)
+        if o is not None:
+            out[datetime.date.fromordinal(o)][1] += (s or 0) * (r or 0) * (wt or 0)
+    return out
+
+
+def exercise_facts(user_id):
+    """(name, date, exercise id, sets, reps, weight) for every archived exercise."""
+    seg = segment(user_id)
+    if seg is None:
+        return []
+    dates = dict(zip(seg.col('w_id'), seg.dates()))
+    return [(n, dates[w], i, s, r, wt)
+            for i, w, n, s, r, wt in zip(*(seg.col(c) for c in EXERCISE_COLUMNS))]
+
+
+def max_ids(user_ids=None):
+    """{'workout': highest archived workout id, 'workout_exercise': highest exercise id}, of all
+    users or of `user_ids`; for reserve_ids() where an id counter does not know them."""
+    q = db.session.query(WorkoutArchive.user_id).filter(WorkoutArchive.workouts > 0)
+    if user_ids is not None:
+        q = q.filter(WorkoutArchive.user_id.in_(list(user_ids)))
+    wid = eid = 0
+    for (uid,) in q.all():
+        seg = segment(uid)
+        if seg is not None:
+            wid = max([wid] + list(seg.col('w_id')))
+            eid = max([eid] + list(seg.col('e_id')))
+    return {'workout': wid, 'workout_exercise': eid}
+
+
+def archived_counts():
+    """{user_id: archived workouts} from the index table."""
+    return dict(db.session.query(WorkoutArchive.user_id, WorkoutArchive.workouts)
+                .filter(WorkoutArchive.workouts > 0))
+
+
+# --- writing -------------------------------------------------------------
+
+def _write(user_id, version, workouts, exercises):
+    data = pack(workouts, exercises)
+    path = _path(user_id, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+def _written(user_id, version):
+    """Remember a version file written inside the caller's transaction; it is
+    removed again if that transaction rolls back instead of committing."""
+    path = _path(user_id, version)
+    st = os.stat(path)
+    db.session.info.setdefault('archive_written', []).append((path, st.st_ino, st.st_mtime_ns))
+
+
+@event.listens_for(Session, 'after_commit')
+def _keep_written(session):
+    session.info.pop('archive_written', None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_written(session, transaction):
+    if transaction.parent is not None:
+        return
+    for path, ino, mtime in session.info.pop('archive_written', ()):
+        try:
+            st = os.stat(path)
+            if (st.st_ino, st.st_mtime_ns) == (ino, mtime):  # not rewritten by a later writer
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _set_index(user_id, version, workouts, exercises, size):
+    row = db.session.get(WorkoutArchive, user_id)
+    if row is None:
+        row = WorkoutArchive(user_id=user_id)
+        db.session.add(row)
+    dates = [w['date'] for w in workouts]
+    row.version = version
+    row.workouts = len(workouts)
+    row.exercises = len(exercises)
+    row.first_date = min(dates) if dates else None
+    row.last_date = max(dates) if dates else None
+    row.size_bytes = size
+    row.updated_at = datetime.datetime.utcnow()
+
+
+def _claim_version(user_id, version):
+    """Compare-and-set the index version; False when another writer got there first."""
+    if version == 0:
+        return db.session.get(WorkoutArchive, user_id) is None
+    return db.session.execute(text(
+        'UPDATE workout_archive SET version = :new WHERE user_id = :uid AND version = :old'),
+        {'new': version + 1, 'uid': user_id, 'old': version}).rowcount == 1
+
+
+def remove_stale_files(user_id):
+    """Delete archive files of the user other than the current version."""
+    row = db.session.get(WorkoutArchive, user_id)
+    folder = os.path.join(ARCHIVE_DIR, str(int(user_id)))
+    if not os.path.isdir(folder):
+        return 0
+    keep = f'v{row.version}.ftarch' if row is not None else None
+    removed = 0
+    for name in os.listdir(folder):
+        if name != keep:
+            os.remove(os.path.join(folder, name))
+            removed += 1
+    return removed
+
+
+def archive_user(user_id, cutoff):
+    """Move the user's workouts dated before `cutoff` into the archive.
+
+    Returns the number of workouts moved, or None when the user wrote during
+    the run (the switch is a compare-and-set on user.data_version, like
+    sharding.move_user) and the run should be retried later.
+    """
+    wt, et = Workout.__table__, WorkoutExercise.__table__
+    version = db.session.execute(text('SELECT data_version FROM "user" WHERE id = :uid'),
+                                 {'uid': user_id}).scalar()
+    with sharding.use_user(user_id):
+        hot = [dict(r._mapping) for r in db.session.execute(
+            wt.select().where(wt.c.user_id == user_id, wt.c.date < cutoff))]
+        wids = [w['id'] for w in hot]
+        exercises = [dict(r._mapping) for r in db.session.execute(
+            et.select().where(et.c.workout_id.in_(wids)))] if wids else []
+    if not hot:
+        db.session.commit()
+        return 0
+    for w in hot:
+        w.pop('user_id')
+    seg = segment(user_id)
+    old_version = db.session.get(WorkoutArchive, user_id).version if seg is not None else 0
+    moved = set(wids)
+    workouts = hot + ([w for w in seg.workout_rows() if w['id'] not in moved] if seg else [])
+    all_ex = exercises + ([e for e in seg.exercise_rows() if e['workout_id'] not in moved] if seg else [])
+    size = _write(user_id, old_version + 1, workouts, all_ex)
+    switched = db.session.execute(text(
+        'UPDATE "user" SET data_version = data_version + 1 WHERE id = :uid AND data_version = :v'),
+        {'uid': user_id, 'v': version}).rowcount
+    if not switched or not _claim_version(user_id, old_version):
+        db.session.rollback()
+        os.remove(_path(user_id, old_version + 1))
+        return None
+    _set_index(user_id, old_version + 1, workouts, all_ex, size)
+    db.session.commit()
+    with sharding.use_user(user_id):
+        db.session.execute(et.delete().where(et.c.workout_id.in_(wids)))
+        db.session.execute(wt.delete().where(wt.c.id.in_(wids)))
+        db.session.commit()
+    remove_stale_files(user_id)
+    return len(wids)
+
+
+def restore(user_id, wid):
+    """Move one archived workout back into the hot tables (within the caller's transaction).
+
+    Returns True when the workout was archived and is now hot again; the
+    caller commits. Used before editing an archived workout. The new version
+    file is deleted again if the caller rolls back.
+    """
+    seg = segment(user_id)
+    if seg is None:
+        return False
+    ids = seg.col('w_id')
+    pos = bisect.bisect_left(ids, wid)
+    if pos == len(ids) or ids[pos] != wid:
+        return False
+    row = db.session.get(WorkoutArchive, user_id)
+    old_version = row.version
+    exercises = _exercises_of(seg, wid)
+    workouts = [w for w in seg.workout_rows() if w['id'] != wid]
+    rest = [e for e in seg.exercise_rows() if e['workout_id'] != wid]
+    size = _write(user_id, old_version + 1, workouts, rest)
+    if not _claim_version(user_id, old_version):
+        os.remove(_path(user_id, old_version + 1))
+        return False
+    _written(user_id, old_version + 1)
+    db.session.execute(Workout.__table__.insert(),
+                       [{'id': wid, 'user_id': user_id, 'date': datetime.date.fromordinal(seg.col('w_date')[pos]),
+                         'note': seg.col('w_note')[pos]}])
+    if exercises:
+        db.session.execute(WorkoutExercise.__table__.insert(), exercises)
+    db.session.refresh(row)
+    _set_index(user_id, old_version + 1, workouts, rest, size)
+    return True
+
+
+def restore_exercise(user_id, eid):
+    """restore() for the archived workout containing exercise `eid`."""
+    seg = segment(user_id)
+    if seg is None:
+        return False
+    for i, w in zip(seg.col('e_id'), seg.col('e_wid')):
+        if i == eid:
+            return restore(user_id, w)
+    return False
+
+
+def discard(user_id, wids=None, start=None, end=None):
+    """Drop archived workouts by id or by date (start <= date <= end) within the caller's transaction.
+
+    The set-based counterpart of restore() + delete for bulk deletes: the
+    segment is rewritten once. Returns [(id, date, [(name, sets, reps, weight), ...])]
+    for the removed workouts, or None when the archive changed concurrently;
+    the caller commits.
+    """
+    seg = segment(user_id)
+    if seg is None:
+        return []
+    wids = set(wids or ())
+    gone = {}
+    for i, d in zip(seg.col('w_id'), seg.dates()):
+        if i in wids or (start is not None and start <= d <= end):
+            gone[i] = (d, [])
+    if not gone:
+        return []
+    for e in seg.exercise_rows():
+        if e['workout_id'] in gone:
+            gone[e['workout_id']][1].append((e['name'], e['sets'], e['reps'], e['weight']))
+    row = db.session.get(WorkoutArchive, user_id)
+    old_version = row.version
+    workouts = [w for w in seg.workout_rows() if w['id'] not in gone]
+    rest = [e for e in seg.exercise_rows() if e['workout_id'] not in gone]
+    size = _write(user_id, old_version + 1, workouts, rest)
+    if not _claim_version(user_id, old_version):
+        os.remove(_path(user_id, old_version + 1))
+        return None
+    _written(user_id, old_version + 1)
+    db.session.refresh(row)
+    _set_index(user_id, old_version + 1, workouts, rest, size)
+    return [(i, d, ex) for i, (d, ex) in gone.items()]
+
+
+def remove_user(user_id):
+    """Delete all archive files of a user (after the account is gone)."""
+    shutil.rmtree(os.path.join(ARCHIVE_DIR, str(int(user_id))), ignore_errors=True)
+
+
+def default_cutoff(today=None):
+    return (today or datetime.date.today()) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+
@@ -0,0 +1,555 @@
+"""Online backups: throttled, incremental snapshots of the databases and the archive.
+
+Snapshots live in FITTRACK_BACKUP_DIR (default instance/backups):
+
+    snapshots/<UTC time>.json   manifest: every file with its size, sha256 and chunks
+    chunks/ab/ab12…             zlib-compressed pieces of FITTRACK_BACKUP_CHUNK_KB,
+                                named by the sha256 of their content
+
+A snapshot holds every database of the app (the main one and the shards)
+and the archive files of backend/archive.py. SQLite databases are copied
+with the online backup API, FITTRACK_BACKUP_STEP_PAGES pages per step with
+FITTRACK_BACKUP_PAUSE_MS between steps, from a connection that keeps one
+read transaction open for the whole copy. In WAL mode that pins a
+consistent snapshot: writers go on, and the copy never restarts because of
+them; only checkpoints wait for it, so the WAL grows while it runs.
+Postgres databases are dumped by `pg_dump --format=custom` under `nice`.
+Archive files are opened before the databases are copied and only the
+versions the copied index points to are stored, so an archive run during
+the copy cannot leave the two out of step; a restore refuses a snapshot
+whose database refers to archive files it does not hold.
+
+Chunks an earlier snapshot already stored are not written again, so a new
+snapshot costs the chunks that changed (and nothing for unchanged archive
+files). Only the newest FITTRACK_BACKUP_KEEP snapshots are kept; chunks no
+manifest references any more are deleted with them.
+
+`verify()` re-hashes the chunks and files of a snapshot, `deep=True` also
+runs `PRAGMA integrity_check` on the restored SQLite files. `restore()`
+writes a snapshot into a directory, or over the live files (stop the
+service first), see scripts/backup.py. In place it also makes sure nothing
+derived from the replaced history (cached aggregates, client sync cursors,
+ids, revoked tokens) matches the restored one.
+
+With FITTRACK_BACKUP_INTERVAL set, a thread in the app takes a snapshot
+every that many seconds. An flock on the backup directory lets one worker
+per host do it and keeps two snapshots (or a snapshot and a prune) from
+running at once.
+
+Configuration (environment):
+    FITTRACK_BACKUP_DIR         snapshot directory (default instance/backups)
+    FITTRACK_BACKUP_INTERVAL    seconds between automatic snapshots (default 0: off)
+    FITTRACK_BACKUP_KEEP        snapshots kept (default 7)
+    FITTRACK_BACKUP_STEP_PAGES  SQLite pages copied per step (default 256)
+    FITTRACK_BACKUP_PAUSE_MS    pause after each step and chunk (default 5)
+    FITTRACK_BACKUP_CHUNK_KB    chunk size (default 1024)
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+from backend import app, db
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run snapshots from one place only
+    fcntl = None
+
+BACKUP_DIR = os.getenv('FITTRACK_BACKUP_DIR') or os.path.join(app.instance_path, 'backups')
+INTERVAL = float(os.getenv('FITTRACK_BACKUP_INTERVAL', '0'))
+KEEP = int(os.getenv('FITTRACK_BACKUP_KEEP', '7'))
+STEP_PAGES = int(os.getenv('FITTRACK_BACKUP_STEP_PAGES', '256'))
+PAUSE = float(os.getenv('FITTRACK_BACKUP_PAUSE_MS', '5')) / 1000
+CHUNK = int(os.getenv('FITTRACK_BACKUP_CHUNK_KB', '1024')) * 1024
+
+logger = logging.getLogger('fittrack')
+
+
+class BackupError(Exception):
+    pass
+
+
+# --- chunk store ---------------------------------------------------------
+
+def _chunk_path(digest):
+    return os.path.join(BACKUP_DIR, 'chunks', digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def _store(fh, pause):
+    """Cut an open file into chunks and store the new ones: its manifest entry and the bytes written."""
+    whole = hashlib.sha256()
+    chunks, size, written = [], 0, 0
+    while True:
+        piece = fh.read(CHUNK)
+        if not piece:
+            break
+        whole.update(piece)
+        size += len(piece)
+        digest = hashlib.sha256(piece).hexdigest()
+        target = _chunk_path(digest)
+        if not os.path.exists(target):
+            data = zlib.compress(piece, 6)
+            _write_atomic(target, data)
+            written += len(data)
+        chunks.append(digest)
+        if pause:
+            time.sleep(pause)
+    return {'size': size, 'sha256': whole.hexdigest(), 'chunks': chunks}, written
+
+
+def _rebuild(entry, out_path):
+    """Write a file of a snapshot back from its chunks, checking every hash; returns problems."""
+    problems = []
+    whole = hashlib.sha256()
+    size = 0
+    with open(out_path, 'wb') as out:
+        for digest in entry['chunks']:
+            try:
+                with open(_chunk_path(digest), 'rb') as fh:
+                    piece = zlib.decompress(fh.read())
+            except (OSError, zlib.error) as e:
+                problems.append(f'chunk {digest}: {e}')
+                continue
+            if hashlib.sha256(piece).hexdigest() != digest:
+                problems.append(f'chunk {digest}: checksum mismatch')
+            whole.update(piece)
+            size += len(piece)
+            out.write(piece)
+    if not problems and (size != entry['size'] or whole.hexdigest() != entry['sha256']):
+        problems.append('file checksum mismatch')
+    return problems
+
+
+# --- sources -------------------------------------------------------------
+
+def _engines():
+    """[(name, engine)] of every database of the app, main first."""
+    with app.app_context():
+        engines = db.engines
+        return [('main' if key is None else str(key), engine)
+                for key, engine in sorted(engines.items(), key=lambda kv: (kv[0] is not None, str(kv[0])))]
+
+
+def _databases():
+    """[(name, engine url)] of every database of the app, main first."""
+    return [(name, engine.url) for name, engine in _engines()]
+
+
+def _copy_sqlite(src_path, out_path, step_pages, pause):
+    """Online copy of a live SQLite database at one point in time; see the module docstring."""
+    src = sqlite3.connect(src_path, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(out_path)
+    try:
+        src.execute('BEGIN')
+        src.execute('SELECT count(*) FROM sqlite_master').fetchone()  # starts the read transaction
+
+        def progress(status, remaining, total):
+            if pause and remaining:
+                time.sleep(pause)
+
+        src.backup(dst, pages=step_pages, progress=progress)
+        src.execute('COMMIT')
+        dst.execute('PRAGMA journal_mode=DELETE')  # a self-contained file, no -wal next to it
+        problem = dst.execute('PRAGMA quick_check').fetchone()[0]
+        if problem != 'ok':
+            raise BackupError(f'copy of {src_path} failed quick_check: {problem}')
+    finally:
+        src.close()
+        dst.close()
+
+
+def _pg_url(url):
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+def _dump_postgres(url, out_path):
+    cmd = ['pg_dump', '--format=custom', '--compress=0', f'--file={out_path}', _pg_url(url)]
+    if shutil.which('nice'):
+        cmd = ['nice', '-n', '19'] + cmd
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def _archive_files():
+    from backend.archive import ARCHIVE_DIR
+    for root, _dirs, files in os.walk(ARCHIVE_DIR):
+        for name in sorted(files):
+            if name.endswith('.ftarch'):
+                path = os.path.join(root, name)
+                yield 'archive/' + os.path.relpath(path, ARCHIVE_DIR).replace(os.sep, '/'), path
+
+
+def _archive_refs(sqlite_path):
+    """Archive files the `workout_archive` index of a main database copy points to."""
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        rows = conn.execute('SELECT user_id, version FROM workout_archive WHERE workouts > 0').fetchall()
+    except sqlite3.OperationalError:  # no archive table
+        rows = []
+    finally:
+        conn.close()
+    return {f'archive/{uid}/v{version}.ftarch' for uid, version in rows}
+
+
+# --- snapshots -----------------------------------------------------------
+
+class _Lock:
+    """flock on the backup directory; `acquired` is False when another process holds it."""
+
+    def __init__(self, wait=True):
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        self.fd = os.open(os.path.join(BACKUP_DIR, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        self.acquired = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except OSError:
+                self.acquired = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)  # releases the flock
+
+
+def snapshots():
+    """Manifest names, oldest first."""
+    folder = os.path.join(BACKUP_DIR, 'snapshots')
+    if not os.path.isdir(folder):
+        return []
+    return sorted(n[:-5] for n in os.listdir(folder) if n.endswith('.json'))
+
+
+def load(name):
+    path = os.path.join(BACKUP_DIR, 'snapshots', f'{name}.json')
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        raise BackupError(f'no snapshot {name}') from None
+
+
+def create_snapshot(step_pages=STEP_PAGES, pause=PAUSE, keep=KEEP, wait=True):
+    """Take a snapshot and prune old ones; returns its manifest, or None if another process is taking one."""
+    with _Lock(wait) as lock:
+        if not lock.acquired:
+            return None
+        started = time.time()
+        name = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        while name in snapshots():
+            name += 'x'
+        work = os.path.join(BACKUP_DIR, f'tmp-{os.getpid()}')
+        shutil.rmtree(work, ignore_errors=True)
+        os.makedirs(work)
+        files, written = {}, 0
+        # Archive files are immutable versions; the index in the main database
+        # names the current one. Every file is opened before the databases are
+        # copied, so a version the copy refers to stays readable even if the
+        # archiver replaces and deletes it meanwhile. Shards are copied before
+        # the main database: archive_user switches the index before deleting
+        # the hot rows, so a snapshot can hold a workout in both places (the
+        # hot row wins) but never in neither.
+        opened = {}
+        for fname, path in _archive_files():
+            try:
+                opened[fname] = (path, open(path, 'rb'))
+            except FileNotFoundError:
+                pass
+        refs = None
+        try:
+            for dbname, url in reversed(_databases()):
+                out = os.path.join(work, dbname)
+                if url.get_backend_name() == 'sqlite':
+                    if not url.database or url.database == ':memory:':
+                        continue
+                    _copy_sqlite(url.database, out, step_pages, pause)
+                    kind, target = 'sqlite', os.path.abspath(url.database)
+                elif url.get_backend_name() == 'postgresql':
+                    _dump_postgres(url, out)
+                    kind, target = 'pg_dump', url.render_as_string(hide_password=True)
+                else:
+                    raise BackupError(f'cannot back up {url.get_backend_name()} databases')
+                if dbname == 'main' and kind == 'sqlite':
+                    refs = _archive_refs(out)
+                with open(out, 'rb') as fh:
+                    entry, new = _store(fh, pause)
+                os.remove(out)
+                files[f'db/{dbname}.' + ('sqlite3' if kind == 'sqlite' else 'dump')] = dict(
+                    entry, kind=kind, target=target)
+                written += new
+            for fname, path in _archive_files():  # versions written during the copies
+                if fname not in opened:
+                    try:
+                        opened[fname] = (path, open(path, 'rb'))
+                    except FileNotFoundError:
+                        pass
+            # a Postgres dump cannot be queried here: keep every version
+            wanted = refs if refs is not None else set(opened)
+            missing = wanted - set(opened)
+            if missing:
+                raise BackupError(f'archive files replaced twice during the snapshot, try again: {sorted(missing)}')
+            for fname in sorted(wanted):
+                path, fh = opened[fname]
+                entry, new = _store(fh, pause)
+                files[fname] = dict(entry, kind='file', target=os.path.abspath(path))
+                written += new
+        finally:
+            for _, fh in opened.values():
+                fh.close()
+            shutil.rmtree(work, ignore_errors=True)
+        manifest = {'name': name, 'created': datetime.datetime.utcnow().isoformat() + 'Z',
+                    'seconds': round(time.time() - started, 3), 'bytes_written': written,
+                    'size': sum(f['size'] for f in files.values()), 'files': files}
+        _write_atomic(os.path.join(BACKUP_DIR, 'snapshots', f'{name}.json'),
+                      json.dumps(manifest, indent=1).encode('utf-8'))
+        _prune(keep)
+        return manifest
+
+
+def _prune(keep):
+    names = snapshots()
+    for name in names[:max(0, len(names) - keep)]:
+        os.remove(os.path.join(BACKUP_DIR, 'snapshots', f'{name}.json'))
+    live = set()
+    for name in snapshots():
+        for entry in load(name)['files'].values():
+            live.update(entry['chunks'])
+    removed = 0
+    chunk_root = os.path.join(BACKUP_DIR, 'chunks')
+    for root, _dirs, files in os.walk(chunk_root):
+        for digest in files:
+            if digest not in live:
+                os.remove(os.path.join(root, digest))
+                removed += 1
+    return removed
+
+
+def prune(keep=KEEP):
+    """Keep the newest `keep` snapshots and delete unreferenced chunks; returns the chunks removed."""
+    with _Lock():
+        return _prune(keep)
+
+
+def verify(name, deep=False):
+    """Problems found in a snapshot (empty list: every chunk and file checks out)."""
+    manifest = load(name)
+    problems = []
+    work = os.path.join(BACKUP_DIR, f'verify-{os.getpid()}')
+    os.makedirs(work, exist_ok=True)
+    try:
+        for fname, entry in manifest['files'].items():
+            out = os.path.join(work, 'file')
+            found = _rebuild(entry, out)
+            if not found and deep and entry['kind'] == 'sqlite':
+                conn = sqlite3.connect(out)
+                try:
+                    result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+                finally:
+                    conn.close()
+                if result != 'ok':
+                    found.append(f'integrity_check: {result}')
+            problems += [f'{fname}: {p}' for p in found]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return problems
+
+
+def restore(name, into=None):
+    """Write the files of a snapshot to directory `into`, or over the live files when it is None.
+
+    In place, every file is rebuilt and checked next to its target before
+    anything is replaced; replaced SQLite databases are kept as
+    <file>.before-restore. Postgres dumps are loaded with pg_restore --clean.
+    Afterwards the shared cache is cleared and versions, id counters, sync
+    floors and token revocations of the replaced databases are carried over
+    (`_after_restore`). Returns [(file, destination)].
+    """
+    manifest = load(name)
+    done, staged = [], []
+    for fname, entry in manifest['files'].items():
+        if into is not None:
+            dest = os.path.join(into, *fname.split('/'))
+        elif entry['kind'] == 'pg_dump':
+            dest = os.path.join(BACKUP_DIR, f'restore-{os.getpid()}-{fname.replace("/", "-")}')
+        else:
+            dest = entry['target']
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + '.restoring'
+        problems = _rebuild(entry, tmp)
+        if problems:
+            for path in [tmp] + [t for _, t, _, _ in staged]:
+                os.remove(path)
+            raise BackupError(f'{fname}: ' + '; '.join(problems))
+        staged.append((fname, tmp, dest, entry))
+    main = [t for f, t, _, e in staged if f == 'db/main.sqlite3']
+    missing = (_archive_refs(main[0]) - set(manifest['files'])) if main else set()
+    if missing:
+        for _, path, _, _ in staged:
+            os.remove(path)
+        raise BackupError(f'the archive does not match the database, missing {sorted(missing)}')
+    urls = {f'db/{n}.dump': u for n, u in _databases()} if into is None else {}
+    live = None
+    if into is None:
+        live = _live_state()
+        for _, engine in _engines():
+            engine.dispose()  # the live files are about to be replaced
+    for fname, tmp, dest, entry in staged:
+        if into is None and entry['kind'] == 'sqlite':
+            if os.path.exists(dest):
+                conn = sqlite3.connect(dest)
+                try:
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # the kept copy without its -wal
+                finally:
+                    conn.close()
+                os.replace(dest, dest + '.before-restore')
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(dest + suffix):
+                    os.remove(dest + suffix)
+        os.replace(tmp, dest)
+        if into is None and entry['kind'] == 'pg_dump':
+            if fname not in urls:
+                raise BackupError(f'{fname}: no such database configured')
+            try:
+                subprocess.run(['pg_restore', '--clean', '--if-exists', '--no-owner', '--single-transaction',
+                                f'--dbname={_pg_url(urls[fname])}', dest], check=True, capture_output=True)
+            finally:
+                os.remove(dest)
+            dest = entry['target']
+        done.append((fname, dest))
+    if live is not None:
+        _after_restore(live)
+    return done
+
+
+# --- what outlives a restore ------------------------------------------------
+#
+# Clients and caches keep values from the history a restore throws away:
+# data/history versions (shared cache keys, X-Data-Version), leaderboard
+# board versions, change-log cursors, ids handed out since the snapshot
+# (sessions and tokens carry user ids) and token revocations. They are read
+# from the live databases before anything is replaced and carried over so
+# none of them can match the restored history again.
+
+_VERSIONED = (('user', 'id', ('data_version', 'history_version')), ('leaderboard_board', 'board', ('version',)))
+
+
+def _counters(conn):
+    """{table: last id handed out} of the id counters of a database."""
+    if conn.dialect.name == 'sqlite':
+        has = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").first()
+        return dict(conn.exec_driver_sql('SELECT name, seq FROM sqlite_sequence').all()) if has else {}
+    out = {}
+    for name, in conn.exec_driver_sql(
+            "SELECT table_name FROM information_schema.columns WHERE column_name = 'id' "
+            "AND table_schema = current_schema()").all():
+        seq = conn.exec_driver_sql("SELECT pg_get_serial_sequence(%s, 'id')", (name,)).scalar()
+        if seq:
+            out[name] = conn.exec_driver_sql(f'SELECT last_value FROM {seq}').scalar()
+    return out
+
+
+def _live_state():
+    state = {'counters': {}, 'versions': {}, 'revoked': []}
+    for name, engine in _engines():
+        with engine.connect() as conn:
+            state['counters'][name] = _counters(conn)
+            if name != 'main':
+                continue
+            for table, key, cols in _VERSIONED:
+                rows = conn.exec_driver_sql(f'SELECT {key}, {", ".join(cols)} FROM "{table}"').all()
+                state['versions'][table] = {r[0]: r[1:] for r in rows}
+            state['revoked'] = [dict(r._mapping) for r in conn.exec_driver_sql(
+                'SELECT family, user_id, not_before, expires_at FROM revoked_token WHERE expires_at > %d'
+                % int(time.time()))]
+    return state
+
+
+def _after_restore(live):
+    """Carry the live state read before a restore in place over to the restored databases."""
+    from sqlalchemy import text
+    from backend import reserve_ids
+    from backend.cache import cache
+    engines = dict(_engines())
+    for name, counters in live['counters'].items():
+        reserve_ids(engines[name], counters)
+    with engines['main'].begin() as conn:
+        for table, key, cols in _VERSIONED:
+            old = live['versions'].get(table, {})
+            for row in conn.execute(text(f'SELECT {key}, {", ".join(cols)} FROM "{table}"')).all():
+                before = old.get(row[0], (0,) * len(cols))
+                conn.execute(text(f'UPDATE "{table}" SET ' + ', '.join(f'{c} = :v{i}' for i, c in enumerate(cols))
+                                  + f' WHERE {key} = :k'),
+                             dict({f'v{i}': max(now or 0, was or 0) + 1 for i, (now, was) in
+                                   enumerate(zip(row[1:], before))}, k=row[0]))
+        # cursors clients hold may lie beyond the restored log: full snapshot for everyone
+        floor = live['counters'].get('main', {}).get('change_log', 0)
+        conn.execute(text('UPDATE "user" SET sync_floor = :c WHERE sync_floor < :c'), {'c': floor})
+        if live['revoked']:
+            conn.execute(text('INSERT INTO revoked_token (family, user_id, not_before, expires_at) '
+                              'VALUES (:family, :user_id, :not_before, :expires_at)'), live['revoked'])
+    cache.clear()
+
+
+# --- scheduler -----------------------------------------------------------
+
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def _due():
+    names = snapshots()
+    if not names:
+        return 0.0
+    try:
+        created = datetime.datetime.fromisoformat(load(names[-1])['created'].rstrip('Z'))
+    except (BackupError, ValueError, KeyError):
+        return 0.0
+    age = (datetime.datetime.utcnow() - created).total_seconds()
+    return max(0.0, INTERVAL - age)
+
+
+def _run_scheduler():
+    while True:
+        time.sleep(max(1.0, _due()))
+        if _due() > 0:  # another worker took one meanwhile
+            continue
+        try:
+            manifest = create_snapshot(wait=False)
+            if manifest is not None:
+                logger.info('backup %s: %d bytes in %.1fs, %d new', manifest['name'], manifest['size'],
+                            manifest['seconds'], manifest['bytes_written'])
+        except Exception:
+            logger.exception('backup failed')
+            time.sleep(min(INTERVAL, 300))
+
+
+def _ensure_scheduler():
+    global _scheduler_pid
+    if _scheduler_pid == os.getpid():
+        return
+    with _scheduler_lock:
+        if _scheduler_pid != os.getpid():
+            # started on the first request of each process: threads do not survive gunicorn's fork
+            threading.Thread(target=_run_scheduler, name='backup', daemon=True).start()
+            _scheduler_pid = os.getpid()
+
+
+def init_app(app):
+    if INTERVAL > 0:
+        app.before_request(_ensure_scheduler)
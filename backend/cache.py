@@ -0,0 +1,99 @@
+"""Per-user data versions and the cache for derived data.
+
+Every mutation endpoint calls `bump_data_version(user_id, touched_date)` in
+the same transaction as the write. `User.data_version` therefore changes
+whenever anything about the user's workouts changes, and cached aggregates
+keyed by it can never be served stale, in any worker. `User.history_version`
+only changes when a write touches a date before the current year, which lets
+past-year aggregates be cached indefinitely.
+
+`cache` holds such aggregates (calendar, progress, stats, leaderboards). It
+is shared by the workers of the host (backend/shared_cache.py) unless
+FITTRACK_CACHE_BACKEND=local, which gives every process its own LRUCache.
+`local_cache` is always per process, for values that are large or cheap to
+rebuild locally (decoded archive segments). FITTRACK_CACHE_SIZE caps the
+entries of both.
+"""
+import datetime
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from backend import db
+
+
+def bump_data_version(user_id, touched_date=None):
+    """Increment the user's data version (and history version for past-year dates).
+
+    Runs as a plain UPDATE inside the caller's transaction; the caller commits.
+    """
+    past = touched_date is not None and touched_date.year < datetime.date.today().year
+    if past:
+        stmt = ('UPDATE "user" SET data_version = COALESCE(data_version, 0) + 1, '
+                'history_version = COALESCE(history_version, 0) + 1 WHERE id = :uid')
+    else:
+        stmt = 'UPDATE "user" SET data_version = COALESCE(data_version, 0) + 1 WHERE id = :uid'
+    db.session.execute(text(stmt), {'uid': user_id})
+
+
+def get_versions(user_id):
+    """Return (data_version, history_version) straight from the database."""
+    row = db.session.execute(
+        text('SELECT COALESCE(data_version, 0), COALESCE(history_version, 0) FROM "user" WHERE id = :uid'),
+        {'uid': user_id}).first()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with a size cap."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_MISSING = object()
+
+CACHE_SIZE = int(os.getenv('FITTRACK_CACHE_SIZE', '1024'))
+CACHE_BACKEND = os.getenv('FITTRACK_CACHE_BACKEND', 'shared').lower()
+
+local_cache = LRUCache(CACHE_SIZE)
+if CACHE_BACKEND == 'shared':
+    from backend.shared_cache import SharedCache
+    cache = SharedCache(max_entries=CACHE_SIZE)
+else:
+    cache = local_cache
@@ -0,0 +1,152 @@
+"""Per-user change log and delta sync.
+
+Mutation endpoints call `record()` in the same transaction as the write. Each
+entry says that a workout or exercise was upserted or deleted; the log id is
+the sync cursor. `/api/sync?since=<cursor>` collapses the entries after the
+cursor to one final operation per entity and returns the current rows for
+upserts and tombstones for deletes, so a client that keeps a local copy only
+downloads what changed.
+
+A cursor of 0, a cursor at or below `user.sync_floor` (entries were pruned
+or ids changed, e.g. by a shard move) or a cursor from another database gets
+a full snapshot instead.
+
+Cursor order must match commit order per user. SQLite serializes writers,
+and on Postgres `record()` takes a per-user transaction advisory lock so two
+concurrent writes of the same user cannot commit out of id order.
+"""
+import datetime
+import os
+
+from sqlalchemy import func, text
+
+from backend import archive, db
+from backend.models import ChangeLog, User, Workout, WorkoutExercise
+from backend.serialization import SUMMARY_COLUMNS, WorkoutSummary, workout_summaries
+
+MAX_CHANGES = int(os.getenv('FITTRACK_SYNC_MAX_CHANGES', '5000'))
+RETENTION_DAYS = int(os.getenv('FITTRACK_SYNC_RETENTION_DAYS', '30'))
+
+
+def record(user_id, entries):
+    """Log [(entity, entity_id, op, workout_id), ...] for the user; the caller commits."""
+    if not entries:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:k)'), {'k': user_id})
+    now = datetime.datetime.utcnow()
+    db.session.execute(ChangeLog.__table__.insert(), [
+        {'user_id': user_id, 'entity': entity, 'entity_id': eid, 'op': op, 'workout_id': wid, 'created_at': now}
+        for entity, eid, op, wid in entries])
+
+
+def workout_upsert(workout_id):
+    return ('workout', workout_id, 'upsert', workout_id)
+
+
+def workout_delete(workout_id):
+    return ('workout', workout_id, 'delete', workout_id)
+
+
+def exercise_upsert(exercise_id, workout_id):
+    return ('exercise', exercise_id, 'upsert', workout_id)
+
+
+def exercise_delete(exercise_id, workout_id):
+    return ('exercise', exercise_id, 'delete', workout_id)
+
+
+def latest_cursor(user_id):
+    return db.session.query(func.max(ChangeLog.id)).filter(ChangeLog.user_id == user_id).scalar() or 0
+
+
+def _exercise_rows(user_id, workout_ids=None, exercise_ids=None):
+    q = (db.session.query(WorkoutExercise.id, WorkoutExercise.workout_id, WorkoutExercise.name,
+                          WorkoutExercise.sets, WorkoutExercise.reps, WorkoutExercise.weight)
+         .join(Workout, Workout.id == WorkoutExercise.workout_id)
+         .filter(Workout.user_id == user_id))
+    if workout_ids is not None:
+        q = q.filter(WorkoutExercise.workout_id.in_(workout_ids))
+    if exercise_ids is not None:
+        q = q.filter(WorkoutExercise.id.in_(exercise_ids))
+    return [{'id': i, 'workout_id': w, 'name': n, 'sets': s, 'reps': r, 'weight': wt}
+            for i, w, n, s, r, wt in q.order_by(WorkoutExercise.id)]
+
+
+def snapshot(user_id):
+    """Full state: every workout summary and exercise of the user (hot and archived)."""
+    workouts = [w.to_dict() for w in workout_summaries(user_id)]
+    exercises = _exercise_rows(user_id)
+    seg = archive.segment(user_id)
+    if seg is not None:
+        hot = {e['id'] for e in exercises}
+        exercises += [e for e in seg.exercise_rows() if e['id'] not in hot]
+    return {'full': True, 'workouts': workouts, 'exercises': exercises,
+            'deleted': {'workouts': [], 'exercises': []}}
+
+
+def _archived(user_id, wids, eids):
+    """Workouts and exercises among the ids that were archived since they were logged."""
+    seg = archive.segment(user_id)
+    if seg is None:
+        return [], []
+    workouts = [WorkoutSummary(*row).to_dict() for row in archive.summaries(user_id) if row[0] in wids]
+    exercises = [e for e in seg.exercise_rows() if e['id'] in eids] if eids else []
+    return workouts, exercises
+
+
+def delta(user_id, since):
+    """Changes after cursor `since`: ({payload}, new cursor)."""
+    floor, = db.session.query(User.sync_floor).filter(User.id == user_id).one()
+    latest = latest_cursor(user_id)
+    if since <= 0 or since <= (floor or 0) or since > latest:
+        return dict(snapshot(user_id), more=False), latest
+    rows = (db.session.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+            .filter(ChangeLog.user_id == user_id, ChangeLog.id > since)
+            .order_by(ChangeLog.id).limit(MAX_CHANGES + 1).all())
+    more = len(rows) > MAX_CHANGES
+    rows = rows[:MAX_CHANGES]
+    cursor = rows[-1][0] if rows else since
+    final = {}
+    for _id, entity, eid, op in rows:
+        final[(entity, eid)] = op
+    up_w = [eid for (entity, eid), op in final.items() if entity == 'workout' and op == 'upsert']
+    up_e = [eid for (entity, eid), op in final.items() if entity == 'exercise' and op == 'upsert']
+    del_w = {eid for (entity, eid), op in final.items() if entity == 'workout' and op == 'delete'}
+    del_e = {eid for (entity, eid), op in final.items() if entity == 'exercise' and op == 'delete'}
+
+    workouts = []
+    if up_w:
+        workouts = [WorkoutSummary(*row).to_dict() for row in db.session.query(*SUMMARY_COLUMNS)
+                    .filter(Workout.user_id == user_id, Workout.id.in_(up_w))]
+    exercises = _exercise_rows(user_id, exercise_ids=up_e) if up_e else []
+    missing_w = set(up_w) - {w['id'] for w in workouts}
+    missing_e = set(up_e) - {e['id'] for e in exercises}
+    if missing_w or missing_e:
+        found_w, found_e = _archived(user_id, missing_w, missing_e)
+        workouts += found_w
+        exercises += found_e
+        # whatever is in neither place was deleted after the logged upsert
+        del_w |= missing_w - {w['id'] for w in found_w}
+        del_e |= missing_e - {e['id'] for e in found_e}
+    return {'full': False, 'more': more, 'workouts': workouts, 'exercises': exercises,
+            'deleted': {'workouts': sorted(del_w), 'exercises': sorted(del_e)}}, cursor
+
+
+def invalidate(user_id):
+    """Force the user's clients to resync from a snapshot (ids changed outside the log)."""
+    db.session.execute(text('UPDATE "user" SET sync_floor = :c WHERE id = :uid'),
+                       {'c': latest_cursor(user_id), 'uid': user_id})
+
+
+def prune(days=RETENTION_DAYS):
+    """Delete entries older than `days`, raising each affected user's sync floor."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    floors = (db.session.query(ChangeLog.user_id, func.max(ChangeLog.id))
+              .filter(ChangeLog.created_at < cutoff).group_by(ChangeLog.user_id).all())
+    for uid, top in floors:
+        db.session.execute(text('UPDATE "user" SET sync_floor = :c WHERE id = :uid AND sync_floor < :c'),
+                           {'c': top, 'uid': uid})
+    deleted = db.session.query(ChangeLog).filter(ChangeLog.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
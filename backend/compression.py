@@ -0,0 +1,95 @@
+"""Accept-Encoding negotiated response compression.
+
+Workout lists, exports and admin listings are plain JSON/CSV and shrink 5-10x
+with gzip. nginx (deploy/nginx.conf) passes proxied responses through as-is,
+so compression happens here: brotli when the `brotli` package is installed
+and the client accepts `br`, otherwise gzip. Bodies below the size threshold
+are left alone because the header overhead and CPU cost aren't worth it.
+Streamed responses (e.g. /api/export/csv/stream) are compressed chunk by
+chunk with a sync flush so the client still receives data incrementally.
+
+Configuration (environment):
+    FITTRACK_COMPRESS            '0' disables compression entirely
+    FITTRACK_COMPRESS_MIN_BYTES  minimum body size to compress (default 1024)
+    FITTRACK_GZIP_LEVEL          zlib level 1-9 (default 6)
+    FITTRACK_BROTLI_QUALITY      brotli quality 0-11 (default 4)
+"""
+import os
+import zlib
+
+try:
+    import brotli
+except Exception:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/csv', 'text/html', 'text/plain', 'text/css',
+                      'application/javascript', 'text/event-stream'}
+
+ENABLED = os.getenv('FITTRACK_COMPRESS', '1') != '0'
+MIN_BYTES = int(os.getenv('FITTRACK_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('FITTRACK_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('FITTRACK_BROTLI_QUALITY', '4'))
+
+
+def choose_encoding(accept_encodings):
+    """Pick 'br', 'gzip' or None from a werkzeug Accept object."""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    compressor = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of str/bytes chunks, flushing after each one."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = c.process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk) + c.flush()
+            if out:
+                yield out
+        yield c.finish()
+    else:
+        c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            out = c.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk) + c.flush(zlib.Z_SYNC_FLUSH)
+            if out:
+                yield out
+        yield c.flush()
+
+
+def compress_response(response):
+    from flask import request
+    if not ENABLED or request.method == 'HEAD':
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    if response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_BYTES:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
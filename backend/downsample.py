@@ -0,0 +1,68 @@
+"""Shape-preserving downsampling of chart series.
+
+Largest-Triangle-Three-Buckets (Steinarsson 2013): the first and last points
+stay, the rest is cut into equal buckets and from each bucket the point
+forming the largest triangle with the previously chosen point and the
+average of the next bucket is kept. Peaks and dips survive, flat stretches
+collapse, and a 5-year daily series fits a chart of a few hundred points.
+
+`downsample()` also keeps points the caller marks as must-keep (personal
+records): LTTB runs with the remaining budget and the kept points are merged
+back in. When there are more of them than the target, they are downsampled
+among themselves, still keeping the highest one.
+
+Plain Python in one pass over the points; the series here are at most a few
+thousand per-day points, so this stays in the low milliseconds.
+"""
+
+
+def lttb(points, threshold):
+    """Indices of `threshold` points of [(x, y), ...] (sorted by x) chosen by LTTB."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n)) if threshold >= n else [0, n - 1][:max(threshold, 0)]
+    every = (n - 2) / (threshold - 2)
+    chosen = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket (the last point for the final bucket)
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        if nxt_start >= nxt_end:
+            nxt_start, nxt_end = n - 1, n
+        span = nxt_end - nxt_start
+        avg_x = sum(points[j][0] for j in range(nxt_start, nxt_end)) / span
+        avg_y = sum(points[j][1] for j in range(nxt_start, nxt_end)) / span
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        chosen.append(best)
+        a = best
+    chosen.append(n - 1)
+    return chosen
+
+
+def downsample(points, target, keep=()):
+    """Ascending indices of at most `target` points, including the `keep` indices.
+
+    With too many `keep` indices for the target, those are thinned out by
+    LTTB among themselves instead; the one with the largest y always stays.
+    """
+    n = len(points)
+    if n <= target:
+        return list(range(n))
+    keep = sorted(set(keep))
+    free = target - len(keep)
+    if not keep or free >= 3:
+        return sorted(set(lttb(points, free)).union(keep))
+    picked = {keep[j] for j in lttb([points[i] for i in keep], target)}
+    top = max(keep, key=lambda i: points[i][1])
+    if top not in picked:
+        # swap it for the picked point next to it
+        picked.discard(min(picked, key=lambda i: abs(i - top)))
+        picked.add(top)
+    return sorted(picked)
@@ -0,0 +1,182 @@
+"""Server-sent events: live change notifications per user.
+
+`/api/events` keeps a `text/event-stream` response open and pushes one event
+per change-log entry of the logged-in user (see backend/changes.py), e.g.
+
+    id: 1234
+    event: workout.upsert
+    data: {"entity": "workout", "id": 57, "op": "upsert", "workout_id": 57}
+
+The change log is the pub/sub channel between gunicorn workers: every write
+goes through the shared database, so one tailer thread per worker polls
+`change_log` for new ids and hands the rows to the local subscribers of that
+user. Idle streams get a comment line every FITTRACK_EVENTS_HEARTBEAT
+seconds so proxies keep the connection open and dead clients are noticed.
+A reconnecting client sends `Last-Event-ID` (EventSource does it by itself)
+and first receives the entries it missed; if those were already pruned it
+gets an `event: reset` and should resync from scratch.
+
+Each open stream holds a thread on gthread/sync workers, so streams end after
+FITTRACK_EVENTS_MAX_SECONDS and the client reconnects; gevent workers can
+keep many more streams open.
+
+Configuration (environment):
+    FITTRACK_EVENTS_POLL          tailer poll interval in seconds (default 0.5)
+    FITTRACK_EVENTS_HEARTBEAT     seconds between heartbeats (default 15)
+    FITTRACK_EVENTS_MAX_SECONDS   stream lifetime before reconnect (default 300)
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import text
+
+from backend import app, changes, db
+
+logger = logging.getLogger('fittrack.events')
+
+POLL_SECONDS = float(os.getenv('FITTRACK_EVENTS_POLL', '0.5'))
+HEARTBEAT_SECONDS = float(os.getenv('FITTRACK_EVENTS_HEARTBEAT', '15'))
+MAX_STREAM_SECONDS = float(os.getenv('FITTRACK_EVENTS_MAX_SECONDS', '300'))
+RETRY_MS = 3000
+REPLAY_LIMIT = 1000
+# ids handed out but not yet visible (uncommitted on Postgres) are looked for
+# again for this long before being given up as rolled back
+GAP_SECONDS = 10.0
+
+_COLUMNS = 'id, user_id, entity, entity_id, op, workout_id'
+
+
+class Hub:
+    """Per-process fan-out of new change-log rows to subscribed streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = {}
+        self._thread = None
+        self._pid = None
+        self._last = 0
+        self._gaps = {}
+
+    def subscribe(self, user_id):
+        q = queue.SimpleQueue()
+        with self._lock:
+            self._subs.setdefault(user_id, set()).add(q)
+            # started lazily: gunicorn preloads the app in the master and the
+            # thread would not survive the fork into the workers
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._last = self._max_id()
+                self._gaps = {}
+                self._thread = threading.Thread(target=self._run, name='fittrack-events', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            subs = self._subs.get(user_id)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[user_id]
+
+    @staticmethod
+    def _max_id():
+        with db.engine.connect() as conn:
+            return conn.execute(text('SELECT coalesce(max(id), 0) FROM change_log')).scalar()
+
+    def _run(self):
+        while True:
+            time.sleep(POLL_SECONDS)
+            with self._lock:
+                if not self._subs:
+                    continue
+            try:
+                with app.app_context():
+                    self.poll()
+            except Exception:
+                logger.exception('change-log tailer failed')
+
+    def poll(self):
+        """Read new change-log rows once and dispatch them."""
+        with db.engine.connect() as conn:
+            now = time.monotonic()
+            self._gaps = {i: t for i, t in self._gaps.items() if now - t < GAP_SECONDS}
+            low = min(self._gaps, default=self._last + 1) - 1
+            rows = conn.execute(text(f'SELECT {_COLUMNS} FROM change_log WHERE id > :low ORDER BY id'),
+                                {'low': low}).fetchall()
+        for row in rows:
+            rid = row[0]
+            if rid <= self._last:
+                if self._gaps.pop(rid, None) is None:
+                    continue
+            else:
+                if rid - self._last <= REPLAY_LIMIT:
+                    self._gaps.update((i, now) for i in range(self._last + 1, rid))
+                self._last = rid
+            self._dispatch(row)
+
+    def _dispatch(self, row):
+        with self._lock:
+            targets = list(self._subs.get(row[1], ()))
+        for q in targets:
+            q.put(row)
+
+
+hub = Hub()
+
+
+def format_event(row):
+    rid, _uid, entity, entity_id, op, workout_id = row
+    data = json.dumps({'entity': entity, 'id': entity_id, 'op': op, 'workout_id': workout_id})
+    return f'id: {rid}\nevent: {entity}.{op}\ndata: {data}\n\n'
+
+
+def _replay(user_id, since):
+    """Rows after `since` for the user, or None when they were pruned or are too many."""
+    floor = db.session.execute(text('SELECT sync_floor FROM "user" WHERE id = :uid'),
+                               {'uid': user_id}).scalar() or 0
+    if since < floor:
+        return None
+    rows = db.session.execute(text(
+        f'SELECT {_COLUMNS} FROM change_log WHERE user_id = :uid AND id > :since ORDER BY id LIMIT :n'),
+        {'uid': user_id, 'since': since, 'n': REPLAY_LIMIT + 1}).fetchall()
+    return rows if len(rows) <= REPLAY_LIMIT else None
+
+
+def stream(user_id, last_event_id=None):
+    """Generator of SSE chunks for one client."""
+    q = hub.subscribe(user_id)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        replayed = set()
+        if last_event_id is None:
+            # no data, but sets the id the browser sends back when it reconnects
+            yield f'id: {changes.latest_cursor(user_id)}\n\n'
+        else:
+            rows = _replay(user_id, last_event_id)
+            if rows is None:
+                yield f'id: {changes.latest_cursor(user_id)}\nevent: reset\ndata: {{}}\n\n'
+            else:
+                for row in rows:
+                    replayed.add(row[0])
+                    yield format_event(row)
+        # the stream can stay open for minutes: do not hold a pooled connection
+        db.session.remove()
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        while True:
+            timeout = min(HEARTBEAT_SECONDS, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+            try:
+                row = q.get(timeout=timeout)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if row[0] not in replayed:
+                yield format_event(row)
+    finally:
+        hub.unsubscribe(user_id, q)
@@ -0,0 +1,118 @@
+"""Idempotency-Key support for the mutation endpoints.
+
+A client that sends `Idempotency-Key: <unique string>` with a POST/DELETE can
+safely resend the same request after a timeout: the first request claims the
+key, and its status and body are stored in `idempotency_key` for
+FITTRACK_IDEMPOTENCY_TTL seconds. Retries then get the stored response, with
+an `Idempotent-Replayed: true` header, and the endpoint does not run again.
+
+    same key, request still running       409, Retry-After
+    same key, different method/path/body  422
+    key older than the TTL                treated as new
+
+Server errors (5xx) and 409 conflicts are not stored, so the retry runs the
+endpoint again. The claim is a short lease (FITTRACK_IDEMPOTENCY_LEASE):
+if a worker dies between its commit and storing the response, the key frees
+up after the lease and a retry can run the endpoint again.
+
+Keys are scoped to the logged-in user, and rows only hold hashes, the status
+and the (small JSON) body. Expired rows are purged in passing by the claims.
+"""
+import functools
+import hashlib
+import itertools
+import os
+import time
+
+from flask import Response, jsonify, make_response, request
+from flask_login import current_user
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from backend import db
+from backend.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+TTL_SECONDS = int(os.getenv('FITTRACK_IDEMPOTENCY_TTL', str(24 * 3600)))
+LEASE_SECONDS = int(os.getenv('FITTRACK_IDEMPOTENCY_LEASE', '60'))
+MAX_KEY_LENGTH = 255
+PURGE_EVERY = 500  # claims between two purges of expired rows
+MUTATING_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+_claims = itertools.count(1)
+
+
+def _digest(*parts, size):
+    h = hashlib.blake2b(digest_size=size)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b'\0')
+    return h.digest()
+
+
+def _error(message, code, **headers):
+    resp = jsonify({'ok': False, 'error': message})
+    resp.status_code = code
+    resp.headers.update(headers)
+    return resp
+
+
+def _claim(kid, fingerprint):
+    """Claim the key; returns None when claimed, otherwise the response to send."""
+    now = int(time.time())
+    if next(_claims) % PURGE_EVERY == 0:
+        db.session.execute(text('DELETE FROM idempotency_key WHERE expires_at < :now'), {'now': now})
+    db.session.execute(text('DELETE FROM idempotency_key WHERE key = :k AND expires_at < :now'),
+                       {'k': kid, 'now': now})
+    db.session.add(IdempotencyKey(key=kid, fingerprint=fingerprint, expires_at=now + LEASE_SECONDS))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+    row = db.session.get(IdempotencyKey, kid)
+    if row is None:  # expired and purged in between: let the client retry
+        return _error('request with this Idempotency-Key is in progress', 409, **{'Retry-After': '1'})
+    if row.fingerprint != fingerprint:
+        return _error('Idempotency-Key was already used for a different request', 422)
+    if row.status is None:
+        return _error('request with this Idempotency-Key is in progress', 409, **{'Retry-After': '1'})
+    return Response(row.body, status=row.status, mimetype=row.mimetype,
+                    headers={'Idempotent-Replayed': 'true'})
+
+
+def _finish(kid, resp):
+    if resp.status_code >= 500 or resp.status_code == 409:
+        db.session.execute(text('DELETE FROM idempotency_key WHERE key = :k'), {'k': kid})
+    else:
+        db.session.execute(text(
+            'UPDATE idempotency_key SET status = :s, body = :b, mimetype = :m, expires_at = :e WHERE key = :k'),
+            {'s': resp.status_code, 'b': resp.get_data(), 'm': resp.mimetype,
+             'e': int(time.time()) + TTL_SECONDS, 'k': kid})
+    db.session.commit()
+
+
+def idempotent(view):
+    """Decorator (below @login_required) honouring the Idempotency-Key header."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or request.method not in MUTATING_METHODS:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return _error(f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters', 400)
+        scope = current_user.id if current_user.is_authenticated else 'anonymous'
+        kid = _digest(scope, key, size=16)
+        fingerprint = _digest(request.method, request.path, request.get_data(), size=8)
+        replay = _claim(kid, fingerprint)
+        if replay is not None:
+            return replay
+        try:
+            resp = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _finish(kid, make_response('', 500))
+            raise
+        _finish(kid, resp)
+        return resp
+    return wrapper
@@ -0,0 +1,336 @@
+"""Materialized leaderboards: volume per exercise, workouts per month, PR counts.
+
+Scores live in `leaderboard_score` (board, user_id, score); each board has a
+version counter in `leaderboard_board`. Board keys:
+
+    volume:<exercise name>   sum of sets * reps * weight
+    workouts:<YYYY-MM>       number of workouts in the month
+    prs                      personal records over all exercises
+
+A PR is a logged weight above every earlier weight for the same exercise
+(the first weighted entry only sets the baseline). `exercise_best` keeps the
+best weight, the last date and the PR count per (user, exercise), so adding
+an exercise on the latest date is a single row update; backdated entries and
+deletions recompute that one exercise for that user.
+
+Mutation endpoints call the `on_*` hooks in the same transaction as the
+write; `rebuild()` recomputes everything (or one user) from scratch and is
+meant for a periodic job (scripts/rebuild_leaderboards.py) and repairs.
+
+Reads never touch `workout_exercise`: each worker loads a board's scores once
+per version into a `Ranking` (ascending score array + top-K picked with a
+heap) kept in the shared LRU cache, and answers "where am I" with a bisect.
+"""
+import bisect
+import datetime
+import heapq
+import os
+from collections import defaultdict
+
+from sqlalchemy import func, text
+
+from backend import archive, db, sharding
+from backend.cache import cache
+from backend.models import ExerciseBest, LeaderboardBoard, LeaderboardScore, User, Workout, WorkoutExercise
+
+PRS = 'prs'
+TOP_K = int(os.getenv('FITTRACK_LEADERBOARD_TOP_K', '10'))
+MAX_TOP_K = 100
+
+
+def volume_board(name):
+    return f'volume:{name}'
+
+
+def month_board(d):
+    return f'workouts:{d.year:04d}-{d.month:02d}'
+
+
+def _volume(sets, reps, weight):
+    try:
+        return float(sets or 0) * float(reps or 0) * float(weight or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _add_scores(deltas):
+    """Apply {(board, user_id): delta} as upserts and bump the touched boards."""
+    boards = set()
+    for (board, user_id), delta in deltas.items():
+        if not delta:
+            continue
+        db.session.execute(text(
+            'INSERT INTO leaderboard_score (board, user_id, score) VALUES (:b, :u, :d) '
+            'ON CONFLICT (board, user_id) DO UPDATE SET score = leaderboard_score.score + excluded.score'),
+            {'b': board, 'u': user_id, 'd': delta})
+        boards.add(board)
+    _touch(boards)
+
+
+def _touch(boards):
+    for board in sorted(boards):
+        db.session.execute(text(
+            'INSERT INTO leaderboard_board (board, version) VALUES (:b, 1) '
+            'ON CONFLICT (board) DO UPDATE SET version = leaderboard_board.version + 1'), {'b': board})
+
+
+# --- personal records ----------------------------------------------------
+
+def _pr_scan(weights):
+    """(best, pr_count) for weights in chronological order."""
+    best = None
+    prs = 0
+    for w in weights:
+        if best is None:
+            best = w
+        elif w > best:
+            best = w
+            prs += 1
+    return best, prs
+
+
+def _recompute_best(user_id, name):
+    """Recount one (user, exercise) from its weighted rows; returns the PR count delta."""
+    rows = (db.session.query(Workout.date, WorkoutExercise.id, WorkoutExercise.weight)
+            .join(Workout, Workout.id == WorkoutExercise.workout_id)
+            .filter(Workout.user_id == user_id, WorkoutExercise.name == name,
+                    WorkoutExercise.weight.isnot(None)).all())
+    rows += [(d, eid, w) for n, d, eid, _s, _r, w in archive.exercise_facts(user_id)
+             if n == name and w is not None]
+    rows.sort()
+    row = _locked_best(user_id, name)
+    old = row.pr_count if row is not None else 0
+    if not rows:
+        if row is not None:
+            db.session.delete(row)
+        return -old
+    best, prs = _pr_scan(r[2] for r in rows)
+    if row is None:
+        row = ExerciseBest(user_id=user_id, name=name)
+        db.session.add(row)
+    row.best_weight = best
+    row.last_date = rows[-1][0]
+    row.pr_count = prs
+    return prs - old
+
+
+def _locked_best(user_id, name):
+    return (db.session.query(ExerciseBest).filter_by(user_id=user_id, name=name)
+            .with_for_update().first())
+
+
+def _pr_delta_added(user_id, d, name, weight):
+    if weight is None:
+        return 0
+    row = _locked_best(user_id, name)
+    if row is None:
+        db.session.add(ExerciseBest(user_id=user_id, name=name, best_weight=weight, last_date=d, pr_count=0))
+        return 0
+    if row.last_date is not None and d < row.last_date:
+        return _recompute_best(user_id, name)
+    row.last_date = d
+    if row.best_weight is None or weight > row.best_weight:
+        gained = 1 if row.best_weight is not None else 0
+        row.best_weight = weight
+        row.pr_count += gained
+        return gained
+    return 0
+
+
+# --- mutation hooks ------------------------------------------------------
+
+def on_exercises_added(user_id, d, exercises, new_workout=False):
+    """After inserting exercises [(name, sets, reps, weight), ...] dated `d` (and flushing)."""
+    deltas = defaultdict(float)
+    if new_workout:
+        deltas[(month_board(d), user_id)] += 1
+    for name, sets, reps, weight in exercises:
+        deltas[(volume_board(name), user_id)] += _volume(sets, reps, weight)
+        deltas[(PRS, user_id)] += _pr_delta_added(user_id, d, name, weight)
+    _add_scores(deltas)
+
+
+def on_exercises_removed(user_id, d, exercises, workout_removed=False):
+    """After deleting exercises [(name, sets, reps, weight), ...] dated `d` (and flushing)."""
+    deltas = defaultdict(float)
+    if workout_removed:
+        deltas[(month_board(d), user_id)] -= 1
+    for name, sets, reps, weight in exercises:
+        deltas[(volume_board(name), user_id)] -= _volume(sets, reps, weight)
+    for name in {e[0] for e in exercises if e[3] is not None}:
+        deltas[(PRS, user_id)] += _recompute_best(user_id, name)
+    _add_scores(deltas)
+
+
+def on_workouts_removed(user_id, removed):
+    """Bulk delete: on_exercises_removed(..., workout_removed=True) for [(date, exercises), ...].
+
+    Each affected exercise is recounted once, not once per deleted workout.
+    """
+    deltas = defaultdict(float)
+    names = set()
+    for d, exercises in removed:
+        deltas[(month_board(d), user_id)] -= 1
+        for name, sets, reps, weight in exercises:
+            deltas[(volume_board(name), user_id)] -= _volume(sets, reps, weight)
+            if weight is not None:
+                names.add(name)
+    for name in sorted(names):
+        deltas[(PRS, user_id)] += _recompute_best(user_id, name)
+    _add_scores(deltas)
+
+
+def on_user_removed(user_id):
+    """Before deleting an account: its scores go with ON DELETE CASCADE, the boards need a new version."""
+    _touch({b for (b,) in db.session.query(LeaderboardScore.board).filter(LeaderboardScore.user_id == user_id)})
+
+
+# --- batch rebuild -------------------------------------------------------
+
+def _scan(uid_filter, scores, weights):
+    """Accumulate scores and weighted rows from the workout tables of the current shard."""
+    vol = (db.session.query(Workout.user_id, WorkoutExercise.name,
+                            func.sum(WorkoutExercise.sets * WorkoutExercise.reps
+                                     * func.coalesce(WorkoutExercise.weight, 0)))
+           .join(Workout, Workout.id == WorkoutExercise.workout_id)
+           .filter(*uid_filter).group_by(Workout.user_id, WorkoutExercise.name))
+    for uid, name, total in vol:
+        scores[(volume_board(name), uid)] += float(total or 0)
+
+    days = (db.session.query(Workout.user_id, Workout.date, func.count(Workout.id))
+            .filter(*uid_filter).group_by(Workout.user_id, Workout.date))
+    for uid, d, n in days:
+        scores[(month_board(d), uid)] += n
+
+    rows = (db.session.query(Workout.user_id, WorkoutExercise.name, Workout.date, WorkoutExercise.id,
+                             WorkoutExercise.weight)
+            .join(Workout, Workout.id == WorkoutExercise.workout_id)
+            .filter(WorkoutExercise.weight.isnot(None), *uid_filter))
+    for uid, name, d, eid, weight in rows:
+        weights[(uid, name)].append((d, eid, weight))
+
+
+def _scan_archive(user_ids, scores, weights):
+    """Same as _scan for archived workouts of `user_ids`."""
+    for uid in user_ids:
+        for name, d, eid, sets, reps, weight in archive.exercise_facts(uid):
+            scores[(volume_board(name), uid)] += _volume(sets, reps, weight)
+            if weight is not None:
+                weights[(uid, name)].append((d, eid, weight))
+        for d, n in archive.date_counts(uid).items():
+            scores[(month_board(d), uid)] += n
+
+
+def rebuild(user_id=None):
+    """Recompute all boards (or one user's scores) from the workout tables and commit."""
+    scores = defaultdict(float)
+    weights = defaultdict(list)
+    if user_id is not None:
+        with sharding.use_user(user_id):
+            _scan([Workout.user_id == user_id], scores, weights)
+        _scan_archive([user_id], scores, weights)
+    else:
+        for _ in sharding.each_shard():
+            _scan([], scores, weights)
+        _scan_archive(archive.archived_counts(), scores, weights)
+    bests = []
+    for (uid, name), rows in weights.items():
+        rows.sort()
+        best, count = _pr_scan(w for _d, _i, w in rows)
+        bests.append({'user_id': uid, 'name': name, 'best_weight': best,
+                      'last_date': rows[-1][0], 'pr_count': count})
+        scores[(PRS, uid)] += count
+
+    score_q = db.session.query(LeaderboardScore)
+    best_q = db.session.query(ExerciseBest)
+    if user_id is not None:
+        score_q = score_q.filter(LeaderboardScore.user_id == user_id)
+        best_q = best_q.filter(ExerciseBest.user_id == user_id)
+    touched = {b for (b,) in score_q.with_entities(LeaderboardScore.board).distinct()}
+    score_q.delete(synchronize_session=False)
+    best_q.delete(synchronize_session=False)
+    rows = [{'board': b, 'user_id': uid, 'score': s} for (b, uid), s in scores.items() if s]
+    if rows:
+        db.session.execute(LeaderboardScore.__table__.insert(), rows)
+    if bests:
+        db.session.execute(ExerciseBest.__table__.insert(), bests)
+    _touch(touched | {r['board'] for r in rows} | {PRS})
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_backfilled():
+    """Populate the boards once for databases that predate them."""
+    if db.session.query(LeaderboardBoard.board).first() is not None:
+        return False
+    if not any(db.session.query(Workout.id).first() is not None for _ in sharding.each_shard()):
+        return False
+    rebuild()
+    return True
+
+
+# --- reads ---------------------------------------------------------------
+
+class Ranking:
+    """One board at one version: ascending score array for ranks, plus the top K."""
+    __slots__ = ('scores', 'by_user', 'top')
+
+    def __init__(self, rows, k):
+        self.by_user = dict(rows)
+        self.scores = sorted(self.by_user.values())
+        # ties broken by user id so the listing is stable between reloads
+        self.top = heapq.nsmallest(k, rows, key=lambda r: (-r[1], r[0]))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def rank_of(self, score):
+        """Competition rank (1 + number of strictly higher scores), O(log n)."""
+        return len(self.scores) - bisect.bisect_right(self.scores, score) + 1
+
+
+def _version(board):
+    v = db.session.query(LeaderboardBoard.version).filter_by(board=board).scalar()
+    return v or 0
+
+
+def _load(board):
+    rows = (db.session.query(LeaderboardScore.user_id, LeaderboardScore.score)
+            .filter(LeaderboardScore.board == board, LeaderboardScore.score > 1e-6).all())
+    ranking = Ranking([(uid, score) for uid, score in rows], MAX_TOP_K)
+    ids = [uid for uid, _ in ranking.top]
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(ids))) if ids else {}
+    ranking.top = [(uid, names.get(uid, ''), score) for uid, score in ranking.top]
+    return ranking
+
+
+def ranking(board):
+    return cache.get_or_compute(('leaderboard', board, _version(board)), lambda: _load(board))
+
+
+def _score_out(board, score):
+    if board.startswith('volume:'):
+        return round(score, 1)
+    return int(score)
+
+
+def board_payload(board, user_id, k=TOP_K):
+    r = ranking(board)
+    top = []
+    for uid, username, score in r.top[:k]:
+        top.append({'rank': r.rank_of(score), 'user_id': uid, 'username': username,
+                    'score': _score_out(board, score)})
+    mine = r.by_user.get(user_id)
+    me = {'rank': r.rank_of(mine), 'score': _score_out(board, mine)} if mine else None
+    kind, _, subject = board.partition(':')
+    return {'board': board, 'kind': kind, 'subject': subject, 'participants': len(r),
+            'top': top, 'me': me}
+
+
+def available_boards():
+    return [b for (b,) in db.session.query(LeaderboardBoard.board).order_by(LeaderboardBoard.board)]
+
+
+def default_boards(today=None):
+    today = today or datetime.date.today()
+    return [PRS, month_board(today)]
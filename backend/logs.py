@@ -0,0 +1,294 @@
+"""Non-blocking error logging for the backend.
+
+Request threads only put records on an in-memory queue (QueueHandler); a
+single QueueListener thread per process formats them and writes them to
+instance/error.log through a rotating file handler. Identical tracebacks are
+collapsed so an error storm produces one entry plus a "repeated N times"
+summary instead of thousands of writes; the summary is written by the
+listener once the window of the error ends.
+
+Python's rotating handlers must not be shared by several processes (each
+would roll the file over under the others). Under gunicorn the master runs
+the only writer (`LogServer`, started from gunicorn.conf.py): the listener
+of every worker sends its records to it over the Unix socket named by
+FITTRACK_LOG_SOCKET, and the master dedups and rotates for all of them.
+Without FITTRACK_LOG_SOCKET the process writes the file itself.
+
+Configuration (environment):
+    FITTRACK_LOG_SOCKET     Unix socket of the gunicorn master's log writer (set by gunicorn.conf.py)
+    FITTRACK_LOG_FORMAT     'text' (default) or 'json' for JSON lines
+    FITTRACK_LOG_ROTATE     'size' (default) or 'time' (daily at midnight)
+    FITTRACK_LOG_MAX_BYTES  rotate size in bytes (default 5 MB)
+    FITTRACK_LOG_BACKUPS    number of rotated files kept (default 5)
+    FITTRACK_LOG_DEDUP_SECONDS  window for collapsing identical tracebacks (default 60)
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import pickle
+import queue
+import socketserver
+import struct
+import threading
+import time
+
+LOGGER_NAME = 'fittrack'
+
+_listener = None
+_queue_handler = None
+_make_handlers = None
+_pid = None
+
+
+class DedupFilter(logging.Filter):
+    """Drop records whose message + traceback was already logged within `window` seconds.
+
+    `expired()` hands back a "repeated N times" summary for every window that
+    ended with suppressed duplicates; the listener writes them. Runs on the
+    listener thread, so the lock is uncontended.
+    """
+
+    def __init__(self, window=60.0, max_keys=1024):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = {}  # key -> [first_ts, suppressed, record]
+        self._lock = threading.Lock()
+
+    def _key(self, record):
+        text = f'{record.levelno}:{record.getMessage()}:{record.exc_text or ""}'
+        return hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest()
+
+    def filter(self, record):
+        if self.window <= 0 or record.levelno < logging.ERROR or getattr(record, 'summary', False):
+            return True
+        key = self._key(record)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            if entry and entry[1]:
+                record.repeated = entry[1]  # the window ended before expired() ran
+            if len(self._seen) >= self.max_keys:
+                # forget the oldest half instead of growing without bound
+                for k, _ in sorted(self._seen.items(), key=lambda kv: kv[1][0])[: self.max_keys // 2]:
+                    del self._seen[k]
+            self._seen[key] = [now, 0, record]
+        return True
+
+    def expired(self, everything=False):
+        """Summary records for the windows that ended (all of them with `everything`)."""
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            for key, (first, suppressed, record) in list(self._seen.items()):
+                if everything or now - first >= self.window:
+                    del self._seen[key]
+                    if suppressed:
+                        out.append(logging.makeLogRecord({
+                            'name': record.name, 'levelno': record.levelno, 'levelname': record.levelname,
+                            'msg': f'previous identical error repeated {suppressed} times: {record.getMessage()}',
+                            'summary': True}))
+        return out
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        s = super().format(record)
+        rid = getattr(record, 'request_id', None)
+        if rid:
+            s = f'{s} [request_id={rid} latency_ms={getattr(record, "latency_ms", "")}]'
+        if getattr(record, 'repeated', 0):
+            s = f'{s}\n(previous identical error repeated {record.repeated} times)'
+        return s
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with request id and latency when available."""
+
+    def format(self, record):
+        out = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for attr in ('request_id', 'latency_ms', 'method', 'path', 'repeated'):
+            val = getattr(record, attr, None)
+            if val is not None:
+                out[attr] = val
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out['traceback'] = record.exc_text
+        return json.dumps(out, ensure_ascii=False)
+
+
+class _PreparedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps extra attributes and renders the traceback to text
+    before enqueueing (exc_info objects pin frames and aren't safe to share)."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _file_handler(log_path):
+    rotate = os.getenv('FITTRACK_LOG_ROTATE', 'size').lower()
+    backups = int(os.getenv('FITTRACK_LOG_BACKUPS', '5'))
+    if rotate == 'time':
+        fh = logging.handlers.TimedRotatingFileHandler(log_path, when='midnight', backupCount=backups,
+                                                       encoding='utf-8', delay=True)
+    else:
+        max_bytes = int(os.getenv('FITTRACK_LOG_MAX_BYTES', str(5 * 1024 * 1024)))
+        fh = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups,
+                                                  encoding='utf-8', delay=True)
+    fh.setLevel(logging.DEBUG)
+    if os.getenv('FITTRACK_LOG_FORMAT', 'text').lower() == 'json':
+        fh.setFormatter(JsonFormatter())
+    else:
+        fh.setFormatter(TextFormatter('%(asctime)s %(levelname)s %(message)s'))
+    fh.addFilter(DedupFilter(float(os.getenv('FITTRACK_LOG_DEDUP_SECONDS', '60'))))
+    return fh
+
+
+class _Listener(logging.handlers.QueueListener):
+    """QueueListener that wakes up every `tick` seconds to write dedup summaries."""
+
+    tick = 1.0
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(timeout=self.tick)
+            except queue.Empty:
+                self.flush_summaries()
+
+    def flush_summaries(self, everything=False):
+        for handler in self.handlers:
+            for f in handler.filters:
+                if isinstance(f, DedupFilter):
+                    for record in f.expired(everything):
+                        handler.handle(record)
+
+    def stop(self):
+        super().stop()
+        self.flush_summaries(everything=True)
+
+
+def _socket_handler(address):
+    """Sends the records of this worker to the master's LogServer (pickled, like SocketHandler does)."""
+    sh = logging.handlers.SocketHandler(address, None)
+    sh.setLevel(logging.DEBUG)
+    return sh
+
+
+def _handlers(log_path):
+    address = os.getenv('FITTRACK_LOG_SOCKET')
+    return [_socket_handler(address)] if address else [_file_handler(log_path)]
+
+
+def _start(handlers):
+    global _listener, _pid
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = _Listener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _pid = os.getpid()
+
+
+def _restart_after_fork():
+    # gunicorn preloads the app in the master; the listener thread does not
+    # survive fork(), so every worker starts its own (with its own connection
+    # to the log writer).
+    if _listener is not None and _pid != os.getpid():
+        _start(_make_handlers())
+
+
+def setup_logging(log_path):
+    """Attach the queued pipeline to the 'fittrack' logger and return the logger."""
+    global _queue_handler, _make_handlers
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG)
+    if _queue_handler is not None:
+        return logger
+    _queue_handler = _PreparedQueueHandler(queue.SimpleQueue())
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+    _make_handlers = lambda: _handlers(log_path)  # noqa: E731
+    _start(_make_handlers())
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+    atexit.register(stop_logging)
+    return logger
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None and _pid == os.getpid():
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+        for h in _listener.handlers:
+            h.close()
+
+
+class _RecordStream(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            head = self.rfile.read(4)
+            if len(head) < 4:
+                return
+            body = self.rfile.read(struct.unpack('>L', head)[0])
+            self.server.records.put(logging.makeLogRecord(pickle.loads(body)))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LogServer:
+    """The single writer of `log_path`: records of every worker arrive on the
+    Unix socket `address` and go through one listener (dedup, rotation).
+
+    Runs in the gunicorn master. The socket is only accessible to its owner,
+    since the records are pickled.
+    """
+
+    def __init__(self, log_path, address):
+        self.address = address
+        if os.path.exists(address):
+            os.unlink(address)
+        self.records = queue.SimpleQueue()
+        self.listener = _Listener(self.records, _file_handler(log_path), respect_handler_level=True)
+        self.listener.start()
+        umask = os.umask(0o177)
+        try:
+            self.server = _UnixServer(address, _RecordStream)
+        finally:
+            os.umask(umask)
+        self.server.records = self.records
+        threading.Thread(target=self.server.serve_forever, name='fittrack-log-server', daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+        self.listener.stop()
+        for h in self.listener.handlers:
+            h.close()
@@ -1,12 +1,17 @@
-from backend import db
+from backend import db, sharding
 from flask_login import UserMixin
 import datetime
 
 class User(UserMixin, db.Model):
+    # AUTOINCREMENT: a new account must never get the id of a deleted one, which
+    # its old sessions, tokens and cached aggregates still carry
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
-    workouts = db.relationship('Workout', backref='user', lazy=True, cascade='all, delete-orphan')
+    # rows are removed by ON DELETE CASCADE in the database, not loaded one by one
+    workouts = db.relationship('Workout', backref='user', lazy=True, cascade='all, delete-orphan',
+                               passive_deletes=True)
     email = db.Column(db.String(255), unique=True)
     oauth_provider = db.Column(db.String(50))
     oauth_sub = db.Column(db.String(255))
@@ -14,18 +19,152 @@ class User(UserMixin, db.Model):
     height_cm = db.Column(db.Float)
     weight_kg = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # bumped by every workout mutation, see backend/cache.py
+    data_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    history_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    # shard holding the user's workouts when sharding is on, see backend/sharding.py
+    shard = db.Column(db.Integer)
+    # change-log ids at or below this can no longer be synced from, see backend/changes.py
+    sync_floor = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+
+db.event.listen(User, 'after_insert', sharding.assign_new_user)
 
 class Workout(db.Model):
+    # AUTOINCREMENT: ids of deleted or archived workouts (backend/archive.py) are never handed out again
+    __table_args__ = (db.Index('ix_workout_user_date', 'user_id', 'date'), {'sqlite_autoincrement': True})
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.date.today)
     note = db.Column(db.Text)
-    exercises = db.relationship('WorkoutExercise', backref='workout', lazy=True, cascade='all, delete-orphan')
+    # summary of the exercises, kept by database triggers, see backend/summaries.py
+    exercise_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    total_sets = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    total_volume = db.Column(db.Float, default=0, nullable=False, server_default='0')
+    max_weight = db.Column(db.Float)
+    exercises = db.relationship('WorkoutExercise', backref='workout', lazy=True, cascade='all, delete-orphan',
+                                passive_deletes=True)
 
 class WorkoutExercise(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
-    workout_id = db.Column(db.Integer, db.ForeignKey('workout.id'), nullable=False)
+    workout_id = db.Column(db.Integer, db.ForeignKey('workout.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.String(120), nullable=False)
     sets = db.Column(db.Integer, nullable=False)
     reps = db.Column(db.Integer, nullable=False)
     weight = db.Column(db.Float)
+
+class UserStats(db.Model):
+    """Consistency metrics maintained incrementally by backend/streaks.py."""
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    total_workouts = db.Column(db.Integer, nullable=False, default=0)
+    active_days = db.Column(db.Integer, nullable=False, default=0)
+    active_weeks = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.Date)
+    last_date = db.Column(db.Date)
+    current_run = db.Column(db.Integer, nullable=False, default=0)
+    longest_run = db.Column(db.Integer, nullable=False, default=0)
+
+class LeaderboardScore(db.Model):
+    """Materialized per-board scores, maintained by backend/leaderboards.py."""
+    __tablename__ = 'leaderboard_score'
+    __table_args__ = (db.Index('ix_leaderboard_board_score', 'board', 'score'),)
+    board = db.Column(db.String(160), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+class LeaderboardBoard(db.Model):
+    """Version counter per board so each worker knows when to reload its ranking."""
+    __tablename__ = 'leaderboard_board'
+    board = db.Column(db.String(160), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ExerciseBest(db.Model):
+    """Best weight and PR count per (user, exercise name)."""
+    __tablename__ = 'exercise_best'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(120), primary_key=True)
+    best_weight = db.Column(db.Float)
+    last_date = db.Column(db.Date)
+    pr_count = db.Column(db.Integer, nullable=False, default=0)
+
+class WorkoutArchive(db.Model):
+    """Per-user cold-storage segment of old workouts, see backend/archive.py."""
+    __tablename__ = 'workout_archive'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    workouts = db.Column(db.Integer, nullable=False, default=0)
+    exercises = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.Date)
+    last_date = db.Column(db.Date)
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class ChangeLog(db.Model):
+    """Per-user log of workout/exercise changes for delta sync, see backend/changes.py."""
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT so SQLite never hands out an id again after pruning
+    __table_args__ = (db.Index('ix_change_log_user_id', 'user_id', 'id'), {'sqlite_autoincrement': True})
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)
+    workout_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+class IdempotencyKey(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key, see backend/idempotency.py."""
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (db.Index('ix_idempotency_key_expires_at', 'expires_at'), {'sqlite_with_rowid': False})
+    # blake2b of the caller (user id) and the client's key, so keys of different users never collide
+    key = db.Column(db.LargeBinary(16), primary_key=True)
+    # hash of method, path and body of the first request
+    fingerprint = db.Column(db.LargeBinary(8), nullable=False)
+    status = db.Column(db.SmallInteger)  # NULL while the first request is still running
+    body = db.Column(db.LargeBinary)
+    mimetype = db.Column(db.String(64))
+    expires_at = db.Column(db.Integer, nullable=False)  # unix time
+
+
+class RevokedToken(db.Model):
+    """A revoked bearer-token login or user, see backend/tokens.py."""
+    __tablename__ = 'revoked_token'
+    # AUTOINCREMENT: once expired rows are purged, a reused id would sit below
+    # the workers' sync cursors and never reach them
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)  # the workers sync by it
+    family = db.Column(db.String(16))  # one login: all tokens it produced
+    user_id = db.Column(db.Integer)  # with not_before: tokens of the user issued until then
+    not_before = db.Column(db.Integer)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # unix time
+
+
+class WorkoutSession(db.Model):
+    """A workout logged set by set while it happens, see backend/setlog.py."""
+    __tablename__ = 'workout_session'
+    # workout ids are unique per shard only, so a session is the user's workout
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    workout_id = db.Column(db.Integer, primary_key=True)  # no FK: the workout may live on a shard
+    started_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)  # set when the sets were rolled up into WorkoutExercise rows
+
+
+class SetLog(db.Model):
+    """One logged set of a WorkoutSession; rows are only ever appended (in batches)."""
+    __tablename__ = 'set_log'
+    __table_args__ = (db.Index('ix_set_log_user_workout', 'user_id', 'workout_id', 'logged_at'),
+                      # unique per session only: clients choose uids, another session's must not block one
+                      db.Index('uix_set_log_session_uid', 'user_id', 'workout_id', 'uid', unique=True))
+    id = db.Column(db.Integer, primary_key=True)
+    # time-ordered id given when the set is accepted; replays of the WAL are ignored by it
+    uid = db.Column(db.LargeBinary(16), nullable=False)
+    # no FKs: buffered sets may arrive after their user or workout was deleted
+    user_id = db.Column(db.Integer, nullable=False)
+    workout_id = db.Column(db.Integer, nullable=False)
+    exercise = db.Column(db.String(120), nullable=False)
+    reps = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Float)
+    rpe = db.Column(db.Float)
+    rest_s = db.Column(db.Integer)
+    logged_at = db.Column(db.Float, nullable=False)  # unix time
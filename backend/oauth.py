@@ -1,27 +1,74 @@
+"""OAuth login provider registration.
+
+The provider is Google, or with FITTRACK_OAUTH_PROVIDER=local the offline
+stand-in from backend/oauth_local.py. Either way it is registered as
+`oauth.google`, and its discovery document and JWKS come from the
+backend/oauth_cache.py cache instead of being fetched by authlib in each
+worker.
+"""
 import os
 try:
     from authlib.integrations.flask_client import OAuth
-    from backend import app
+    from authlib.integrations.flask_client.apps import FlaskOAuth2App
+    from backend import app, oauth_cache
 except Exception:
     # If authlib isn't installed or import fails, provide a noop fallback
     OAuth = None
     app = None
 
+PROVIDER = os.getenv('FITTRACK_OAUTH_PROVIDER', 'google')
+GOOGLE_METADATA_URL = "https://accounts.google.com/.well-known/openid-configuration"
+
 _g_client_id = os.getenv("GOOGLE_CLIENT_ID")
 _g_client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
+_metadata_url = GOOGLE_METADATA_URL
+_compliance_fix = None
 
 oauth = None
+documents = None
+
+if PROVIDER == 'local' and app is not None:
+    from backend import oauth_local
+    _g_client_id = oauth_local.CLIENT_ID
+    _g_client_secret = oauth_local.CLIENT_SECRET
+    _metadata_url = oauth_local.METADATA_URL
+    oauth_local.mount(oauth_cache.http, app)
+
+    def _compliance_fix(session):
+        oauth_local.mount(session, app)
+
 
 def is_configured():
     return bool(_g_client_id and _g_client_secret and OAuth and app)
 
+
 if is_configured():
-    oauth = OAuth(app)
+    documents = oauth_cache.DocumentCache(
+        os.getenv('FITTRACK_OAUTH_CACHE_DIR') or os.path.join(app.instance_path, 'oauth_cache'))
+
+    class CachedOAuth2App(FlaskOAuth2App):
+        """authlib client reading the discovery document and the JWKS from `documents`."""
+
+        def load_server_metadata(self):
+            if self._server_metadata_url:
+                self.server_metadata.update(documents.get(self._server_metadata_url))
+            return self.server_metadata
+
+        def fetch_jwk_set(self, force=False):
+            uri = self.load_server_metadata().get('jwks_uri')
+            if not uri:
+                return super().fetch_jwk_set(force)
+            return documents.get(uri, force=force)
+
+    class CachedOAuth(OAuth):
+        oauth2_client_cls = CachedOAuth2App
+
+    oauth = CachedOAuth(app)
     oauth.register(
         name="google",
-        server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+        server_metadata_url=_metadata_url,
         client_id=_g_client_id,
         client_secret=_g_client_secret,
         client_kwargs={"scope": "openid email profile"},
+        compliance_fix=_compliance_fix,
     )
-
@@ -0,0 +1,183 @@
+"""Cached OAuth provider documents: discovery metadata and signing keys (JWKS).
+
+authlib fetches the provider's discovery document once per process and the
+JWKS on demand, so every fresh worker pays two HTTPS round trips to the
+provider inside its first login, and a provider outage breaks logins. Both
+documents are kept here in memory and on disk (one JSON file per URL, shared
+by all workers and surviving restarts):
+
+    fresh         younger than the TTL: served as is; past REFRESH_AHEAD of
+                  the TTL a background refresh starts, so busy workers
+                  rarely see an expired copy
+    stale         up to FITTRACK_OAUTH_CACHE_STALE seconds past the TTL:
+                  served at once while one background thread refetches it
+                  (stale-while-revalidate)
+    expired       fetched in the request
+    fetch failed  the last copy is served regardless of age (stale-if-error)
+
+The TTL is the response's `Cache-Control: max-age` when the provider sends
+one, else FITTRACK_OAUTH_CACHE_TTL. A forced refetch (an ID token signed with
+an unknown key id, i.e. the provider rotated its keys) goes to the provider
+at most once per MIN_FORCED_INTERVAL seconds per URL.
+
+Fetches go through the module-level `http` session, so a stand-in provider
+can be mounted on it (see backend/oauth_local.py).
+
+Configuration (environment):
+    FITTRACK_OAUTH_CACHE_DIR    directory of the disk copies (default instance/oauth_cache)
+    FITTRACK_OAUTH_CACHE_TTL    seconds without Cache-Control (default 3600)
+    FITTRACK_OAUTH_CACHE_STALE  seconds a stale copy may be served (default 86400)
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+
+TTL_SECONDS = int(os.getenv('FITTRACK_OAUTH_CACHE_TTL', '3600'))
+STALE_SECONDS = int(os.getenv('FITTRACK_OAUTH_CACHE_STALE', str(24 * 3600)))
+REFRESH_AHEAD = 0.8         # share of the TTL after which a refresh starts in the background
+MIN_FORCED_INTERVAL = 60    # seconds between two forced refetches of one URL
+FETCH_TIMEOUT = (3.05, 10)
+
+logger = logging.getLogger('fittrack')
+http = requests.Session()
+
+_MAX_AGE = re.compile(r'(?:^|,)\s*max-age\s*=\s*(\d+)', re.I)
+
+
+def max_age(cache_control):
+    """Seconds from a Cache-Control header, or None (also for no-store/no-cache)."""
+    if not cache_control or re.search(r'no-store|no-cache', cache_control, re.I):
+        return None
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+def fetch(url):
+    """GET a JSON document; returns (document, max-age or None)."""
+    resp = http.get(url, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json(), max_age(resp.headers.get('Cache-Control'))
+
+
+class _Entry:
+    __slots__ = ('doc', 'fetched_at', 'ttl')
+
+    def __init__(self, doc, fetched_at, ttl):
+        self.doc = doc
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+
+class DocumentCache:
+    """JSON documents by URL, in memory and on disk, refreshed in the background."""
+
+    def __init__(self, directory, ttl=TTL_SECONDS, stale=STALE_SECONDS, fetcher=fetch):
+        self.directory = directory
+        self.ttl = ttl
+        self.stale = stale
+        self._fetch = fetcher
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.stats = Counter()  # hits, stale, disk, fetches, errors, background
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest()[:32] + '.json')
+
+    def _load(self, url):
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('url') != url:
+            return None
+        entry = _Entry(data['doc'], data['fetched_at'], data['ttl'])
+        self._entries[url] = entry
+        self.stats['disk'] += 1
+        return entry
+
+    def _save(self, url, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'fetched_at': entry.fetched_at, 'ttl': entry.ttl, 'doc': entry.doc}, f)
+            os.replace(tmp, self._path(url))
+        except OSError:
+            logger.warning('could not write the OAuth cache file for %s', url, exc_info=True)
+
+    def _refresh(self, url):
+        doc, seconds = self._fetch(url)
+        self.stats['fetches'] += 1
+        entry = _Entry(doc, time.time(), seconds if seconds is not None else self.ttl)
+        self._entries[url] = entry
+        self._save(url, entry)
+        return entry
+
+    def _refresh_in_background(self, url):
+        with self._lock:
+            if url in self._refreshing:
+                return
+            self._refreshing.add(url)
+
+        def run():
+            try:
+                self._refresh(url)
+                self.stats['background'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+                logger.warning('background refresh of %s failed', url, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(url)
+
+        threading.Thread(target=run, name='oauth-cache-refresh', daemon=True).start()
+
+    def get(self, url, force=False):
+        """The document at url, fetched only when there is no usable copy.
+
+        force=True asks for a new copy (rate limited to MIN_FORCED_INTERVAL).
+        """
+        entry = self._entries.get(url) or self._load(url)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if force:
+                if age < MIN_FORCED_INTERVAL:
+                    self.stats['hits'] += 1
+                    return entry.doc
+            elif age < entry.ttl:
+                if age > entry.ttl * REFRESH_AHEAD:
+                    self._refresh_in_background(url)
+                self.stats['hits'] += 1
+                return entry.doc
+            elif age < entry.ttl + self.stale:
+                self._refresh_in_background(url)
+                self.stats['stale'] += 1
+                return entry.doc
+        try:
+            return self._refresh(url).doc
+        except Exception:
+            self.stats['errors'] += 1
+            if entry is None:
+                raise
+            logger.warning('fetching %s failed, serving the cached copy', url, exc_info=True)
+            return entry.doc
+
+    def clear(self, disk=False):
+        """Forget the documents (in memory, and on disk with disk=True)."""
+        if disk:
+            for url in list(self._entries):
+                try:
+                    os.remove(self._path(url))
+                except OSError:
+                    pass
+        self._entries.clear()
@@ -0,0 +1,200 @@
+"""Local stand-in OpenID Connect provider for offline tests and load tests.
+
+With FITTRACK_OAUTH_PROVIDER=local the app registers this provider instead
+of Google and serves it under /oauth-local, so the complete login flow
+(/api/google/login, authorize, /api/google/callback) runs without network:
+
+    /.well-known/openid-configuration   discovery document
+    /authorize   approves at once and redirects back with a code; the
+                 identity is taken from `login_hint` (default "tester")
+    /token       exchanges the code for an access token and an RS256 ID token
+    /jwks        public signing key
+    /userinfo    claims for the access token
+
+The browser reaches it at FITTRACK_OAUTH_LOCAL_URL. The server-side calls
+(discovery, JWKS, token) are dispatched to the app in-process by
+`InProcessAdapter`, mounted on the authlib and oauth_cache sessions, so they
+open no socket and do not need a free worker.
+
+Codes and access tokens are signed with SECRET_KEY rather than stored, and
+the RSA key is kept in the instance folder, so any worker can finish a flow
+another worker started. Nothing here is meant for production use.
+
+Configuration (environment):
+    FITTRACK_OAUTH_PROVIDER       google (default) or local
+    FITTRACK_OAUTH_LOCAL_URL      public URL of the stand-in (default http://localhost:5000/oauth-local)
+    FITTRACK_OAUTH_LOCAL_LATENCY  milliseconds added to each server-side call, to play a
+                                  remote provider (default 0)
+"""
+import os
+import time
+from urllib.parse import urlencode, urlsplit
+
+from flask import Blueprint, current_app, jsonify, redirect, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from joserfc import jwt
+from joserfc.jwk import RSAKey
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+BASE_URL = os.getenv('FITTRACK_OAUTH_LOCAL_URL', 'http://localhost:5000/oauth-local').rstrip('/')
+PREFIX = urlsplit(BASE_URL).path  # where backend/__init__.py mounts provider_bp
+METADATA_URL = BASE_URL + '/.well-known/openid-configuration'
+CLIENT_ID = 'fittrack-local'
+CLIENT_SECRET = 'fittrack-local-secret'
+CODE_TTL = 120
+TOKEN_TTL = 3600
+DOCUMENT_MAX_AGE = 3600  # Cache-Control of the discovery document and the JWKS
+LATENCY = float(os.getenv('FITTRACK_OAUTH_LOCAL_LATENCY', '0')) / 1000
+
+provider_bp = Blueprint('oauth_local', __name__)
+_key = None
+
+
+def _signing_key():
+    """The provider's RSA key, created once and shared by the workers via the instance folder."""
+    global _key
+    if _key is None:
+        path = os.path.join(current_app.instance_path, 'oauth_local_key.pem')
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(RSAKey.generate_key(2048).as_pem(private=True))
+            try:
+                os.link(tmp, path)  # the first worker wins, the others read its key
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        with open(path, 'rb') as f:
+            pem = f.read()
+        # the key id is derived from the key, so it is the same in every worker
+        kid = RSAKey.import_key(pem).thumbprint()[:16]
+        _key = RSAKey.import_key(pem, parameters={'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return _key
+
+
+def _serializer(salt):
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=salt)
+
+
+def _cached(payload):
+    resp = jsonify(payload)
+    resp.headers['Cache-Control'] = f'public, max-age={DOCUMENT_MAX_AGE}'
+    return resp
+
+
+def _error(error, code=400):
+    return jsonify({'error': error}), code
+
+
+def _claims(login):
+    return {'sub': f'local-{login}', 'email': f'{login}@oauth.local', 'email_verified': True, 'name': login}
+
+
+@provider_bp.route('/.well-known/openid-configuration')
+def discovery():
+    return _cached({
+        'issuer': BASE_URL,
+        'authorization_endpoint': BASE_URL + '/authorize',
+        'token_endpoint': BASE_URL + '/token',
+        'userinfo_endpoint': BASE_URL + '/userinfo',
+        'jwks_uri': BASE_URL + '/jwks',
+        'response_types_supported': ['code'],
+        'subject_types_supported': ['public'],
+        'id_token_signing_alg_values_supported': ['RS256'],
+        'scopes_supported': ['openid', 'email', 'profile'],
+        'token_endpoint_auth_methods_supported': ['client_secret_basic', 'client_secret_post'],
+    })
+
+
+@provider_bp.route('/jwks')
+def jwks():
+    return _cached({'keys': [_signing_key().as_dict(private=False)]})
+
+
+@provider_bp.route('/authorize')
+def authorize():
+    args = request.args
+    if args.get('client_id') != CLIENT_ID:
+        return _error('invalid_client')
+    if args.get('response_type') != 'code' or not args.get('redirect_uri'):
+        return _error('invalid_request')
+    code = _serializer('code').dumps({'login': args.get('login_hint') or 'tester',
+                                      'nonce': args.get('nonce'),
+                                      'redirect_uri': args['redirect_uri']})
+    query = {'code': code}
+    if args.get('state'):
+        query['state'] = args['state']
+    sep = '&' if '?' in args['redirect_uri'] else '?'
+    return redirect(f"{args['redirect_uri']}{sep}{urlencode(query)}")
+
+
+@provider_bp.route('/token', methods=['POST'])
+def token():
+    auth = request.authorization
+    client_id, secret = (auth.username, auth.password) if auth else (
+        request.form.get('client_id'), request.form.get('client_secret'))
+    if client_id != CLIENT_ID or secret != CLIENT_SECRET:
+        return _error('invalid_client', 401)
+    if request.form.get('grant_type') != 'authorization_code':
+        return _error('unsupported_grant_type')
+    try:
+        data = _serializer('code').loads(request.form.get('code', ''), max_age=CODE_TTL)
+    except BadSignature:
+        return _error('invalid_grant')
+    if data['redirect_uri'] != request.form.get('redirect_uri'):
+        return _error('invalid_grant')
+    now = int(time.time())
+    claims = dict(_claims(data['login']), iss=BASE_URL, aud=CLIENT_ID, iat=now, exp=now + TOKEN_TTL)
+    if data.get('nonce'):
+        claims['nonce'] = data['nonce']
+    key = _signing_key()
+    id_token = jwt.encode({'alg': 'RS256', 'kid': key.kid}, claims, key)
+    return jsonify({'access_token': _serializer('access').dumps(data['login']), 'token_type': 'Bearer',
+                    'expires_in': TOKEN_TTL, 'scope': 'openid email profile', 'id_token': id_token})
+
+
+@provider_bp.route('/userinfo')
+def userinfo():
+    auth = request.headers.get('Authorization', '')
+    try:
+        login = _serializer('access').loads(auth.removeprefix('Bearer '), max_age=TOKEN_TTL)
+    except BadSignature:
+        return _error('invalid_token', 401)
+    return jsonify(_claims(login))
+
+
+class InProcessAdapter(BaseAdapter):
+    """requests transport that hands requests for the stand-in to the Flask app directly."""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if LATENCY:
+            time.sleep(LATENCY)
+        url = urlsplit(request.url)
+        body = request.body.encode() if isinstance(request.body, str) else request.body
+        with self.app.test_client() as client:
+            result = client.open(url.path, method=request.method, query_string=url.query,
+                                 headers=dict(request.headers), data=body)
+        resp = Response()
+        resp.status_code = result.status_code
+        resp.headers = CaseInsensitiveDict(result.headers)
+        resp._content = result.get_data()
+        resp.encoding = 'utf-8'
+        resp.url = request.url
+        resp.request = request
+        resp.reason = result.status.partition(' ')[2]
+        return resp
+
+    def close(self):
+        pass
+
+
+def mount(session, app):
+    """Route the session's requests for the stand-in to `app` in-process."""
+    session.mount(BASE_URL, InProcessAdapter(app))
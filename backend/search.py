@@ -0,0 +1,256 @@
+"""Full-text search over workout notes and exercise names.
+
+SQLite: an FTS5 table `workout_search` (rowid = workout.id) using the
+unicode61 tokenizer with remove_diacritics, so "drep" finds "Dřep". The
+owner is indexed as a token ('u<id>') so the per-user filter is part of the
+MATCH instead of a scan over every user's hits. The table is kept in sync by
+triggers on `workout` and `workout_exercise`, which also covers bulk writes
+that bypass the ORM.
+
+Postgres: a plain `workout_search` table with a tsvector column and a GIN
+index, maintained by plpgsql triggers. Text goes through `unaccent` when the
+extension is available.
+
+If neither is available (SQLite built without FTS5) search falls back to a
+LIKE scan, which is slow and accent-sensitive but keeps the endpoint working.
+"""
+import re
+
+from sqlalchemy import text
+
+from backend import db, sharding
+
+SNIPPET_OPEN = '**'
+SNIPPET_CLOSE = '**'
+MAX_PER_PAGE = 50
+
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS workout_search USING fts5(
+        owner, note, exercises,
+        tokenize = 'unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_ai AFTER INSERT ON workout BEGIN
+        INSERT INTO workout_search(rowid, owner, note, exercises)
+        VALUES (NEW.id, 'u' || NEW.user_id, COALESCE(NEW.note, ''), '');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_au AFTER UPDATE OF note, user_id ON workout BEGIN
+        UPDATE workout_search SET note = COALESCE(NEW.note, ''), owner = 'u' || NEW.user_id WHERE rowid = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_ad AFTER DELETE ON workout BEGIN
+        DELETE FROM workout_search WHERE rowid = OLD.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_eai AFTER INSERT ON workout_exercise BEGIN
+        UPDATE workout_search SET exercises =
+            (SELECT COALESCE(group_concat(name, ' '), '') FROM workout_exercise WHERE workout_id = NEW.workout_id)
+        WHERE rowid = NEW.workout_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_eau AFTER UPDATE OF name ON workout_exercise BEGIN
+        UPDATE workout_search SET exercises =
+            (SELECT COALESCE(group_concat(name, ' '), '') FROM workout_exercise WHERE workout_id = NEW.workout_id)
+        WHERE rowid = NEW.workout_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workout_search_ead AFTER DELETE ON workout_exercise BEGIN
+        UPDATE workout_search SET exercises =
+            (SELECT COALESCE(group_concat(name, ' '), '') FROM workout_exercise WHERE workout_id = OLD.workout_id)
+        WHERE rowid = OLD.workout_id;
+    END""",
+]
+
+_SQLITE_BACKFILL = """
+    INSERT INTO workout_search(rowid, owner, note, exercises)
+    SELECT w.id, 'u' || w.user_id, COALESCE(w.note, ''),
+           COALESCE((SELECT group_concat(e.name, ' ') FROM workout_exercise e WHERE e.workout_id = w.id), '')
+    FROM workout w
+"""
+
+_PG_DDL = [
+    """CREATE TABLE IF NOT EXISTS workout_search (
+        workout_id INTEGER PRIMARY KEY REFERENCES workout(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL,
+        note TEXT NOT NULL DEFAULT '',
+        exercises TEXT NOT NULL DEFAULT '',
+        document tsvector NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS ix_workout_search_document ON workout_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_workout_search_user ON workout_search (user_id)",
+    """CREATE OR REPLACE FUNCTION fittrack_fold(t TEXT) RETURNS TEXT AS $$
+    BEGIN
+        BEGIN
+            RETURN unaccent(lower(t));
+        EXCEPTION WHEN undefined_function THEN
+            RETURN lower(t);
+        END;
+    END $$ LANGUAGE plpgsql STABLE""",
+    """CREATE OR REPLACE FUNCTION workout_search_refresh(wid INTEGER) RETURNS VOID AS $$
+        INSERT INTO workout_search (workout_id, user_id, note, exercises, document)
+        SELECT w.id, w.user_id, COALESCE(w.note, ''), COALESCE(x.names, ''),
+               to_tsvector('simple', fittrack_fold(COALESCE(w.note, '') || ' ' || COALESCE(x.names, '')))
+        FROM workout w
+        LEFT JOIN (SELECT workout_id, string_agg(name, ' ' ORDER BY id) AS names
+                   FROM workout_exercise WHERE workout_id = wid GROUP BY workout_id) x ON x.workout_id = w.id
+        WHERE w.id = wid
+        ON CONFLICT (workout_id) DO UPDATE SET user_id = EXCLUDED.user_id, note = EXCLUDED.note,
+            exercises = EXCLUDED.exercises, document = EXCLUDED.document
+    $$ LANGUAGE sql""",
+    """CREATE OR REPLACE FUNCTION workout_search_trigger() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'workout' THEN
+            IF TG_OP <> 'DELETE' THEN PERFORM workout_search_refresh(NEW.id); END IF;
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM workout_search_refresh(OLD.workout_id);
+        ELSE
+            PERFORM workout_search_refresh(NEW.workout_id);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS workout_search_w ON workout",
+    """CREATE TRIGGER workout_search_w AFTER INSERT OR UPDATE OF note, user_id ON workout
+        FOR EACH ROW EXECUTE FUNCTION workout_search_trigger()""",
+    "DROP TRIGGER IF EXISTS workout_search_e ON workout_exercise",
+    """CREATE TRIGGER workout_search_e AFTER INSERT OR UPDATE OF name OR DELETE ON workout_exercise
+        FOR EACH ROW EXECUTE FUNCTION workout_search_trigger()""",
+]
+
+
+def _run(sql, params=None):
+    """Execute raw SQL on the workout tables (routed to the current shard when sharding is on)."""
+    return db.session.execute(text(sql), params or {}, bind_arguments=sharding.raw_args())
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _has_fts5():
+    try:
+        rows = db.session.execute(text('PRAGMA compile_options')).fetchall()
+        return any(r[0] == 'ENABLE_FTS5' for r in rows)
+    except Exception:
+        return False
+
+
+def fts_available():
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        return True
+    return dialect == 'sqlite' and _has_fts5()
+
+
+def _table_exists():
+    if _dialect() == 'postgresql':
+        return _run("SELECT to_regclass('workout_search')").scalar() is not None
+    return _run("SELECT 1 FROM sqlite_master WHERE name = 'workout_search'").first() is not None
+
+
+def ensure_search_index(rebuild=False):
+    """Create the search table and triggers; backfill when newly created or on rebuild."""
+    if not fts_available():
+        return False
+    for _ in sharding.each_shard():
+        _ensure_one(rebuild)
+    return True
+
+
+def _ensure_one(rebuild):
+    existed = _table_exists()
+    if _dialect() == 'postgresql':
+        try:
+            _run('CREATE EXTENSION IF NOT EXISTS unaccent')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        for stmt in _PG_DDL:
+            _run(stmt)
+        if rebuild or not existed:
+            _run('DELETE FROM workout_search')
+            _run('SELECT workout_search_refresh(id) FROM workout')
+    else:
+        for stmt in _SQLITE_DDL:
+            _run(stmt)
+        if rebuild or not existed:
+            _run('DELETE FROM workout_search')
+            _run(_SQLITE_BACKFILL)
+    db.session.commit()
+
+
+def drop_search_index():
+    for _ in sharding.each_shard():
+        if _dialect() == 'postgresql':
+            _run('DROP TABLE IF EXISTS workout_search CASCADE')
+        else:
+            _run('DROP TABLE IF EXISTS workout_search')
+    db.session.commit()
+
+
+def _terms(q):
+    return re.findall(r'\w+', q or '', flags=re.UNICODE)[:10]
+
+
+def search_workouts(user_id, q, page=1, per_page=20):
+    """Return (total, hits) for the user's workouts matching all words of `q` (prefix match)."""
+    terms = _terms(q)
+    if not terms:
+        return 0, []
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    page = max(1, int(page))
+    offset = (page - 1) * per_page
+    dialect = _dialect()
+
+    if dialect == 'sqlite' and _has_fts5():
+        words = ' '.join('"%s"*' % t.replace('"', '') for t in terms)
+        match = f'owner:u{int(user_id)} AND {{note exercises}}: ({words})'
+        params = {'match': match, 'limit': per_page, 'offset': offset}
+        total = _run("SELECT count(*) FROM workout_search WHERE workout_search MATCH :match", params).scalar()
+        note_snip = f"snippet(workout_search, 1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 12)"
+        ex_snip = f"snippet(workout_search, 2, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 12)"
+        rows = _run(f"""
+            SELECT s.rowid, w.date, w.note, s.exercises,
+                   CASE WHEN instr({note_snip}, '{SNIPPET_OPEN}') > 0 THEN {note_snip} ELSE {ex_snip} END,
+                   bm25(workout_search)
+            FROM workout_search s JOIN workout w ON w.id = s.rowid
+            WHERE workout_search MATCH :match
+            ORDER BY bm25(workout_search), w.date DESC
+            LIMIT :limit OFFSET :offset""", params).fetchall()
+        return total, [_hit(r) for r in rows]
+
+    if dialect == 'postgresql':
+        tsq = ' & '.join(re.sub(r"[^\w]", '', t) + ':*' for t in terms)
+        params = {'uid': user_id, 'tsq': tsq, 'limit': per_page, 'offset': offset}
+        total = _run("""
+            SELECT count(*) FROM workout_search
+            WHERE user_id = :uid AND document @@ to_tsquery('simple', fittrack_fold(:tsq))""", params).scalar()
+        rows = _run(f"""
+            SELECT s.workout_id, w.date, w.note, s.exercises,
+                   ts_headline('simple', s.note || ' ' || s.exercises, to_tsquery('simple', fittrack_fold(:tsq)),
+                               'StartSel={SNIPPET_OPEN}, StopSel={SNIPPET_CLOSE}, MaxWords=20, MinWords=5'),
+                   -ts_rank(s.document, to_tsquery('simple', fittrack_fold(:tsq))) AS rank
+            FROM workout_search s JOIN workout w ON w.id = s.workout_id
+            WHERE s.user_id = :uid AND s.document @@ to_tsquery('simple', fittrack_fold(:tsq))
+            ORDER BY rank, w.date DESC
+            LIMIT :limit OFFSET :offset""", params).fetchall()
+        return total, [_hit(r) for r in rows]
+
+    return _search_like(user_id, terms, per_page, offset)
+
+
+def _search_like(user_id, terms, per_page, offset):
+    from backend.models import Workout, WorkoutExercise
+    q = Workout.query.filter(Workout.user_id == user_id)
+    for t in terms:
+        like = f'%{t}%'
+        q = q.filter(db.or_(Workout.note.ilike(like),
+                            Workout.exercises.any(WorkoutExercise.name.ilike(like))))
+    total = q.count()
+    hits = []
+    for w in q.order_by(Workout.date.desc()).limit(per_page).offset(offset):
+        names = ' '.join(e.name for e in w.exercises)
+        hits.append(_hit((w.id, w.date, w.note, names, (w.note or names)[:80], 0.0)))
+    return total, hits
+
+
+def _hit(row):
+    wid, wdate, note, exercises, snippet, rank = row
+    if isinstance(wdate, str):
+        date_s = wdate
+    else:
+        date_s = wdate.isoformat()
+    return {'id': wid, 'date': date_s, 'note': note or '', 'exercises': exercises or '',
+            'snippet': snippet or '', 'rank': round(float(rank or 0.0), 6)}
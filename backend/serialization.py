@@ -0,0 +1,188 @@
+"""Column-level queries and fast JSON encoding for API responses.
+
+List/export endpoints used to hydrate full ORM objects (plus a lazy load of
+`exercises` per workout) and run everything through Flask's stdlib JSON
+provider. The helpers here select only the needed columns as plain tuples,
+wrap them in small `__slots__` DTOs and encode them in one `json.dumps` call.
+
+The output is byte for byte that of the old `jsonify` responses: same keys,
+sorted, compact separators, \\u escapes and a trailing newline
+(scripts/check_serialization.py compares the two on real API payloads).
+FITTRACK_JSON_BACKEND=orjson encodes with orjson instead, when installed. It
+is faster but not byte-compatible: non-ASCII text comes out as UTF-8 and
+exponents lose their sign and padding (`2e-6` and `1e16` instead of `2e-06`
+and `1e+16`), which decodes to the same values.
+"""
+import heapq
+import json
+import os
+
+from flask import current_app
+from sqlalchemy import func
+
+from backend import archive, db, sharding
+from backend.models import User, Workout, WorkoutExercise
+
+try:
+    import orjson
+except Exception:  # optional dependency
+    orjson = None
+
+USE_ORJSON = orjson is not None and os.getenv('FITTRACK_JSON_BACKEND', 'stdlib').lower() == 'orjson'
+
+
+def dumps(obj):
+    """Encode `obj` like Flask's jsonify (sorted keys, compact) and return bytes."""
+    if USE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=True) + '\n').encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Drop-in replacement for `jsonify(payload), status` using the fast encoder."""
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+class WorkoutSummary:
+    __slots__ = ('id', 'date', 'note', 'exercise_count', 'total_sets', 'total_volume', 'max_weight')
+
+    def __init__(self, id, date, note, exercise_count, total_sets, total_volume, max_weight):
+        self.id = id
+        self.date = date
+        self.note = note
+        self.exercise_count = exercise_count
+        self.total_sets = total_sets
+        self.total_volume = total_volume
+        self.max_weight = max_weight
+
+    def to_dict(self):
+        return {'id': self.id, 'date': self.date.isoformat(), 'note': self.note or '',
+                'exercise_count': self.exercise_count, 'total_sets': self.total_sets,
+                'total_volume': round(self.total_volume, 2), 'max_weight': self.max_weight}
+
+
+# the workout row carries its exercise summary (backend/summaries.py): no join needed
+SUMMARY_COLUMNS = (Workout.id, Workout.date, Workout.note, Workout.exercise_count, Workout.total_sets,
+                   Workout.total_volume, Workout.max_weight)
+
+
+class ExerciseRow:
+    __slots__ = ('id', 'name', 'sets', 'reps', 'weight')
+
+    def __init__(self, id, name, sets, reps, weight):
+        self.id = id
+        self.name = name
+        self.sets = sets
+        self.reps = reps
+        self.weight = weight
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'sets': self.sets, 'reps': self.reps, 'weight': self.weight}
+
+
+def workout_summaries(user_id, limit=None):
+    """Newest-first WorkoutSummary list for a user (hot rows in one query, plus the archive)."""
+    q = (db.session.query(*SUMMARY_COLUMNS)
+         .filter(Workout.user_id == user_id)
+         .order_by(Workout.date.desc(), Workout.id.desc()))
+    if limit is not None:
+        q = q.limit(limit)
+    rows = q.all()
+    archived = archive.summaries(user_id)
+    if archived:
+        rows = sorted(rows + archived, key=lambda r: (r[1], r[0]), reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+    return [WorkoutSummary(*row) for row in rows]
+
+
+def workout_page(user_id, page, per_page):
+    """(total, WorkoutSummary list) for one newest-first page of the user's workouts.
+
+    Archived workouts can sort between hot ones, so with an archive the first
+    page*per_page hot rows are merged with the archived summaries before slicing.
+    """
+    offset = (page - 1) * per_page
+    archived = archive.summaries(user_id)
+    total = (db.session.query(func.count(Workout.id)).filter(Workout.user_id == user_id).scalar()
+             + len(archived))
+    q = (db.session.query(*SUMMARY_COLUMNS)
+         .filter(Workout.user_id == user_id)
+         .order_by(Workout.date.desc(), Workout.id.desc()))
+    if archived:
+        rows = sorted(q.limit(offset + per_page).all() + archived,
+                      key=lambda r: (r[1], r[0]), reverse=True)[offset:offset + per_page]
+    else:
+        rows = q.limit(per_page).offset(offset).all()
+    return total, [WorkoutSummary(*row) for row in rows]
+
+
+def workout_detail(user_id, wid):
+    """Detail payload dict for one workout or None if it doesn't belong to the user."""
+    head = (db.session.query(Workout.id, Workout.date, Workout.note)
+            .filter(Workout.id == wid, Workout.user_id == user_id).first())
+    if head is None:
+        return archive.detail(user_id, wid)
+    rows = (db.session.query(WorkoutExercise.id, WorkoutExercise.name, WorkoutExercise.sets,
+                             WorkoutExercise.reps, WorkoutExercise.weight)
+            .filter(WorkoutExercise.workout_id == wid).order_by(WorkoutExercise.id))
+    return {'id': head[0], 'date': head[1].isoformat(), 'note': head[2] or '',
+            'exercises': [ExerciseRow(*r).to_dict() for r in rows]}
+
+
+def _export_query(user_id):
+    return (db.session.query(Workout.id, Workout.date, Workout.note, WorkoutExercise.name,
+                             WorkoutExercise.sets, WorkoutExercise.reps, WorkoutExercise.weight)
+            .join(WorkoutExercise, WorkoutExercise.workout_id == Workout.id)
+            .filter(Workout.user_id == user_id)
+            .order_by(Workout.id, WorkoutExercise.id))
+
+
+def export_rows(user_id):
+    """(workout id, date, note, name, sets, reps, weight) tuples for the CSV export."""
+    rows = _export_query(user_id).all()
+    archived = archive.export_rows(user_id)
+    if archived:
+        rows = sorted(archived + rows, key=lambda r: r[0])
+    return rows
+
+
+def iter_export_rows(user_id, batch=1000):
+    """Same rows as export_rows, fetched in batches for streamed exports."""
+    hot = _export_query(user_id).yield_per(batch)
+    archived = archive.export_rows(user_id)
+    if not archived:
+        return hot
+    return heapq.merge(archived, hot, key=lambda r: r[0])
+
+
+def admin_user_rows():
+    """Admin listing with workout counts from a single grouped query.
+
+    With sharding the counts are gathered from every shard and merged, and
+    archived workouts are added from the archive index.
+    """
+    archived = archive.archived_counts()
+    if sharding.enabled() or archived:
+        counts = {}
+        for _ in sharding.each_shard():
+            counts.update(db.session.query(Workout.user_id, func.count(Workout.id)).group_by(Workout.user_id))
+        q = ((uid, username, email, provider, created, counts.get(uid, 0) + archived.get(uid, 0))
+             for uid, username, email, provider, created in
+             db.session.query(User.id, User.username, User.email, User.oauth_provider, User.created_at)
+             .order_by(User.id.asc()))
+    else:
+        counts = (db.session.query(Workout.user_id.label('uid'), func.count(Workout.id).label('n'))
+                  .group_by(Workout.user_id).subquery())
+        q = (db.session.query(User.id, User.username, User.email, User.oauth_provider, User.created_at,
+                              func.coalesce(counts.c.n, 0))
+             .outerjoin(counts, counts.c.uid == User.id)
+             .order_by(User.id.asc()))
+    return [{
+        'id': uid,
+        'username': username,
+        'email': email or '',
+        'oauth_provider': provider or '',
+        'created_at': created.isoformat() if created else '',
+        'workout_count': n,
+    } for uid, username, email, provider, created, n in q]
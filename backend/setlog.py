@@ -0,0 +1,353 @@
+"""Live workout sessions: per-set logging with buffered, append-only writes.
+
+A session is a workout logged set by set while it happens:
+
+    POST /api/sessions                   start (creates the workout)
+    POST /api/sessions/<id>/sets         log one set or a batch, answered at once
+    GET  /api/sessions/<id>              the sets logged so far
+    POST /api/sessions/<id>/finish       roll the sets up into WorkoutExercise rows
+
+Logging a set does not write to the database. Every worker appends the sets
+it accepts to a write-ahead file under FITTRACK_SETLOG_DIR (JSON lines,
+fsynced unless FITTRACK_SETLOG_FSYNC=0) and keeps them in memory; a
+background thread inserts them into `set_log` in one transaction once
+FITTRACK_SETLOG_FLUSH_SIZE sets are waiting or FITTRACK_SETLOG_FLUSH_MS have
+passed, and at shutdown. Many users logging at once therefore cost a few
+batched inserts per second per worker instead of one write transaction
+(and one SQLite write lock) per set.
+
+Each worker writes its own segment files, holding an flock on the ones not
+yet in the database. After an insert commits, its segment is deleted. A
+segment nobody holds is left over from a crashed worker: the next worker
+that starts replays it. Every set carries a time-ordered `uid` and inserts
+ignore a uid the session already has, so a replay of sets that were already
+inserted is harmless; clients may send their own `id` (32 hex digits) to make
+resending a set safe as well. Uids are unique per session (user and workout),
+so an id another session happens to use does not swallow the set.
+
+Finishing flushes this worker's buffer and reads the sets of the session
+still waiting in other workers' segments, so the rollup sees all of them.
+Sets become WorkoutExercise rows per exercise, weight and reps in the order
+they were first logged (3 x 10 at 60 kg, then 2 x 8 at 70 kg gives two rows),
+which keeps volume and records exact. This assumes the workers share one
+disk (one host); a set accepted while the session finishes can miss the
+summary, it stays in `set_log`.
+
+Configuration (environment):
+    FITTRACK_SETLOG_DIR         write-ahead files (default instance/setlog)
+    FITTRACK_SETLOG_FLUSH_SIZE  sets buffered before an insert (default 200)
+    FITTRACK_SETLOG_FLUSH_MS    longest time a set waits for its insert (default 1000)
+    FITTRACK_SETLOG_FSYNC       1 (default): fsync each append, 0: survive process but not OS crashes
+"""
+import atexit
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from backend import app, db
+from backend.models import SetLog, WorkoutSession
+
+try:
+    import fcntl
+except ImportError:  # Windows: orphaned segments are recognised by age instead
+    fcntl = None
+
+DIRECTORY = os.getenv('FITTRACK_SETLOG_DIR') or os.path.join(app.instance_path, 'setlog')
+FLUSH_SIZE = int(os.getenv('FITTRACK_SETLOG_FLUSH_SIZE', '200'))
+FLUSH_SECONDS = int(os.getenv('FITTRACK_SETLOG_FLUSH_MS', '1000')) / 1000
+FSYNC = os.getenv('FITTRACK_SETLOG_FSYNC', '1') != '0'
+ORPHAN_AGE = 300  # without flock: seconds without a write after which a segment counts as orphaned
+MAX_BATCH = 500  # sets per request
+
+logger = logging.getLogger('fittrack')
+_starting = threading.Lock()
+
+
+def new_uid():
+    """16 bytes: milliseconds first, so ids (and the unique index) grow in time order."""
+    return int(time.time() * 1000).to_bytes(6, 'big') + os.urandom(10)
+
+
+def _insert(rows):
+    """Insert set rows (dicts with bytes uids), skipping uids already stored for their session.
+
+    A row the database rejects is dropped (and logged) instead of blocking
+    the rows buffered with it forever.
+    """
+    if not rows:
+        return
+    table = SetLog.__table__
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).on_conflict_do_nothing(index_elements=['user_id', 'workout_id', 'uid'])
+    else:
+        stmt = table.insert().prefix_with('OR IGNORE')
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(stmt, rows)
+    except IntegrityError:
+        for row in rows:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, row)
+            except IntegrityError:
+                logger.error('dropping invalid logged set %r', row)
+
+
+def _decode(line):
+    row = json.loads(line)
+    row['uid'] = bytes.fromhex(row['uid'])
+    return row
+
+
+def _read_segment(path):
+    """The set rows of a segment; a torn last line (crash mid-write) is skipped."""
+    rows = []
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    rows.append(_decode(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+class _Segment:
+    """One write-ahead file of this worker, locked while it holds sets not in the database."""
+    __slots__ = ('path', 'fd', 'rows')
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.rows = []
+
+    def append(self, rows):
+        os.write(self.fd, b''.join(json.dumps(dict(r, uid=r['uid'].hex())).encode() + b'\n' for r in rows))
+        if FSYNC:
+            os.fsync(self.fd)
+        self.rows.extend(rows)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)
+
+
+class SetBuffer:
+    """This worker's sets on their way to `set_log`; see the module docstring."""
+
+    def __init__(self, directory=DIRECTORY, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._pid = None
+
+    def _start(self):
+        """Per-process state, created on first use (after gunicorn forked the worker)."""
+        # the random part keeps a reused pid from picking up an orphaned segment
+        self._prefix = f'{os.getpid()}-{os.urandom(4).hex()}-'
+        self._lock = threading.Lock()        # current segment
+        self._flush_lock = threading.Lock()  # one insert at a time
+        self._current = None
+        self._waiting = []                   # segments handed to the flusher, oldest first
+        self._oldest = None
+        self._seq = itertools.count()
+        self._wake = threading.Event()
+        self._closed = False
+        self.stats = {'appended': 0, 'flushes': 0, 'inserted': 0, 'recovered': 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='setlog-flush', daemon=True).start()
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            with _starting:
+                if self._pid != os.getpid():
+                    self._start()
+
+    def append(self, rows):
+        """Make the sets durable in the write-ahead file and queue them for insertion."""
+        self._ensure_started()
+        with self._lock:
+            if self._current is None:
+                self._current = _Segment(os.path.join(self.directory, f'{self._prefix}{next(self._seq)}.wal'))
+                self._oldest = time.monotonic()
+            self._current.append(rows)
+            self.stats['appended'] += len(rows)
+            full = len(self._current.rows) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Insert everything buffered so far; returns the number of sets written."""
+        self._ensure_started()
+        with self._flush_lock:
+            with self._lock:
+                if self._current is not None:
+                    self._waiting.append(self._current)
+                    self._current = None
+                    self._oldest = None
+                segments = list(self._waiting)
+            if not segments:
+                return 0
+            rows = [r for seg in segments for r in seg.rows]
+            with app.app_context():
+                _insert(rows)
+            for seg in segments:
+                seg.discard()
+            with self._lock:
+                del self._waiting[:len(segments)]
+            self.stats['flushes'] += 1
+            self.stats['inserted'] += len(rows)
+            return len(rows)
+
+    def _run(self):
+        self.recover()
+        while not self._closed:
+            self._wake.wait(self.flush_seconds / 2)
+            self._wake.clear()
+            with self._lock:
+                due = self._current is not None and (
+                    len(self._current.rows) >= self.flush_size
+                    or time.monotonic() - self._oldest >= self.flush_seconds)
+                due = due or bool(self._waiting)  # an earlier insert failed: retry
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('flushing logged sets failed, retrying')
+                    time.sleep(self.flush_seconds)
+
+    def recover(self):
+        """Insert the sets of segments left by crashed workers and delete them."""
+        for path in glob.glob(os.path.join(self.directory, '*.wal')):
+            if os.path.basename(path).startswith(self._prefix):
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # its worker is alive
+                elif time.time() - os.fstat(fd).st_mtime < ORPHAN_AGE:
+                    continue
+                rows = _read_segment(path)
+                with app.app_context():
+                    _insert(rows)
+                os.remove(path)
+                self.stats['recovered'] += len(rows)
+                logger.warning('replayed %d logged sets from %s', len(rows), path)
+            except Exception:
+                logger.exception('replaying %s failed', path)
+            finally:
+                os.close(fd)
+
+    def pending(self, user_id, workout_id):
+        """Sets of the user's workout not in `set_log` yet, from the segments of all workers."""
+        rows = []
+        for path in glob.glob(os.path.join(self.directory, '*.wal')):
+            rows.extend(r for r in _read_segment(path)
+                        if r['workout_id'] == workout_id and r['user_id'] == user_id)
+        return rows
+
+    def close(self):
+        """Flush at shutdown (atexit and the gunicorn worker_exit hook)."""
+        if self._pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('flushing logged sets at shutdown failed; the write-ahead file keeps them')
+
+
+buffer = SetBuffer()
+
+
+def parse_set(data, user_id, workout_id):
+    """A set row from the request JSON, or raise ValueError with the message for a 400."""
+    name = (data.get('exercise') or '').strip()
+    if not name or len(name) > 120:
+        raise ValueError('exercise required (at most 120 characters)')
+    try:
+        reps = int(data.get('reps'))
+        weight = None if data.get('weight') is None else float(data['weight'])
+        rpe = None if data.get('rpe') is None else float(data['rpe'])
+        rest_s = None if data.get('rest_s') is None else int(data['rest_s'])
+        uid = bytes.fromhex(data['id']) if data.get('id') else new_uid()
+    except (TypeError, ValueError):
+        raise ValueError('invalid set') from None
+    if not 0 <= reps <= 1000 or (weight is not None and not 0 <= weight <= 2000) \
+            or (rpe is not None and not 1 <= rpe <= 10) or (rest_s is not None and not 0 <= rest_s <= 3600) \
+            or len(uid) != 16:
+        raise ValueError('invalid set')
+    return {'uid': uid, 'user_id': user_id, 'workout_id': workout_id, 'exercise': name, 'reps': reps,
+            'weight': weight, 'rpe': rpe, 'rest_s': rest_s, 'logged_at': time.time()}
+
+
+def session_sets(user_id, workout_id, flush=False):
+    """All sets of the session in logging order, stored or still buffered by any worker.
+
+    Sessions are identified by user and workout id together: with sharding
+    on, workouts of different users share ids. flush=True first writes them
+    all to `set_log` (before a rollup).
+    """
+    if flush:
+        buffer.flush()
+        _insert(buffer.pending(user_id, workout_id))
+    stored = [dict(r._mapping) for r in db.session.execute(text(
+        'SELECT uid, user_id, workout_id, exercise, reps, weight, rpe, rest_s, logged_at FROM set_log '
+        'WHERE user_id = :u AND workout_id = :w ORDER BY logged_at, id'), {'u': user_id, 'w': workout_id})]
+    if flush:
+        return stored
+    rows = {r['uid']: r for r in buffer.pending(user_id, workout_id)}
+    rows.update((r['uid'], r) for r in stored)
+    return sorted(rows.values(), key=lambda r: r['logged_at'])
+
+
+def rollup(sets):
+    """[(name, sets, reps, weight), ...] for WorkoutExercise rows, in order of first appearance."""
+    groups = {}
+    for s in sets:
+        key = (s['exercise'], s['reps'], s['weight'])
+        groups[key] = groups.get(key, 0) + 1
+    return [(name, count, reps, weight) for (name, reps, weight), count in groups.items()]
+
+
+def to_dict(row):
+    return {'id': row['uid'].hex(), 'exercise': row['exercise'], 'reps': row['reps'], 'weight': row['weight'],
+            'rpe': row['rpe'], 'rest_s': row['rest_s'], 'logged_at': row['logged_at']}
+
+
+def on_workouts_removed(user_id, workout_ids):
+    """Drop the sessions and logged sets of deleted workouts; the caller commits."""
+    for i in range(0, len(workout_ids), 500):
+        chunk = workout_ids[i:i + 500]
+        for model in (SetLog, WorkoutSession):
+            (db.session.query(model).filter(model.user_id == user_id, model.workout_id.in_(chunk))
+             .delete(synchronize_session=False))
+
+
+def on_user_removed(user_id):
+    """Drop the user's logged sets (sessions go with ON DELETE CASCADE); the caller commits."""
+    db.session.query(SetLog).filter(SetLog.user_id == user_id).delete(synchronize_session=False)
@@ -0,0 +1,341 @@
+"""Optional horizontal sharding of workout data by user.
+
+With FITTRACK_SHARDS=N (N >= 1) the `workout`, `workout_exercise` and
+`workout_search` tables live in N separate databases, while `user` and the
+small per-user/global tables (stats, leaderboards, ...) stay in the main
+database. Each shard is a Flask-SQLAlchemy bind named `shard<i>`:
+
+    FITTRACK_SHARDS       number of shards (default 0 = off)
+    FITTRACK_SHARD_URLS   comma-separated database URLs, one per shard; the
+                          default is instance/shard-<i>.sqlite3. For Postgres
+                          schemas use one URL per schema with
+                          ?options=-csearch_path%3Dshard_<i>
+
+A user's shard is stored in `User.shard` when the user is created (a stable
+hash of the id) and only changes when scripts/rebalance_shards.py moves the
+user. `RoutingSession.get_bind` sends every statement that touches a sharded
+table to the shard of, in order: an explicit `use_shard()` / `use_user()`
+block, or the logged-in user of the current request. API code therefore
+needs no changes; code that works across users (admin listings, batch jobs)
+iterates `each_shard()` and merges the results (scatter-gather). Statements
+that join sharded and global tables raise ShardRoutingError.
+
+Writes that touch a shard and the main database (e.g. a workout plus the
+user's data_version) commit one database after the other, not atomically.
+Derived data can be repaired with the rebuild scripts.
+"""
+import contextlib
+import contextvars
+import hashlib
+import logging
+import os
+import time
+
+import sqlalchemy as sa
+from flask import has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.util import find_tables
+
+logger = logging.getLogger('fittrack.sharding')
+
+SHARD_COUNT = int(os.getenv('FITTRACK_SHARDS', '0'))
+SHARDED_TABLES = frozenset({'workout', 'workout_exercise', 'workout_search'})
+
+_forced_shard = contextvars.ContextVar('fittrack_shard', default=None)
+
+
+class ShardRoutingError(RuntimeError):
+    pass
+
+
+def enabled():
+    return SHARD_COUNT >= 1
+
+
+def bind_key(index):
+    return f'shard{index}'
+
+
+def shard_urls(instance_path):
+    urls = [u.strip() for u in os.getenv('FITTRACK_SHARD_URLS', '').split(',') if u.strip()]
+    if urls:
+        if len(urls) != SHARD_COUNT:
+            raise ValueError(f'FITTRACK_SHARD_URLS has {len(urls)} URLs for {SHARD_COUNT} shards')
+        return urls
+    return [f"sqlite:///{os.path.join(instance_path, f'shard-{i}.sqlite3')}" for i in range(SHARD_COUNT)]
+
+
+def bind_config(instance_path):
+    """SQLALCHEMY_BINDS entries for the shards (empty when sharding is off)."""
+    if not enabled():
+        return {}
+    return {bind_key(i): url for i, url in enumerate(shard_urls(instance_path))}
+
+
+def hash_shard(user_id, count=None):
+    """Default placement: a stable hash of the user id."""
+    count = count or SHARD_COUNT
+    digest = hashlib.blake2b(str(int(user_id)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def user_shard(user):
+    shard = getattr(user, 'shard', None)
+    return shard if shard is not None else hash_shard(user.id)
+
+
+@contextlib.contextmanager
+def use_shard(index):
+    """Route sharded tables to shard `index` inside the block."""
+    token = _forced_shard.set(index)
+    try:
+        yield index
+    finally:
+        _forced_shard.reset(token)
+
+
+def shard_of_user_id(user_id):
+    from backend import db
+    shard = db.session.execute(sa.text('SELECT shard FROM "user" WHERE id = :uid'), {'uid': user_id}).scalar()
+    return shard if shard is not None else hash_shard(user_id)
+
+
+@contextlib.contextmanager
+def use_user(user_id):
+    """Route sharded tables to the shard holding `user_id`'s data."""
+    if not enabled():
+        yield None
+        return
+    with use_shard(shard_of_user_id(user_id)) as index:
+        yield index
+
+
+def each_shard():
+    """Iterate shard indexes with routing set to each one in turn (scatter-gather).
+
+    Without sharding this yields a single None so callers need no special case.
+    """
+    if not enabled():
+        yield None
+        return
+    for i in range(SHARD_COUNT):
+        with use_shard(i):
+            yield i
+
+
+def raw_args():
+    """`bind_arguments` for raw SQL (text()) on sharded tables, which carries no table info."""
+    from backend.models import Workout
+    return {'mapper': Workout}
+
+
+def current_shard():
+    forced = _forced_shard.get()
+    if forced is not None:
+        return forced
+    if has_request_context():
+        from flask_login import current_user
+        if current_user.is_authenticated:
+            return user_shard(current_user)
+    raise ShardRoutingError('no shard selected: use sharding.use_user()/use_shard() outside requests')
+
+
+def _table_names(mapper, clause):
+    names = set()
+    if mapper is not None:
+        names.add(sa.inspect(mapper).local_table.name)
+    if isinstance(clause, sa.Table):
+        names.add(clause.name)
+    elif isinstance(clause, sa.sql.ClauseElement):
+        names.update(t.name for t in find_tables(clause, include_crud=True, include_joins=True)
+                     if isinstance(t, sa.Table))
+    return names
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends sharded tables to the selected shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and enabled():
+            names = _table_names(mapper, clause)
+            sharded = names & SHARDED_TABLES
+            if sharded:
+                if names - SHARDED_TABLES:
+                    raise ShardRoutingError(f'cross-shard join between {sorted(names)}')
+                return self._db.engines[bind_key(current_shard())]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# --- schema --------------------------------------------------------------
+
+def _shard_tables():
+    from backend.models import Workout, WorkoutExercise
+    return [Workout.__table__, WorkoutExercise.__table__]
+
+
+def shard_ddl_tables():
+    """Copies of the shard tables for CREATE TABLE, minus foreign keys into the main database.
+
+    `workout.user_id` references `user`, which does not exist in a shard; with
+    SQLite foreign key enforcement on, that reference would fail every insert.
+    """
+    md = sa.MetaData()
+    out = []
+    for table in _shard_tables():
+        cols = []
+        for c in table.columns:
+            fks = [sa.ForeignKey(fk.target_fullname, ondelete=fk.ondelete) for fk in c.foreign_keys
+                   if fk.column.table.name in SHARDED_TABLES]
+            cols.append(sa.Column(c.name, c.type, *fks, primary_key=c.primary_key, nullable=c.nullable))
+        copy = sa.Table(table.name, md, *cols,
+                        sqlite_autoincrement=bool(table.dialect_options['sqlite'].get('autoincrement')))
+        for index in table.indexes:
+            sa.Index(index.name, *[copy.c[c.name] for c in index.columns], unique=index.unique)
+        out.append(copy)
+    return out
+
+
+def create_shard_tables():
+    from backend import db, rebuild_sqlite_tables, reserve_ids
+    for i in range(SHARD_COUNT):
+        engine = db.engines[bind_key(i)]
+        tables = shard_ddl_tables()
+        for table in tables:
+            table.create(engine, checkfirst=True)
+        if 'workout' in rebuild_sqlite_tables(engine, tables):
+            from backend import archive
+            reserve_ids(engine, archive.max_ids())
+
+
+def drop_shard_tables():
+    from backend import db
+    for i in range(SHARD_COUNT):
+        engine = db.engines[bind_key(i)]
+        for table in reversed(shard_ddl_tables()):
+            table.drop(engine, checkfirst=True)
+
+
+def pin_users():
+    """Store the hash placement for users that have no shard yet."""
+    from backend import db
+    rows = db.session.execute(sa.text('SELECT id FROM "user" WHERE shard IS NULL')).fetchall()
+    for (uid,) in rows:
+        db.session.execute(sa.text('UPDATE "user" SET shard = :s WHERE id = :uid'),
+                           {'s': hash_shard(uid), 'uid': uid})
+    db.session.commit()
+    return len(rows)
+
+
+def assign_new_user(mapper, connection, target):
+    """after_insert hook on User: pin the new user to its hash shard."""
+    if not enabled() or target.shard is not None:
+        return
+    shard = hash_shard(target.id)
+    connection.execute(mapper.local_table.update().where(mapper.local_table.c.id == target.id)
+                       .values(shard=shard))
+    set_committed_value(target, 'shard', shard)
+
+
+# --- moving users ---------------------------------------------------------
+
+def _copy_rows(user_id, source, target):
+    """Copy a user's rows from `source` into `target`; returns (workout ids, exercise ids, renumbered)."""
+    from backend import db
+    workout, exercise = _shard_tables()
+    with use_shard(source):
+        workouts = [dict(r._mapping) for r in db.session.execute(
+            sa.select(workout).where(workout.c.user_id == user_id))]
+        wids = [w['id'] for w in workouts]
+        exercises = [dict(r._mapping) for r in db.session.execute(
+            sa.select(exercise).where(exercise.c.workout_id.in_(wids)))] if wids else []
+    eids = [e['id'] for e in exercises]
+    renumbered = 0
+    with use_shard(target):
+        taken_w = {r[0] for r in db.session.execute(sa.select(workout.c.id).where(workout.c.id.in_(wids)))} if wids else set()
+        taken_e = {r[0] for r in db.session.execute(sa.select(exercise.c.id).where(exercise.c.id.in_(eids)))} if eids else set()
+        # rows keep their ids where the target has them free; the rest are
+        # inserted afterwards so the new ids cannot collide with kept ones
+        keep = [w for w in workouts if w['id'] not in taken_w]
+        if keep:
+            db.session.execute(workout.insert(), keep)
+        id_map = {}
+        for w in workouts:
+            if w['id'] in taken_w:
+                old = w.pop('id')
+                id_map[old] = db.session.execute(workout.insert().values(**w)).inserted_primary_key[0]
+                renumbered += 1
+        for e in exercises:
+            e['workout_id'] = id_map.get(e['workout_id'], e['workout_id'])
+            if e['id'] in taken_e:
+                e.pop('id')
+                renumbered += 1
+        with_id = [e for e in exercises if 'id' in e]
+        if with_id:
+            db.session.execute(exercise.insert(), with_id)
+        for e in exercises:
+            if 'id' not in e:
+                db.session.execute(exercise.insert().values(**e))
+        db.session.commit()
+    return wids, eids, renumbered
+
+
+def _delete_rows(user_id, index, wids=None):
+    from backend import db
+    workout, exercise = _shard_tables()
+    with use_shard(index):
+        cond = workout.c.user_id == user_id
+        if wids is not None:
+            cond = cond & workout.c.id.in_(wids)
+        ids = sa.select(workout.c.id).where(cond)
+        db.session.execute(exercise.delete().where(exercise.c.workout_id.in_(ids)))
+        db.session.execute(workout.delete().where(cond))
+        db.session.commit()
+
+
+def move_user(user_id, target, grace=2.0, retries=3):
+    """Move one user's workouts to shard `target` and repoint `User.shard`.
+
+    The switch is a compare-and-set on `user.data_version`, which every write
+    endpoint bumps, so a write during the copy aborts and retries the move.
+    Requests already routed to the old shard when the pointer flips get
+    `grace` seconds to finish before the source rows are deleted; rows they
+    created are left in place and reported.
+    Returns a dict with the number of workouts moved and renumbered ids.
+    """
+    from backend import db
+    source = shard_of_user_id(user_id)
+    if source == target:
+        return {'user_id': user_id, 'moved': 0, 'renumbered': 0, 'left_behind': 0}
+    for _ in range(retries):
+        version = db.session.execute(sa.text('SELECT data_version FROM "user" WHERE id = :uid'),
+                                     {'uid': user_id}).scalar()
+        db.session.commit()
+        wids, _eids, renumbered = _copy_rows(user_id, source, target)
+        # new workouts on the target must not take the ids of the user's archived ones
+        from backend import archive, reserve_ids
+        reserve_ids(db.engines[bind_key(target)], archive.max_ids([user_id]))
+        switched = db.session.execute(sa.text(
+            'UPDATE "user" SET shard = :t, data_version = data_version + 1 '
+            'WHERE id = :uid AND data_version = :v'), {'t': target, 'uid': user_id, 'v': version}).rowcount
+        db.session.commit()
+        if switched:
+            break
+        _delete_rows(user_id, target)
+    else:
+        raise ShardRoutingError(f'user {user_id} kept writing during {retries} move attempts')
+    time.sleep(grace)
+    _delete_rows(user_id, source, wids)
+    with use_shard(source):
+        left = db.session.execute(sa.text('SELECT count(*) FROM workout WHERE user_id = :uid'),
+                                  {'uid': user_id}, bind_arguments=raw_args()).scalar()
+        db.session.commit()
+    if renumbered:
+        # clients hold the old ids: make their next /api/sync a full snapshot
+        from backend import changes
+        changes.invalidate(user_id)
+        db.session.commit()
+    if left:
+        logger.warning('user %s: %s workouts written to shard %s during the move were left there',
+                       user_id, left, source)
+    return {'user_id': user_id, 'moved': len(wids), 'renumbered': renumbered, 'left_behind': left}
@@ -0,0 +1,254 @@
+"""Cache shared by all workers of a host: a key-value store in SQLite (WAL).
+
+Per-process LRU caches hold one copy of every aggregate per gunicorn worker
+and start empty after each restart. `SharedCache` keeps the pickled values
+in one SQLite file instead, in WAL mode and read through mmap, so readers do
+not block the writer or each other, a value computed by one worker is a hit
+in all of them and survives restarts of the service.
+
+- Eviction is LRU under a byte cap and an entry cap. Hits refresh the use
+  time at most every TOUCH_SECONDS, so hot keys cost no write per hit.
+- `get_or_compute` lets one caller compute a missing key: threads of a
+  worker wait on a lock, other workers on a claim row (taken over after
+  CLAIM_SECONDS if its owner died) and then read the stored value.
+- Each worker keeps the last few decoded values in a small in-process
+  LRU, which makes repeated hits as cheap as with a plain dict.
+- Values must pickle. Keys are tuples of str/int/date, stored as repr().
+  Errors of the store are logged and turn into misses: the cache can be
+  deleted at any time.
+- Keys hold data versions, not database identities: the default file is
+  named after the database URL, and it is cleared when the schema is
+  created from scratch (and by the benchmark seeder), so a recreated
+  database does not meet values of the old one.
+
+Configuration (environment):
+    FITTRACK_SHARED_CACHE_PATH  file (default instance/shared_cache-<hash of the database URL>.sqlite3)
+    FITTRACK_SHARED_CACHE_MB    size cap of the stored values (default 64)
+    FITTRACK_SHARED_CACHE_L1    decoded values kept per worker (default 128)
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from backend import app
+
+PATH = os.getenv('FITTRACK_SHARED_CACHE_PATH') or os.path.join(
+    app.instance_path,
+    'shared_cache-%s.sqlite3' % hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12])
+MAX_BYTES = int(float(os.getenv('FITTRACK_SHARED_CACHE_MB', '64')) * 1024 * 1024)
+L1_ENTRIES = int(os.getenv('FITTRACK_SHARED_CACHE_L1', '128'))
+TOUCH_SECONDS = 5.0   # least time between two use-time updates of a key
+CLAIM_SECONDS = 30.0  # a computation taking longer is assumed dead and redone
+EVICT_BATCH = 32
+
+logger = logging.getLogger('fittrack')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ix_entry_used ON entry (used);
+CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL,
+                                  entries INTEGER NOT NULL);
+INSERT OR IGNORE INTO usage VALUES (0, 0, 0);
+CREATE TABLE IF NOT EXISTS claim (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+"""
+
+_MISSING = object()
+
+
+class SharedCache:
+    """LRU cache stored in a SQLite file shared by processes; the interface of cache.LRUCache."""
+
+    def __init__(self, path=PATH, max_entries=1024, max_bytes=MAX_BYTES, l1_entries=L1_ENTRIES):
+        from backend.cache import LRUCache
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._l1 = LRUCache(l1_entries) if l1_entries else None
+        self._local = threading.local()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # --- connection ------------------------------------------------------
+
+    def _conn(self):
+        """This thread's connection (a new one after fork)."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # a cache needs no fsync per commit
+            conn.execute(f'PRAGMA mmap_size={max(self.max_bytes * 2, 1 << 24)}')
+            conn.executescript(_SCHEMA)
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    # --- LRUCache interface ----------------------------------------------
+
+    def get(self, key, default=None):
+        skey = repr(key)
+        now = time.time()
+        if self._l1 is not None:
+            held = self._l1.get(skey)
+            if held is not None:
+                value, touched = held
+                if now - touched > TOUCH_SECONDS:
+                    self._touch(skey, now)
+                    self._l1.set(skey, (value, now))
+                self.hits += 1
+                return value
+        try:
+            row = self._conn().execute('SELECT value, used FROM entry WHERE key = ?', (skey,)).fetchone()
+            value = pickle.loads(row[0]) if row is not None else _MISSING
+        except Exception:
+            logger.exception('shared cache read failed')
+            row, value = None, _MISSING
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        if now - row[1] > TOUCH_SECONDS:
+            self._touch(skey, now)
+        if self._l1 is not None:
+            self._l1.set(skey, (value, now))
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        skey = repr(key)
+        now = time.time()
+        if self._l1 is not None:
+            self._l1.set(skey, (value, now))
+        try:
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logger.warning('not caching unpicklable value for %s', skey)
+            return
+        if len(blob) > self.max_bytes // 8:
+            return  # would evict most of the cache; stays in this worker only
+        try:
+            self._store(skey, blob, now)
+        except sqlite3.Error:
+            logger.exception('shared cache write failed')
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        skey = repr(key)
+        with self._flights_lock:
+            lock = self._flights.setdefault(skey, threading.Lock())
+        with lock:
+            try:
+                value = self.get(key, _MISSING)  # computed by another thread meanwhile
+                if value is not _MISSING:
+                    return value
+                owner = self._claim(skey)
+                if owner is None:  # another worker computed it
+                    value = self.get(key, _MISSING)
+                    if value is not _MISSING:
+                        return value
+                try:
+                    value = compute()
+                    self.set(key, value)
+                finally:
+                    if owner is not None:
+                        self._release(skey, owner)
+                return value
+            finally:
+                with self._flights_lock:
+                    self._flights.pop(skey, None)
+
+    def clear(self):
+        if self._l1 is not None:
+            self._l1.clear()
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM entry')
+                conn.execute('UPDATE usage SET bytes = 0, entries = 0')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            logger.exception('clearing the shared cache failed')
+
+    def usage(self):
+        """(stored bytes, entries) of the shared store."""
+        return tuple(self._conn().execute('SELECT bytes, entries FROM usage').fetchone())
+
+    # --- store -----------------------------------------------------------
+
+    def _touch(self, skey, now):
+        try:
+            self._conn().execute('UPDATE entry SET used = ? WHERE key = ?', (now, skey))
+        except sqlite3.Error:
+            pass  # busy: the use time is only a hint for eviction
+
+    def _store(self, skey, blob, now):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            old = conn.execute('SELECT size FROM entry WHERE key = ?', (skey,)).fetchone()
+            conn.execute('INSERT INTO entry (key, value, size, used) VALUES (?, ?, ?, ?) ON CONFLICT (key) '
+                         'DO UPDATE SET value = excluded.value, size = excluded.size, used = excluded.used',
+                         (skey, blob, len(blob), now))
+            conn.execute('UPDATE usage SET bytes = bytes + ?, entries = entries + ?',
+                         (len(blob) - (old[0] if old else 0), 0 if old else 1))
+            size, entries = conn.execute('SELECT bytes, entries FROM usage').fetchone()
+            while size > self.max_bytes or entries > self.max_entries:
+                victims = conn.execute('SELECT key, size FROM entry WHERE key <> ? ORDER BY used LIMIT ?',
+                                       (skey, EVICT_BATCH)).fetchall()
+                if not victims:
+                    break
+                for vkey, vsize in victims:
+                    conn.execute('DELETE FROM entry WHERE key = ?', (vkey,))
+                    size -= vsize
+                    entries -= 1
+                    if size <= self.max_bytes and entries <= self.max_entries:
+                        break
+                conn.execute('UPDATE usage SET bytes = ?, entries = ?', (size, entries))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _claim(self, skey):
+        """Claim the computation of a key: our owner id, or None after waiting for another worker's."""
+        owner = f'{os.getpid()}-{threading.get_ident()}'
+        deadline = time.time() + CLAIM_SECONDS
+        pause = 0.005
+        try:
+            conn = self._conn()
+            while True:
+                now = time.time()
+                conn.execute('DELETE FROM claim WHERE key = ? AND expires < ?', (skey, now))
+                try:
+                    conn.execute('INSERT INTO claim (key, owner, expires) VALUES (?, ?, ?)',
+                                 (skey, owner, now + CLAIM_SECONDS))
+                    return owner
+                except sqlite3.IntegrityError:
+                    pass
+                time.sleep(pause)
+                pause = min(pause * 2, 0.1)
+                if conn.execute('SELECT 1 FROM entry WHERE key = ?', (skey,)).fetchone() is not None:
+                    return None
+                if time.time() > deadline:
+                    return owner  # compute without a claim rather than wait longer
+        except sqlite3.Error:
+            logger.exception('shared cache claim failed')
+            return owner
+
+    def _release(self, skey, owner):
+        try:
+            self._conn().execute('DELETE FROM claim WHERE key = ? AND owner = ?', (skey, owner))
+        except sqlite3.Error:
+            pass
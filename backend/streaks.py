@@ -0,0 +1,192 @@
+"""Streak and consistency metrics maintained incrementally.
+
+A streak is a run of consecutive calendar days with at least one workout.
+`user_stats` keeps, per user: total workouts, distinct training days and
+weeks, first/last training day, the length of the run ending on the last
+training day (`current_run`) and the longest run ever.
+
+Mutation endpoints call `on_workout_added` / `on_workout_removed` after the
+workout row has been flushed. Each update only issues point queries on the
+(user_id, date) index: the day, the week, and the run of consecutive days
+around the changed date. A full recompute happens only when a deletion
+empties a day inside the current streak window, breaks the run that holds
+the longest-streak record, or removes several workouts at once.
+
+The row is created lazily by `read_stats` the first time it is needed; until
+then the mutation hooks do nothing.
+"""
+import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from backend import archive, db
+from backend.models import UserStats, Workout
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def _week_start(d):
+    return d - datetime.timedelta(days=d.weekday())
+
+
+def _count_between(user_id, start, end):
+    return (db.session.query(func.count(Workout.id))
+            .filter(Workout.user_id == user_id, Workout.date >= start, Workout.date < end)
+            .scalar()) + archive.count_between(user_id, start, end)
+
+
+def _day_count(user_id, d):
+    return _count_between(user_id, d, d + ONE_DAY)
+
+
+def _week_count(user_id, d):
+    start = _week_start(d)
+    return _count_between(user_id, start, start + datetime.timedelta(days=7))
+
+
+def _run_length(user_id, d, step):
+    """Consecutive training days starting at `d` going in direction `step` (+1/-1 day)."""
+    length = 0
+    window = 32
+    cursor = d
+    while True:
+        if step > 0:
+            lo, hi = cursor, cursor + datetime.timedelta(days=window)
+        else:
+            lo, hi = cursor - datetime.timedelta(days=window - 1), cursor + ONE_DAY
+        days = {r[0] for r in db.session.query(Workout.date).distinct()
+                .filter(Workout.user_id == user_id, Workout.date >= lo, Workout.date < hi)}
+        days |= archive.dates_between(user_id, lo, hi)
+        for _ in range(window):
+            if cursor not in days:
+                return length
+            length += 1
+            cursor += ONE_DAY if step > 0 else -ONE_DAY
+        window *= 2
+
+
+def compute_from_scratch(user_id):
+    """Recompute every metric from the user's distinct training dates (one query plus the archive)."""
+    per_day = archive.date_counts(user_id)
+    per_day.update(dict(db.session.query(Workout.date, func.count(Workout.id))
+                        .filter(Workout.user_id == user_id).group_by(Workout.date)))
+    dates = sorted(per_day)
+    total = sum(per_day.values())
+    out = {'total_workouts': total, 'active_days': len(dates),
+           'active_weeks': len({_week_start(d) for d in dates}),
+           'first_date': dates[0] if dates else None, 'last_date': dates[-1] if dates else None,
+           'current_run': 0, 'longest_run': 0}
+    run = 0
+    prev = None
+    for d in dates:
+        run = run + 1 if prev is not None and d - prev == ONE_DAY else 1
+        out['longest_run'] = max(out['longest_run'], run)
+        prev = d
+    out['current_run'] = run
+    return out
+
+
+def _apply(row, values):
+    for k, v in values.items():
+        setattr(row, k, v)
+
+
+def _locked_row(user_id):
+    return db.session.query(UserStats).filter_by(user_id=user_id).with_for_update().first()
+
+
+def on_workout_added(user_id, d):
+    """Update stats after a workout dated `d` was inserted (and flushed)."""
+    row = _locked_row(user_id)
+    if row is None:
+        return
+    row.total_workouts += 1
+    if _day_count(user_id, d) != 1:
+        return  # the day already counted as a training day
+    row.active_days += 1
+    if _week_count(user_id, d) == 1:
+        row.active_weeks += 1
+    if row.first_date is None or d < row.first_date:
+        row.first_date = d
+    back = _run_length(user_id, d, -1)
+    fwd = _run_length(user_id, d + ONE_DAY, +1)
+    run_len = back + fwd
+    run_end = d + datetime.timedelta(days=fwd)
+    if row.last_date is None or run_end >= row.last_date:
+        row.last_date = run_end
+        row.current_run = run_len
+    row.longest_run = max(row.longest_run, run_len)
+
+
+def on_workout_removed(user_id, d):
+    """Update stats after a workout dated `d` was deleted (and flushed)."""
+    row = _locked_row(user_id)
+    if row is None:
+        return
+    row.total_workouts -= 1
+    if _day_count(user_id, d) != 0:
+        return  # other workouts still make it a training day
+    window_start = row.last_date - datetime.timedelta(days=row.current_run - 1) if row.last_date else None
+    broken_run = _run_length(user_id, d - ONE_DAY, -1) + 1 + _run_length(user_id, d + ONE_DAY, +1)
+    if (window_start is not None and window_start <= d <= row.last_date) or broken_run >= row.longest_run:
+        _apply(row, compute_from_scratch(user_id))
+        return
+    row.active_days -= 1
+    if _week_count(user_id, d) == 0:
+        row.active_weeks -= 1
+    if d == row.first_date:
+        firsts = [db.session.query(func.min(Workout.date)).filter(Workout.user_id == user_id).scalar(),
+                  archive.first_date(user_id)]
+        row.first_date = min((f for f in firsts if f is not None), default=None)
+
+
+def on_workouts_removed(user_id, dates):
+    """Bulk delete: update stats after workouts dated `dates` were deleted (and flushed)."""
+    if len(dates) == 1:
+        return on_workout_removed(user_id, dates[0])
+    row = _locked_row(user_id)
+    if row is not None and dates:
+        _apply(row, compute_from_scratch(user_id))
+
+
+def _stats_row(user_id):
+    row = db.session.get(UserStats, user_id)
+    if row is not None:
+        return row
+    row = UserStats(user_id=user_id, **compute_from_scratch(user_id))
+    db.session.add(row)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another request created it concurrently
+        db.session.rollback()
+        row = db.session.get(UserStats, user_id)
+    return row
+
+
+def summarize(values, today=None):
+    """Public metrics from stored values (dict or UserStats row)."""
+    get = values.get if isinstance(values, dict) else lambda k: getattr(values, k)
+    today = today or datetime.date.today()
+    last = get('last_date')
+    first = get('first_date')
+    current = get('current_run') if last is not None and last >= today - ONE_DAY else 0
+    if first is None:
+        return {'total_workouts': 0, 'current_streak': 0, 'longest_streak': 0, 'workouts_per_week': 0.0,
+                'adherence_pct': 0.0, 'active_days': 0}
+    span_days = max(1, (max(today, last) - first).days + 1)
+    weeks = (_week_start(max(today, last)) - _week_start(first)).days // 7 + 1
+    return {
+        'total_workouts': get('total_workouts'),
+        'current_streak': current,
+        'longest_streak': get('longest_run'),
+        'workouts_per_week': round(get('total_workouts') / max(1.0, span_days / 7.0), 2),
+        'adherence_pct': round(100.0 * get('active_weeks') / weeks, 1),
+        'active_days': get('active_days'),
+    }
+
+
+def read_stats(user_id):
+    """Consistency metrics for the stats endpoint, without scanning workouts."""
+    return summarize(_stats_row(user_id))
@@ -0,0 +1,139 @@
+"""Per-workout summary columns maintained by the database.
+
+`workout.exercise_count`, `total_sets`, `total_volume` (sum of sets * reps *
+weight, like the volume leaderboards) and `max_weight` (the top set) are
+what list views show for a workout. Triggers on `workout_exercise`
+recompute them for the affected workout on every insert, delete and update,
+so list endpoints read them from the `workout` row and never touch
+`workout_exercise`. Being triggers (like the search index in
+backend/search.py) they also cover bulk inserts that bypass the ORM: archive
+restores, shard moves, the benchmark seeder.
+
+The triggers recompute instead of adding deltas, so copying a workout row
+together with its summary and then its exercises (shard moves) stays
+correct. `check()` compares the columns with a recompute and can repair
+them, see scripts/check_summaries.py.
+"""
+from sqlalchemy import text
+
+from backend import db, sharding
+
+COLUMNS = ('exercise_count', 'total_sets', 'total_volume', 'max_weight')
+
+_AGGREGATE = """SELECT count(*), COALESCE(sum(sets), 0), COALESCE(sum(sets * reps * COALESCE(weight, 0.0)), 0.0),
+    max(weight) FROM workout_exercise WHERE workout_id = {wid}"""
+_SET = 'UPDATE workout SET (exercise_count, total_sets, total_volume, max_weight) = (' + _AGGREGATE + ')'
+_RECOMPUTE = _SET + ' WHERE id = {wid}'
+_RECOMPUTE_ALL = _SET.format(wid='workout.id')
+
+_SQLITE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS workout_summary_ai AFTER INSERT ON workout_exercise BEGIN
+        %s;
+    END""" % _RECOMPUTE.format(wid='NEW.workout_id'),
+    """CREATE TRIGGER IF NOT EXISTS workout_summary_au AFTER UPDATE OF workout_id, sets, reps, weight
+        ON workout_exercise BEGIN
+        %s;
+        %s;
+    END""" % (_RECOMPUTE.format(wid='OLD.workout_id'), _RECOMPUTE.format(wid='NEW.workout_id')),
+    """CREATE TRIGGER IF NOT EXISTS workout_summary_ad AFTER DELETE ON workout_exercise BEGIN
+        %s;
+    END""" % _RECOMPUTE.format(wid='OLD.workout_id'),
+]
+
+_PG_DDL = [
+    """CREATE OR REPLACE FUNCTION workout_summary_refresh(wid INTEGER) RETURNS VOID AS $$
+        %s
+    $$ LANGUAGE sql""" % _RECOMPUTE.format(wid='wid'),
+    """CREATE OR REPLACE FUNCTION workout_summary_trigger() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN PERFORM workout_summary_refresh(OLD.workout_id); END IF;
+        IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.workout_id <> OLD.workout_id) THEN
+            PERFORM workout_summary_refresh(NEW.workout_id);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS workout_summary_e ON workout_exercise",
+    """CREATE TRIGGER workout_summary_e AFTER INSERT OR UPDATE OF workout_id, sets, reps, weight OR DELETE
+        ON workout_exercise FOR EACH ROW EXECUTE FUNCTION workout_summary_trigger()""",
+]
+
+_COLUMN_DDL = {
+    'exercise_count': 'INTEGER NOT NULL DEFAULT 0',
+    'total_sets': 'INTEGER NOT NULL DEFAULT 0',
+    'total_volume': 'FLOAT NOT NULL DEFAULT 0',
+    'max_weight': 'FLOAT',
+}
+
+# workouts whose stored summary differs from a recompute
+_DRIFT = """
+    SELECT w.id, w.exercise_count, w.total_sets, w.total_volume, w.max_weight,
+           COALESCE(x.n, 0), COALESCE(x.s, 0), COALESCE(x.v, 0.0), x.m
+    FROM workout w
+    LEFT JOIN (SELECT workout_id, count(*) AS n, sum(sets) AS s,
+                      sum(sets * reps * COALESCE(weight, 0.0)) AS v, max(weight) AS m
+               FROM workout_exercise GROUP BY workout_id) x ON x.workout_id = w.id
+    WHERE {where} (w.exercise_count <> COALESCE(x.n, 0) OR w.total_sets <> COALESCE(x.s, 0)
+           OR abs(w.total_volume - COALESCE(x.v, 0.0)) > 1e-6
+           OR abs(COALESCE(w.max_weight, -1.0) - COALESCE(x.m, -1.0)) > 1e-9)
+    ORDER BY w.id
+"""
+
+
+def _run(sql, params=None):
+    """Execute raw SQL on the workout tables (routed to the current shard when sharding is on)."""
+    return db.session.execute(text(sql), params or {}, bind_arguments=sharding.raw_args())
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _missing_columns():
+    if _dialect() == 'postgresql':
+        have = {r[0] for r in _run("SELECT column_name FROM information_schema.columns WHERE table_name = 'workout'")}
+    else:
+        have = {r[1] for r in _run('PRAGMA table_info(workout)')}
+    return [c for c in COLUMNS if c not in have]
+
+
+def _has_triggers():
+    if _dialect() == 'postgresql':
+        return _run("SELECT 1 FROM pg_trigger WHERE tgname = 'workout_summary_e'").first() is not None
+    return _run("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'workout_summary_ai'").first() is not None
+
+
+def ensure_summaries():
+    """Add the columns and triggers where missing (every shard); backfill them when added."""
+    for _ in sharding.each_shard():
+        missing = _missing_columns()
+        installed = _has_triggers()
+        for column in missing:
+            _run(f'ALTER TABLE workout ADD COLUMN {column} {_COLUMN_DDL[column]}')
+        for stmt in (_PG_DDL if _dialect() == 'postgresql' else _SQLITE_DDL):
+            _run(stmt)
+        if missing or not installed:
+            _run(_RECOMPUTE_ALL)
+        db.session.commit()
+
+
+def _shards(user_id):
+    if user_id is None:
+        yield from sharding.each_shard()
+    else:
+        with sharding.use_user(user_id):
+            yield None
+
+
+def check(repair=False, user_id=None):
+    """[(workout id, stored, expected), ...] for summaries that drifted; repair=True fixes them and commits."""
+    drift = []
+    where = 'w.user_id = :uid AND' if user_id is not None else ''
+    for _ in _shards(user_id):
+        rows = _run(_DRIFT.format(where=where), {'uid': user_id}).fetchall()
+        drift += [(r[0], tuple(r[1:5]), tuple(r[5:9])) for r in rows]
+        ids = [r[0] for r in rows] if repair else []
+        for i in range(0, len(ids), 500):
+            _run(_RECOMPUTE_ALL + ' WHERE id IN (%s)' % ','.join(str(int(w)) for w in ids[i:i + 500]))
+    if repair:
+        db.session.commit()
+    return drift
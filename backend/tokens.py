@@ -0,0 +1,212 @@
+"""Signed bearer tokens as an alternative to the session cookie.
+
+`POST /api/token` with username and password returns a short-lived access
+token and a refresh token. API requests then send `Authorization: Bearer
+<access token>` instead of the cookie, and `POST /api/token/refresh` trades
+the refresh token for a new pair before the access token runs out.
+
+Both are itsdangerous signatures over a few claims (like the links in
+backend/auth.py), nothing is stored per token:
+
+    u  user id        n  username (the admin account is the one named admin)
+    a  admin flag     f  id of the login, shared by all tokens it produces
+
+A bearer request is therefore authenticated without loading the user:
+`current_user` is a `TokenUser` that knows id, username and the admin flag,
+reads the data versions with a one-column query and only loads the User row
+when an endpoint touches any other attribute.
+
+Revocation: logging out revokes the login (`f`), deleting the account all
+tokens of the user issued until then. The revocations are rows in
+`revoked_token`, each worker keeps the live ones in two small dicts and
+picks up rows added by other workers at most FITTRACK_TOKEN_SYNC seconds
+later, with one indexed query. Rows expire with the last token they can
+match.
+
+Configuration (environment):
+    FITTRACK_ACCESS_TOKEN_TTL   seconds an access token is valid (default 900)
+    FITTRACK_REFRESH_TOKEN_TTL  seconds a refresh token is valid (default 30 days)
+    FITTRACK_TOKEN_SYNC         seconds between revocation syncs per worker (default 2)
+"""
+import os
+import secrets
+import threading
+import time
+
+from flask import current_app, jsonify, request
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import text
+
+from backend import db
+from backend.cache import get_versions
+from backend.models import User
+
+ACCESS_TTL = int(os.getenv('FITTRACK_ACCESS_TOKEN_TTL', '900'))
+REFRESH_TTL = int(os.getenv('FITTRACK_REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+SYNC_SECONDS = float(os.getenv('FITTRACK_TOKEN_SYNC', '2'))
+PURGE_EVERY = 100  # revocations between two purges of expired rows
+
+
+def _serializer(kind):
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=f'{kind}-token')
+
+
+class TokenUser(UserMixin):
+    """`current_user` of a bearer-token request; see the module docstring."""
+
+    def __init__(self, uid, username, admin, family):
+        self.id = uid
+        self.username = username
+        self.is_admin = admin
+        self.family = family
+
+    # read on every access: a write in the request changes them
+    @property
+    def data_version(self):
+        return get_versions(self.id)[0]
+
+    @property
+    def history_version(self):
+        return get_versions(self.id)[1]
+
+    def __getattr__(self, name):
+        # only called for attributes not set above: they come from the User row
+        if name.startswith('_'):
+            raise AttributeError(name)
+        row = self.__dict__.get('_row')
+        if row is None:
+            row = db.session.get(User, self.id)
+            if row is None:
+                raise AttributeError(name)
+            self.__dict__['_row'] = row
+        return getattr(row, name)
+
+
+class Revocations:
+    """Revoked logins and users of all workers, synced from `revoked_token`."""
+
+    def __init__(self):
+        self.families = {}  # login id -> expires_at
+        self.users = {}     # user id -> not_before (tokens issued until then are revoked)
+        self._cursor = None
+        self._synced = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _apply(self, rows, now):
+        for family, user_id, not_before, expires_at in rows:
+            if expires_at <= now:
+                continue
+            if family:
+                self.families[family] = expires_at
+            if user_id is not None:
+                self.users[user_id] = max(not_before, self.users.get(user_id, 0))
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self._synced < SYNC_SECONDS:
+            return
+        with self._lock:
+            if now - self._synced < SYNC_SECONDS:
+                return
+            wall = int(time.time())
+            if self._cursor is None:
+                self._cursor = 0
+                self.families.clear()
+                self.users.clear()
+            rows = db.session.execute(text(
+                'SELECT id, family, user_id, not_before, expires_at FROM revoked_token '
+                'WHERE id > :cursor ORDER BY id'), {'cursor': self._cursor}).all()
+            if rows:
+                self._cursor = rows[-1][0]
+                self._apply([r[1:] for r in rows], wall)
+            self.families = {f: e for f, e in self.families.items() if e > wall}
+            # a user revocation only matters while tokens issued before it can live
+            self.users = {u: nb for u, nb in self.users.items() if nb + REFRESH_TTL > wall}
+            self._synced = now
+
+    def is_revoked(self, family, user_id, issued_at):
+        self.sync()
+        return family in self.families or issued_at <= self.users.get(user_id, -1)
+
+    def add(self, family=None, user_id=None):
+        """Revoke a login or all current tokens of a user; commits."""
+        now = int(time.time())
+        self._count += 1
+        if self._count % PURGE_EVERY == 0:
+            db.session.execute(text('DELETE FROM revoked_token WHERE expires_at < :now'), {'now': now})
+        db.session.execute(text(
+            'INSERT INTO revoked_token (family, user_id, not_before, expires_at) VALUES (:f, :u, :nb, :e)'),
+            {'f': family, 'u': user_id, 'nb': now if user_id is not None else None, 'e': now + REFRESH_TTL})
+        db.session.commit()
+        with self._lock:
+            self._apply([(family, user_id, now, now + REFRESH_TTL)], now)
+
+
+revocations = Revocations()
+
+
+def issue(user, family=None):
+    """A new token pair for the user (a new login unless `family` is given)."""
+    family = family or secrets.token_urlsafe(9)
+    claims = {'u': user.id, 'n': user.username, 'a': int(user.username == 'admin'), 'f': family}
+    return {
+        'access_token': _serializer('access').dumps(claims),
+        'refresh_token': _serializer('refresh').dumps({'u': user.id, 'f': family}),
+        'token_type': 'Bearer',
+        'expires_in': ACCESS_TTL,
+    }
+
+
+def _verify(kind, token, max_age):
+    """Claims of a valid, unrevoked token, or None."""
+    try:
+        claims, issued = _serializer(kind).loads(token, max_age=max_age, return_timestamp=True)
+    except BadSignature:
+        return None
+    if revocations.is_revoked(claims.get('f'), claims.get('u'), int(issued.timestamp())):
+        return None
+    return claims
+
+
+def refresh(token):
+    """A new token pair for a valid refresh token, or None.
+
+    Loads the user, so a deleted or renamed account gets no new tokens.
+    """
+    claims = _verify('refresh', token or '', REFRESH_TTL)
+    if claims is None:
+        return None
+    user = db.session.get(User, claims['u'])
+    if user is None:
+        return None
+    return issue(user, family=claims['f'])
+
+
+def load_bearer_user(req):
+    """Flask-Login request loader: the TokenUser of a valid `Authorization: Bearer` header."""
+    auth = req.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    claims = _verify('access', auth[7:].strip(), ACCESS_TTL)
+    if claims is None:
+        return None
+    return TokenUser(claims['u'], claims['n'], bool(claims['a']), claims['f'])
+
+
+def init_app(app):
+    from backend import login_manager
+    login_manager.request_loader(load_bearer_user)
+    redirect_to_login = login_manager.unauthorized
+
+    def unauthorized():
+        # token clients get a 401 to refresh on, not the redirect meant for cookie sessions
+        if request.headers.get('Authorization', '').startswith('Bearer '):
+            resp = jsonify({'ok': False, 'error': 'invalid or expired token'})
+            resp.status_code = 401
+            resp.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+            return resp
+        return redirect_to_login()
+
+    login_manager.unauthorized = unauthorized
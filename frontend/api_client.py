@@ -0,0 +1,337 @@
+"""Thin HTTP client for the FitTrack API used by the Streamlit frontend.
+
+Streamlit reruns the whole script on every interaction, so without help each
+click repeats every GET of the page. One `ApiClient` lives in
+`st.session_state` and sits between the pages and `requests`:
+
+    cache       successful GETs are kept per session, keyed by endpoint and
+                params and tagged with the user's data version (the API sends
+                it as `X-Data-Version`). A cached response is reused while a
+                cheap `GET /api/version` still reports that version, i.e. no
+                workout changed, from this session or any other.
+    coalescing  identical GETs within one rerun are sent once.
+    prefetch    `prefetch()` starts a GET on a small shared thread pool and
+                returns at once; a later `get()` of the same endpoint waits
+                for that response instead of sending its own. Independent
+                calls of a page then take as long as the slowest one, not
+                their sum. Prefetched responses not used in the rerun move to
+                the cache when the next rerun starts (e.g. the details of the
+                workouts on screen, for the click that opens one).
+    mutations   `mutate()` sends POST/DELETE with an Idempotency-Key and drops
+                everything cached or prefetched for the user.
+
+Each session keeps up to FITTRACK_API_POOL keep-alive connections (enough
+for its parallel calls), every request has a connect and a read timeout, and
+connection errors and overload responses are retried with backoff.
+
+`begin_render()` / `end_render()` bracket one rerun and count the requests it
+sent, the responses served from the cache or coalesced, and the render time.
+
+Login goes through `login()` / `logout()`. With FITTRACK_API_AUTH=token the
+client logs in at `/api/token` and sends `Authorization: Bearer` instead of
+the session cookie; the access token is refreshed at the start of a rerun
+when it is about to expire, and once more on a 401.
+
+Scopes for `get(..., cache=)`:
+    USER    data of the logged-in user (default); also dropped at midnight,
+            since streaks and "today" depend on the date
+    STATIC  data that does not change while the app runs (the catalog)
+    None    never cached (other users' data, e.g. leaderboards), coalesced only
+
+Configuration (environment):
+    FITTRACK_API_CONNECT_TIMEOUT  seconds to connect (default 3.05)
+    FITTRACK_API_TIMEOUT          seconds to wait for a response (default 15)
+    FITTRACK_API_POOL             keep-alive connections per session (default 4)
+    FITTRACK_API_WORKERS          threads for parallel calls of all sessions (default 8)
+    FITTRACK_API_AUTH             cookie (default) or token
+"""
+import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER = 'user'
+STATIC = 'static'
+VERSION_HEADER = 'X-Data-Version'
+MAX_ENTRIES = 256
+MAX_INFLIGHT = 16  # prefetches per session not picked up yet
+HISTORY = 20  # renders kept for the stats table
+
+CONNECT_TIMEOUT = float(os.getenv('FITTRACK_API_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('FITTRACK_API_TIMEOUT', '15'))
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+EXPORT_TIMEOUT = (CONNECT_TIMEOUT, 120)
+POOL_SIZE = int(os.getenv('FITTRACK_API_POOL', '4'))
+WORKERS = int(os.getenv('FITTRACK_API_WORKERS', '8'))
+AUTH = os.getenv('FITTRACK_API_AUTH', 'cookie')
+REFRESH_MARGIN = 60  # seconds before expiry at which the access token is renewed
+
+
+
+class _Retry(Retry):
+    # A 409 is retried only with Retry-After: that is the API's "request with
+    # this Idempotency-Key is still in progress". Other conflicts (a finished
+    # session, a key reused for a different request) go back to the caller.
+    RETRY_AFTER_STATUS_CODES = Retry.RETRY_AFTER_STATUS_CODES | {409}
+
+
+# Retries with exponential backoff (0.5 s, 1 s, 2 s) on connection errors,
+# timeouts and overload responses. POST/DELETE are retried too: every
+# mutation goes through mutate(), which sends an Idempotency-Key, so the API
+# answers a retry with the stored result instead of running it twice.
+RETRY = _Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+               allowed_methods=None, raise_on_status=False, respect_retry_after_header=True)
+
+# shared by all sessions of the Streamlit server, so parallel calls stay bounded
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='fittrack-api')
+
+
+def _freeze(params):
+    if not params:
+        return ()
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()))
+
+
+def response_version(resp):
+    """The data version a response was computed at, or None."""
+    value = resp.headers.get(VERSION_HEADER)
+    return int(value) if value is not None and value.isdigit() else None
+
+
+class ApiClient:
+    """Per-session API access with a version-keyed cache, coalescing and prefetch."""
+
+    def __init__(self, base):
+        self.base = base
+        self.session = requests.Session()
+        # pool_maxsize covers the parallel calls, so each of them reuses a
+        # kept-alive connection instead of opening (and dropping) an extra one
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=RETRY)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Advertise compression; the API gzips/brotli-compresses large payloads.
+        # requests only decodes br when the brotli package is installed.
+        try:
+            import brotli  # noqa: F401
+            self.session.headers['Accept-Encoding'] = 'br, gzip'
+        except ImportError:
+            self.session.headers['Accept-Encoding'] = 'gzip'
+        self._cache = OrderedDict()  # (path, params) -> (tag, response)
+        self._memo = {}              # same key -> response, for the current rerun
+        self._inflight = {}          # same key -> (scope, rerun number, future)
+        self._pending = {}           # action hash -> Idempotency-Key awaiting an answer
+        self.version = None          # data version seen during the current rerun
+        self._refresh_token = None   # token mode: refresh token and access token expiry
+        self._expires_at = 0.0
+        self.reruns = 0
+        self.render = None
+        self.history = deque(maxlen=HISTORY)
+
+    # -- renders -------------------------------------------------------------
+
+    def begin_render(self):
+        """Start a rerun: forget the coalesced responses and the known version.
+
+        Prefetches of earlier reruns that have finished move into the cache.
+        """
+        self._memo.clear()
+        self.version = None
+        self.reruns += 1
+        if self._refresh_token and time.time() > self._expires_at - REFRESH_MARGIN:
+            self._renew()
+        for key, (cache, _rerun, future) in list(self._inflight.items()):
+            if future.done():
+                del self._inflight[key]
+                if not future.cancelled() and future.exception() is None:
+                    self._store(key, cache, future.result())
+        self.render = {'page': None, 'requests': 0, 'cached': 0, 'coalesced': 0,
+                       'start': time.perf_counter(), 'ms': None}
+
+    def end_render(self, page):
+        """Finish the rerun (only the first call counts) and return its stats."""
+        render = self.render
+        if render is not None and render['ms'] is None:
+            render['page'] = page
+            render['ms'] = round((time.perf_counter() - render['start']) * 1000, 1)
+            self.history.append(render)
+        return render
+
+    def _count(self, field):
+        if self.render is not None and self.render['ms'] is None:
+            self.render[field] += 1
+
+    # -- requests ------------------------------------------------------------
+
+    def _send(self, method, path, **kwargs):
+        # also runs on the pool threads: must not touch the client's state
+        url = path if '://' in path else f"{self.base}{path}"
+        kwargs.setdefault('timeout', TIMEOUT)
+        return self.session.request(method, url, **kwargs)
+
+    def _seen(self, resp):
+        seen = response_version(resp)
+        if seen is not None:
+            self.version = max(seen, self.version or 0)
+        return resp
+
+    def request(self, method, path, **kwargs):
+        """Send one request as is (no cache), counted in the render stats.
+
+        `path` is relative to the API base unless it is a full URL.
+        """
+        self._count('requests')
+        resp = self._send(method, path, **kwargs)
+        if resp.status_code == 401 and self._refresh_token and self._renew():
+            resp = self._send(method, path, **kwargs)
+        return self._seen(resp)
+
+    # -- login ---------------------------------------------------------------
+
+    def _use_tokens(self, data):
+        self._refresh_token = data['refresh_token']
+        self._expires_at = time.time() + data['expires_in']
+        self.session.headers['Authorization'] = f"Bearer {data['access_token']}"
+
+    def _renew(self):
+        """Trade the refresh token for a new token pair; False (and logged out) if refused."""
+        resp = self._send('POST', '/token/refresh', json={'refresh_token': self._refresh_token})
+        if resp.ok:
+            self._use_tokens(resp.json())
+            return True
+        self.forget_login()
+        return False
+
+    def login(self, username, password):
+        """Log in with a password (session cookie or, with FITTRACK_API_AUTH=token, bearer tokens)."""
+        self.forget_login()
+        body = {'username': username, 'password': password}
+        if AUTH == 'token':
+            resp = self.request('POST', '/token', json=body)
+            if resp.ok:
+                self._use_tokens(resp.json())
+        else:
+            resp = self.request('POST', '/login', json=body)
+        return resp
+
+    def logout(self):
+        """Log out on the server (which revokes the tokens) and forget the login here."""
+        resp = self.request('POST', '/logout')
+        self.forget_login()
+        return resp
+
+    def forget_login(self):
+        """Drop cookies, tokens and all cached user data."""
+        self.session.cookies.clear()
+        self.session.headers.pop('Authorization', None)
+        self._refresh_token = None
+        self.invalidate()
+
+    def data_version(self):
+        """The user's current data version, asked once per rerun."""
+        if self.version is None:
+            resp = self.request('GET', '/version')
+            if not resp.ok:
+                return None
+            self.version = resp.json().get('data_version', 0)
+        return self.version
+
+    def _tag(self, scope, version):
+        if scope == STATIC:
+            return STATIC
+        return (version, datetime.date.today())
+
+    def _fresh(self, key, cache):
+        """The cached response for key if still current; drops a stale entry."""
+        entry = self._cache.get(key) if cache else None
+        if entry is None:
+            return None
+        if entry[0] == self._tag(cache, None if cache == STATIC else self.data_version()):
+            self._cache.move_to_end(key)
+            return entry[1]
+        del self._cache[key]
+        return None
+
+    def _store(self, key, cache, resp):
+        if not cache or not resp.ok:
+            return
+        version = response_version(resp)
+        if cache == STATIC or version is not None:
+            self._cache[key] = (self._tag(cache, version), resp)
+            while len(self._cache) > MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _collect(self, key):
+        """Wait for the prefetch of key; its response if usable in this rerun, else None."""
+        cache, rerun, future = self._inflight.pop(key)
+        try:
+            resp = future.result()
+        except Exception:
+            return None
+        if resp.status_code == 401:  # token expired meanwhile: get() sends it again
+            return None
+        self._store(key, cache, resp)
+        if rerun == self.reruns:
+            return self._seen(resp)
+        # started in an earlier rerun: only good while its version is current
+        return self._fresh(key, cache)
+
+    def get(self, path, params=None, cache=USER, **kwargs):
+        """GET with coalescing within the rerun and, unless cache=None, the session cache."""
+        key = (path, _freeze(params))
+        if key in self._memo:
+            self._count('coalesced')
+            return self._memo[key]
+        resp = self._collect(key) if key in self._inflight else None
+        if resp is None:
+            resp = self._fresh(key, cache)
+            if resp is not None:
+                self._count('cached')
+        if resp is None:
+            resp = self.request('GET', path, params=params, **kwargs)
+            self._store(key, cache, resp)
+        self._memo[key] = resp
+        return resp
+
+    def prefetch(self, path, params=None, cache=USER):
+        """Start a GET in the background unless it is cached, coalesced or already running."""
+        key = (path, _freeze(params))
+        if key in self._memo or key in self._inflight or len(self._inflight) >= MAX_INFLIGHT:
+            return
+        if self._fresh(key, cache) is not None:
+            return
+        self._count('requests')
+        self._inflight[key] = (cache, self.reruns, _executor.submit(self._send, 'GET', path, params=params))
+
+    def mutate(self, method, path, **kwargs):
+        """Send a POST/DELETE with an Idempotency-Key and drop the user's cached data.
+
+        The key is kept until an answer arrives, so repeating the same action
+        after a timeout (a second click) reuses it and cannot create duplicates.
+        """
+        action = hashlib.sha1(json.dumps([method, path, kwargs.get('json')], sort_keys=True,
+                                         default=str).encode()).hexdigest()
+        key = self._pending.setdefault(action, uuid.uuid4().hex)
+        try:
+            resp = self.request(method, path, headers={'Idempotency-Key': key}, **kwargs)
+        finally:
+            self.invalidate()
+        self._pending.pop(action, None)
+        return resp
+
+    def invalidate(self):
+        """Forget cached, prefetched and coalesced user data (after a write, login or logout)."""
+        for key in [k for k, (tag, _) in self._cache.items() if tag != STATIC]:
+            del self._cache[key]
+        for _scope, _rerun, future in self._inflight.values():
+            future.cancel()
+        self._inflight.clear()
+        self._memo.clear()
+        self.version = None
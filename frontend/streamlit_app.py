@@ -1,20 +1,25 @@
 import streamlit as st
-import requests
 import pandas as pd
-from datetime import date, datetime
+import altair as alt
+from collections import Counter
+from datetime import date, datetime, timedelta
 import webbrowser
 
+from api_client import ApiClient, EXPORT_TIMEOUT, MAX_INFLIGHT, STATIC, response_version
+
 # Use secrets if available, otherwise default to localhost
 try:
     API_BASE = st.secrets.get('api_base', 'http://localhost:5000/api')
 except:
     API_BASE = 'http://localhost:5000/api'
 
-# Initialize session
-if 'session' not in st.session_state:
-    st.session_state['session'] = requests.Session()
-
-session = st.session_state['session']
+# All API calls go through one client per browser session: it caches GETs by
+# the user's data version, sends duplicate GETs of a rerun once and counts the
+# requests of each render (see frontend/api_client.py).
+if 'api' not in st.session_state:
+    st.session_state['api'] = ApiClient(API_BASE)
+api = st.session_state['api']
+api.begin_render()
 
 
 def _safe_json(resp, default=None):
@@ -30,6 +35,55 @@ def _safe_json(resp, default=None):
             pass
     return default if default is not None else {}
 
+def synced_workouts():
+    """The user's workouts (newest first) from a local copy kept fresh via /api/sync.
+
+    The first call downloads a full snapshot; later calls only fetch what
+    changed since the stored cursor, and nothing while the data version is the
+    one of the last sync. Returns None when the API is unreachable.
+    """
+    state = st.session_state.get('sync')
+    if state is None:
+        state = {'cursor': 0, 'workouts': {}, 'exercises': {}, 'version': None}
+    try:
+        # every write bumps the data version, so an unchanged version means no delta
+        if state.get('version') is not None and state['version'] == api.data_version():
+            return _sorted_workouts(state)
+        while True:
+            r = api.get("/sync", params={'since': state['cursor']}, cache=None)
+            if not r.ok:
+                return None
+            delta = _safe_json(r)
+            if delta.get('full'):
+                state = {'cursor': 0, 'workouts': {}, 'exercises': {}, 'version': None}
+            gone = set(delta.get('deleted', {}).get('workouts', []))
+            for wid in gone:
+                state['workouts'].pop(wid, None)
+            dropped = set(delta.get('deleted', {}).get('exercises', []))
+            state['exercises'] = {eid: e for eid, e in state['exercises'].items()
+                                  if eid not in dropped and e['workout_id'] not in gone}
+            state['workouts'].update((w['id'], w) for w in delta.get('workouts', []))
+            state['exercises'].update((e['id'], e) for e in delta.get('exercises', []))
+            state['cursor'] = delta.get('cursor', state['cursor'])
+            state['version'] = response_version(r)
+            st.session_state['sync'] = state
+            if not delta.get('more'):
+                break
+    except Exception:
+        return None
+    return _sorted_workouts(state)
+
+
+def prefetch_synced_workouts():
+    """Start the /api/sync call of a later synced_workouts() now, if it will need one."""
+    state = st.session_state.get('sync')
+    if state is None or state.get('version') is None or state['version'] != api.data_version():
+        api.prefetch("/sync", params={'since': state['cursor'] if state else 0}, cache=None)
+
+
+def _sorted_workouts(state):
+    return sorted(state['workouts'].values(), key=lambda w: (w['date'], w['id']), reverse=True)
+
 # Initialize login state
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
@@ -43,6 +97,9 @@ query_params = st.query_params
 if 'auth' in query_params:
     if query_params['auth'] == 'success':
         st.session_state['logged_in'] = True
+        st.session_state.pop('sync', None)
+        st.session_state.pop('events_last_id', None)
+        api.invalidate()
         st.success('Přihlášení přes Google úspěšné!')
         # Clear query params
         st.query_params.clear()
@@ -54,7 +111,7 @@ if 'auth' in query_params:
 def check_login():
     """Check if user is logged in by calling /api/me"""
     try:
-        r = session.get(f"{API_BASE}/me")
+        r = api.get("/me", cache=None)
         if r.ok:
             st.session_state['logged_in'] = True
             st.session_state['user'] = _safe_json(r).get('user')
@@ -79,7 +136,7 @@ def profile_form():
         if submitted:
             payload = {'age': int(age), 'height_cm': float(height), 'weight_kg': float(weight)}
             try:
-                r = session.post(f"{API_BASE}/profile", json=payload)
+                r = api.mutate('POST', "/profile", json=payload)
                 if r.ok:
                     st.success('Profil uložen.')
                     # update local user state
@@ -111,10 +168,12 @@ def login_page():
                 if not username or not password:
                     st.error("Vyplňte všechna pole")
                 else:
-                    r = session.post(f"{API_BASE}/login", json={'username': username, 'password': password})
+                    r = api.login(username, password)
                     if r.ok:
                         data = _safe_json(r)
                         st.session_state['logged_in'] = True
+                        st.session_state.pop('sync', None)
+                        st.session_state.pop('events_last_id', None)
                         st.session_state['user'] = {'username': username, 'is_admin': data.get('is_admin', False)}
                         st.success("Přihlášení úspěšné!")
                         st.rerun()
@@ -124,7 +183,7 @@ def login_page():
         st.markdown("---")
         st.subheader("Nebo se přihlaste přes Google")
         if st.button("🔐 Přihlásit se přes Google", use_container_width=True):
-            r = session.get(f"{API_BASE}/google/login")
+            r = api.get("/google/login", cache=None)
             if r.ok:
                 auth_url = _safe_json(r).get('auth_url')
                 st.markdown(f'<meta http-equiv="refresh" content="0;url={auth_url}">', unsafe_allow_html=True)
@@ -148,7 +207,7 @@ def login_page():
                 elif len(new_password) < 8:
                     st.error("Heslo musí mít minimálně 8 znaků")
                 else:
-                    r = session.post(f"{API_BASE}/register", json={'username': new_username, 'password': new_password})
+                    r = api.mutate('POST', "/register", json={'username': new_username, 'password': new_password})
                     if r.ok:
                         st.success("Registrace úspěšná! Nyní se můžete přihlásit.")
                     else:
@@ -156,8 +215,14 @@ def login_page():
 
 def dashboard_page():
     st.markdown('<div class="main-header">📊 Dashboard</div>', unsafe_allow_html=True)
+    # the three sections are independent: fetch them in parallel, each picks up its response
+    api.prefetch("/stats")
+    api.prefetch("/calendar", params={'year': st.session_state.get('calendar_year', date.today().year)})
+    prefetch_synced_workouts()
+    if st.session_state.get('progress_exercise'):
+        api.prefetch("/progress", params=_progress_params())
     # Stats
-    r = session.get(f"{API_BASE}/stats")
+    r = api.get("/stats")
     if r.ok:
         stats = _safe_json(r).get('stats', {})
         col1, col2 = st.columns(2)
@@ -175,8 +240,30 @@ def dashboard_page():
                 <div class="stat-label">Cviků v posledních 5</div>
             </div>
             """, unsafe_allow_html=True)
+        consistency = [
+            (f"🔥 {stats.get('current_streak', 0)}", 'Aktuální série dní'),
+            (stats.get('longest_streak', 0), 'Nejdelší série dní'),
+            (stats.get('workouts_per_week', 0), 'Tréninků týdně'),
+            (f"{stats.get('adherence_pct', 0)} %", 'Aktivních týdnů'),
+        ]
+        for col, (value, label) in zip(st.columns(4), consistency):
+            with col:
+                st.markdown(f"""
+                <div class="stat-box">
+                    <div class="stat-number">{value}</div>
+                    <div class="stat-label">{label}</div>
+                </div>
+                """, unsafe_allow_html=True)
     
     st.markdown("---")
+
+    calendar_heatmap()
+
+    st.markdown("---")
+
+    progress_chart()
+
+    st.markdown("---")
     
     # Quick actions
     st.subheader("⚡ Rychlý start")
@@ -184,7 +271,7 @@ def dashboard_page():
     
     with col1:
         if st.button("🟢 Začátečník", use_container_width=True):
-            r = session.post(f"{API_BASE}/quickstart/zacatecnik")
+            r = api.mutate('POST', "/quickstart/zacatecnik")
             if r.ok:
                 st.success("Trénink vytvořen!")
                 st.session_state['page'] = 'workouts'
@@ -192,7 +279,7 @@ def dashboard_page():
     
     with col2:
         if st.button("🟡 Pokročilý", use_container_width=True):
-            r = session.post(f"{API_BASE}/quickstart/pokracily")
+            r = api.mutate('POST', "/quickstart/pokracily")
             if r.ok:
                 st.success("Trénink vytvořen!")
                 st.session_state['page'] = 'workouts'
@@ -200,7 +287,7 @@ def dashboard_page():
     
     with col3:
         if st.button("🔴 Expert", use_container_width=True):
-            r = session.post(f"{API_BASE}/quickstart/expert")
+            r = api.mutate('POST', "/quickstart/expert")
             if r.ok:
                 st.success("Trénink vytvořen!")
                 st.session_state['page'] = 'workouts'
@@ -210,12 +297,14 @@ def dashboard_page():
     
     # Recent workouts
     st.subheader("📅 Poslední tréninky")
-    r = session.get(f"{API_BASE}/workouts")
-    if r.ok:
-        workouts = _safe_json(r).get('workouts', [])[:5]
+    workouts = synced_workouts()
+    if workouts is not None:
+        workouts = workouts[:5]
+        for w in workouts:
+            api.prefetch(f"/workouts/{w['id']}")
         if workouts:
             for w in workouts:
-                with st.expander(f"📌 {w['date']} — {w['exercise_count']} cviků"):
+                with st.expander(f"📌 {w['date']} — {w['exercise_count']} cviků, {w.get('total_volume', 0):g} kg"):
                     st.write(f"**Poznámka:** {w.get('note', 'Bez poznámky')}")
                     if st.button("Zobrazit detail", key=f"detail_{w['id']}"):
                         st.session_state['selected_workout'] = w['id']
@@ -224,55 +313,293 @@ def dashboard_page():
         else:
             st.info("Zatím nemáte žádné tréninky. Začněte rychlým startem nebo vytvořte nový trénink!")
 
+WEEKDAYS_CS = ['Po', 'Út', 'St', 'Čt', 'Pá', 'So', 'Ne']
+
+
+PROGRESS_POINTS = 300  # about one point per 2-3 px of the chart width
+PROGRESS_METRICS = {'weight': 'Max. váha (kg)', 'volume': 'Objem (kg)'}
+
+
+def _progress_params():
+    return {'exercise': st.session_state.get('progress_exercise'),
+            'metric': st.session_state.get('progress_metric', 'weight'), 'points': PROGRESS_POINTS}
+
+
+def progress_chart():
+    """Progress of one exercise over the whole history from /api/progress, PR days marked.
+
+    The API downsamples long histories to PROGRESS_POINTS points, keeping every PR.
+    """
+    st.subheader("📈 Progres")
+    synced_workouts()
+    exercises = (st.session_state.get('sync') or {}).get('exercises', {})
+    names = [n for n, _ in Counter(e['name'] for e in exercises.values()).most_common()]
+    if not names:
+        st.info("Progres se zobrazí po prvních cvicích.")
+        return
+    if st.session_state.get('progress_exercise') not in names:
+        st.session_state['progress_exercise'] = names[0]
+    col1, col2 = st.columns(2)
+    with col1:
+        st.selectbox('Cvik', names, key='progress_exercise')
+    with col2:
+        st.radio('Metrika', list(PROGRESS_METRICS), format_func=PROGRESS_METRICS.get, horizontal=True,
+                 key='progress_metric')
+    r = api.get("/progress", params=_progress_params())
+    if not r.ok:
+        st.error("Nepodařilo se načíst progres")
+        return
+    progress = _safe_json(r).get('progress', {})
+    points = progress.get('points', [])
+    if not points:
+        st.info("Pro tento cvik zatím nejsou data.")
+        return
+    df = pd.DataFrame(points)
+    df['date'] = pd.to_datetime(df['date'])
+    label = PROGRESS_METRICS[progress.get('metric', 'weight')]
+    base = alt.Chart(df).encode(
+        x=alt.X('date:T', title=None),
+        y=alt.Y('value:Q', title=label),
+        tooltip=[alt.Tooltip('date:T', title='Datum'), alt.Tooltip('value:Q', title=label)],
+    )
+    prs = base.transform_filter(alt.datum.pr).mark_point(filled=True, size=60, color='#f58518')
+    st.altair_chart(base.mark_line() + prs, use_container_width=True)
+    caption = "🟠 osobní rekord"
+    if progress.get('total', 0) > len(points):
+        caption += f" · zobrazeno {len(points)} z {progress['total']} tréninkových dní"
+    st.caption(caption)
+
+
+def calendar_heatmap():
+    """GitHub-style yearly heatmap of training volume from /api/calendar."""
+    st.subheader("🗓️ Tréninkový kalendář")
+    this_year = date.today().year
+    year = st.selectbox('Rok', list(range(this_year, this_year - 6, -1)), key='calendar_year')
+    r = api.get("/calendar", params={'year': year})
+    if not r.ok:
+        st.error("Nepodařilo se načíst kalendář")
+        return
+    cal = _safe_json(r).get('calendar', {})
+    by_day = {d['date']: d for d in cal.get('days', [])}
+    rows = []
+    day = date(year, 1, 1)
+    while day.year == year:
+        d = by_day.get(day.isoformat(), {})
+        rows.append({
+            'Datum': day.isoformat(),
+            'Týden': int(day.strftime('%W')),
+            'Den': WEEKDAYS_CS[day.weekday()],
+            'Tréninky': d.get('workouts', 0),
+            'Objem (kg)': d.get('volume', 0.0),
+        })
+        day += timedelta(days=1)
+    chart = alt.Chart(pd.DataFrame(rows)).mark_rect(stroke='white').encode(
+        x=alt.X('Týden:O', axis=alt.Axis(labels=False, ticks=False, title=None)),
+        y=alt.Y('Den:O', sort=WEEKDAYS_CS, title=None),
+        color=alt.Color('Objem (kg):Q', scale=alt.Scale(scheme='greens'), legend=None),
+        tooltip=['Datum', 'Tréninky', 'Objem (kg)'],
+    ).properties(height=160)
+    st.altair_chart(chart, use_container_width=True)
+    st.caption(f"{cal.get('total_workouts', 0)} tréninků · {cal.get('active_days', 0)} aktivních dnů · "
+               f"objem {cal.get('total_volume', 0):,.0f} kg")
+
+
+def show_render_stats():
+    """Sidebar note with the API requests and the time of this render, once per rerun."""
+    stats = api.end_render(st.session_state.get('page', 'dashboard'))
+    if stats is None or stats.get('shown'):
+        return
+    stats['shown'] = True
+    with st.sidebar:
+        st.caption(f"⏱️ {stats['ms']:.0f} ms · API: {stats['requests']} požadavků, "
+                   f"{stats['cached']} z cache, {stats['coalesced']} sloučeno")
+        with st.expander("Výkon stránek"):
+            st.dataframe(pd.DataFrame([{'Stránka': h['page'], 'ms': h['ms'], 'Požadavky': h['requests'],
+                                        'Z cache': h['cached'], 'Sloučeno': h['coalesced']}
+                                       for h in reversed(api.history)]),
+                         use_container_width=True, hide_index=True)
+
+
+def wait_for_change(timeout=25):
+    """Block until /api/events reports a change (or `timeout` passes), then rerun.
+
+    The stream resumes from the last seen event id, so changes made while the
+    page was rendering are not lost between two waits. The render ends before
+    the wait, so the waiting does not count as render time.
+    """
+    show_render_stats()
+    headers = {}
+    if st.session_state.get('events_last_id') is not None:
+        headers['Last-Event-ID'] = str(st.session_state['events_last_id'])
+    deadline = datetime.now() + timedelta(seconds=timeout)
+    try:
+        with api.request('GET', "/events", headers=headers, stream=True, timeout=(5, timeout)) as r:
+            if not r.ok:
+                return
+            changed = False
+            for line in r.iter_lines(decode_unicode=True):
+                if line.startswith('id:'):
+                    st.session_state['events_last_id'] = int(line[3:].strip())
+                elif line.startswith('event:'):
+                    changed = True
+                elif (line == '' and changed) or datetime.now() > deadline:
+                    break
+    except Exception:
+        return
+    st.rerun()
+
+
+DETAIL_PREFETCH = 10
+
+
 def workouts_page():
     st.markdown('<div class="main-header">💪 Moje tréninky</div>', unsafe_allow_html=True)
     
     col1, col2 = st.columns([3, 1])
+    with col1:
+        live = st.checkbox("🔴 Živé aktualizace", key='workouts_live',
+                           help="Seznam se obnoví sám, když se tréninky změní v jiném okně nebo zařízení")
     with col2:
         if st.button("➕ Nový trénink", use_container_width=True):
             st.session_state['page'] = 'new_workout'
             st.rerun()
     
+    query = st.text_input("🔍 Hledat v poznámkách a cvicích", key='workout_search')
     st.markdown("---")
+
+    if query.strip():
+        search_results(query.strip())
+        return
     
-    r = session.get(f"{API_BASE}/workouts")
+    per_page = st.session_state.get('workouts_per_page', 50)
+    page = st.session_state.get('workouts_page_no', 1)
+    r = api.get("/workouts", params={'page': page, 'per_page': per_page})
     if not r.ok:
         st.error("Nepodařilo se načíst tréninky")
         return
-    
-    workouts = r.json().get('workouts', [])
+    data = _safe_json(r)
+    total = data.get('total', 0)
+    pages = max(1, (total + per_page - 1) // per_page)
+    if page > pages:
+        # the list got shorter (deletes elsewhere): show the last page instead
+        st.session_state['workouts_page_no'] = pages
+        st.rerun()
+    workouts = data.get('workouts', [])
+    # details of the top rows load in the background, ready when one is clicked
+    for w in workouts[:DETAIL_PREFETCH]:
+        api.prefetch(f"/workouts/{w['id']}")
     
     if not workouts:
         st.info("Zatím nemáte žádné tréninky")
+        if live:
+            wait_for_change()
         return
     
-    # Create DataFrame for display
-    df_data = []
-    for w in workouts:
-        df_data.append({
-            'Datum': w['date'],
-            'Poznámka': w.get('note', '')[:50] + ('...' if len(w.get('note', '')) > 50 else ''),
-            'Počet cviků': w['exercise_count'],
-            'ID': w['id']
-        })
-    
-    df = pd.DataFrame(df_data)
-    
-    # Display workouts
-    for idx, row in df.iterrows():
-        col1, col2, col3, col4 = st.columns([2, 4, 2, 2])
+    with st.expander("🗑️ Hromadné mazání"):
+        with st.form('bulk_delete'):
+            c1, c2 = st.columns(2)
+            with c1:
+                start = st.date_input("Od", value=date.today() - timedelta(days=30))
+            with c2:
+                end = st.date_input("Do", value=date.today())
+            if st.form_submit_button("Smazat tréninky v období"):
+                r = api.mutate('POST', "/workouts/bulk-delete",
+                                 json={'from': start.isoformat(), 'to': end.isoformat()})
+                if r.ok:
+                    st.success(f"Smazáno tréninků: {_safe_json(r).get('deleted', 0)}")
+                    st.rerun()
+                else:
+                    st.error(_safe_json(r).get('error', 'Mazání se nezdařilo'))
+
+    # One dataframe per page instead of a row of widgets per workout: the page
+    # holds at most per_page rows however many workouts the user has.
+    df = pd.DataFrame([{
+        'Datum': w['date'],
+        'Poznámka': w.get('note', ''),
+        'Počet cviků': w['exercise_count'],
+        'Série': w.get('total_sets'),
+        'Objem (kg)': w.get('total_volume'),
+        'Max. váha (kg)': w.get('max_weight'),
+    } for w in workouts])
+    st.caption("Kliknutím na řádek otevřete detail tréninku.")
+    # a fresh key after each navigation, so a kept selection does not redirect again
+    table_key = f"workouts_table_{st.session_state.get('workouts_table_nonce', 0)}"
+    event = st.dataframe(df, key=table_key, on_select='rerun', selection_mode='single-row',
+                         hide_index=True, use_container_width=True,
+                         height=min(len(df), 20) * 35 + 38)
+    selected = event.selection.rows if event is not None else []
+    if selected:
+        st.session_state['workouts_table_nonce'] = st.session_state.get('workouts_table_nonce', 0) + 1
+        st.session_state['selected_workout'] = workouts[selected[0]]['id']
+        st.session_state['page'] = 'workout_detail'
+        st.rerun()
+
+    col1, col2, col3, col4 = st.columns([1, 2, 1, 1])
+    with col1:
+        if st.button("← Předchozí", disabled=page <= 1, key='workouts_prev'):
+            st.session_state['workouts_page_no'] = page - 1
+            st.rerun()
+    with col2:
+        st.write(f"Strana {page} / {pages} · {total} tréninků")
+    with col3:
+        if st.button("Další →", disabled=page >= pages, key='workouts_next'):
+            st.session_state['workouts_page_no'] = page + 1
+            st.rerun()
+    with col4:
+        sizes = [25, 50, 100, 200]
+        size = st.selectbox("Na stránku", sizes, index=sizes.index(per_page), key='workouts_per_page_select',
+                            label_visibility='collapsed')
+        if size != per_page:
+            # keep the first visible workout on screen
+            st.session_state['workouts_per_page'] = size
+            st.session_state['workouts_page_no'] = (page - 1) * per_page // size + 1
+            st.rerun()
+
+    if live:
+        wait_for_change()
+
+def search_results(query):
+    """Render ranked, paginated search hits from /api/search."""
+    per_page = 20
+    if st.session_state.get('search_query') != query:
+        st.session_state['search_query'] = query
+        st.session_state['search_page'] = 1
+    page = st.session_state.get('search_page', 1)
+    r = api.get("/search", params={'q': query, 'page': page, 'per_page': per_page})
+    if not r.ok:
+        st.error(_safe_json(r).get('error', 'Vyhledávání selhalo'))
+        return
+    data = _safe_json(r)
+    total = data.get('total', 0)
+    hits = data.get('results', [])
+    if not hits:
+        st.info("Nic nenalezeno")
+        return
+    st.caption(f"Nalezeno {total} tréninků")
+    for hit in hits:
+        col1, col2, col3 = st.columns([2, 6, 2])
         with col1:
-            st.write(f"**{row['Datum']}**")
+            st.write(f"**{hit['date']}**")
         with col2:
-            st.write(row['Poznámka'])
+            st.markdown(hit.get('snippet') or hit.get('note', ''))
         with col3:
-            st.write(f"🏋️ {row['Počet cviků']} cviků")
-        with col4:
-            if st.button("Detail", key=f"view_{row['ID']}"):
-                st.session_state['selected_workout'] = row['ID']
+            if st.button("Detail", key=f"search_view_{hit['id']}"):
+                st.session_state['selected_workout'] = hit['id']
                 st.session_state['page'] = 'workout_detail'
                 st.rerun()
-        st.markdown("---")
+    pages = max(1, (total + per_page - 1) // per_page)
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("← Předchozí", disabled=page <= 1, key='search_prev'):
+                st.session_state['search_page'] = page - 1
+                st.rerun()
+        with col2:
+            st.write(f"Strana {page} / {pages}")
+        with col3:
+            if st.button("Další →", disabled=page >= pages, key='search_next'):
+                st.session_state['search_page'] = page + 1
+                st.rerun()
 
 def workout_detail_page():
     if 'selected_workout' not in st.session_state:
@@ -280,7 +607,7 @@ def workout_detail_page():
         return
     
     wid = st.session_state['selected_workout']
-    r = session.get(f"{API_BASE}/workouts/{wid}")
+    r = api.get(f"/workouts/{wid}")
     
     if not r.ok:
         st.error("Trénink nenalezen")
@@ -293,7 +620,7 @@ def workout_detail_page():
         st.markdown(f'<div class="main-header">🏋️ Trénink z {workout["date"]}</div>', unsafe_allow_html=True)
     with col2:
         if st.button("🗑️ Smazat trénink", use_container_width=True):
-            r = session.delete(f"{API_BASE}/workouts/{wid}")
+            r = api.mutate('DELETE', f"/workouts/{wid}")
             if r.ok:
                 st.success("Trénink smazán!")
                 st.session_state['page'] = 'workouts'
@@ -319,7 +646,7 @@ def workout_detail_page():
                 st.write(f"{ex.get('weight', '-')} kg")
             with col5:
                 if st.button("❌", key=f"del_ex_{ex['id']}"):
-                    r = session.delete(f"{API_BASE}/exercises/{ex['id']}")
+                    r = api.mutate('DELETE', f"/exercises/{ex['id']}")
                     if r.ok:
                         st.success("Cvik smazán!")
                         st.rerun()
@@ -351,7 +678,7 @@ def workout_detail_page():
                     'reps': ex_reps,
                     'weight': ex_weight if ex_weight > 0 else None
                 }
-                r = session.post(f"{API_BASE}/exercises/{wid}/add", json=payload)
+                r = api.mutate('POST', f"/exercises/{wid}/add", json=payload)
                 if r.ok:
                     st.success("Cvik přidán!")
                     st.rerun()
@@ -402,7 +729,7 @@ def new_workout_page():
                     'note': note,
                     'exercises': exercises
                 }
-                r = session.post(f"{API_BASE}/workouts", json=payload)
+                r = api.mutate('POST', "/workouts", json=payload)
                 if r.status_code == 201:
                     st.success("Trénink vytvořen!")
                     st.session_state['page'] = 'workouts'
@@ -413,7 +740,7 @@ def new_workout_page():
 def catalog_page():
     st.markdown('<div class="main-header">📚 Katalog cviků</div>', unsafe_allow_html=True)
     
-    r = session.get(f"{API_BASE}/catalog")
+    r = api.get("/catalog", cache=STATIC)
     if not r.ok:
         st.error("Nepodařilo se načíst katalog")
         return
@@ -422,11 +749,8 @@ def catalog_page():
     
     st.write("Základní cviky pro inspiraci:")
     # Load user's workouts so they can choose where to add an exercise
-    wr = session.get(f"{API_BASE}/workouts")
-    workouts = []
+    workouts = synced_workouts() or []
     workout_map = {}
-    if wr.ok:
-        workouts = _safe_json(wr).get('workouts', [])
     for w in workouts:
         note = (w.get('note') or 'Bez poznámky')
         short = note if len(note) <= 30 else note[:27] + '...'
@@ -457,7 +781,7 @@ def catalog_page():
                 if selected_target == create_new_label:
                     # create new workout
                     payload = {'date': date.today().isoformat(), 'note': f'Přidáno z katalogu: {exercise}', 'exercises': []}
-                    cr = session.post(f"{API_BASE}/workouts", json=payload)
+                    cr = api.mutate('POST', "/workouts", json=payload)
                     if cr.ok:
                         wid = _safe_json(cr).get('id')
                     else:
@@ -468,23 +792,10 @@ def catalog_page():
 
                 # Add exercise to workout using chosen sets/reps
                 ex_payload = {'name': exercise, 'sets': int(st.session_state.get(sets_key, 3)), 'reps': int(st.session_state.get(reps_key, 10))}
-                ae = session.post(f"{API_BASE}/exercises/{wid}/add", json=ex_payload)
+                ae = api.mutate('POST', f"/exercises/{wid}/add", json=ex_payload)
                 if ae.ok:
                     st.success(f"Cvik '{exercise}' přidán do tréninku (ID {wid}).")
-                    # refresh workouts listing for next actions
-                    try:
-                        wr = session.get(f"{API_BASE}/workouts")
-                        if wr.ok:
-                            workouts = _safe_json(wr).get('workouts', [])
-                            workout_map = {}
-                            for w in workouts:
-                                note = (w.get('note') or 'Bez poznámky')
-                                short = note if len(note) <= 30 else note[:27] + '...'
-                                lbl = f"{w['date']} — {short} ({w['exercise_count']} cviků)"
-                                workout_map[lbl] = w['id']
-                    except Exception:
-                        pass
-                    # redirect to workout detail page
+                    # redirect to workout detail page (the rerun syncs the workout list)
                     st.session_state['selected_workout'] = wid
                     st.session_state['page'] = 'workout_detail'
                     st.rerun()
@@ -503,9 +814,9 @@ def export_page():
 
     if fmt == 'CSV':
         if st.button("📊 Stáhnout CSV", use_container_width=True):
-            r = session.get(f"{API_BASE}/export/csv")
+            r = api.request('GET', "/export/csv/stream", timeout=EXPORT_TIMEOUT)
             if r.ok:
-                csv_data = r.json().get('csv')
+                csv_data = r.content
                 st.download_button(
                     label="💾 Uložit CSV soubor",
                     data=csv_data,
@@ -521,7 +832,7 @@ def export_page():
         if st.button("📄 Stáhnout PDF", use_container_width=True):
             # PDF endpoint is served at /export/pdf
             try:
-                r = session.get(f"{API_BASE.replace('/api','')}/export/pdf")
+                r = api.request('GET', f"{API_BASE.replace('/api','')}/export/pdf", timeout=EXPORT_TIMEOUT)
                 if r.ok:
                     pdf_data = r.content
                     st.download_button(
@@ -540,13 +851,16 @@ def export_page():
     elif fmt == 'JSON':
         if st.button("🗂️ Stáhnout JSON", use_container_width=True):
             # Build JSON from API
-            r = session.get(f"{API_BASE}/workouts")
+            r = api.get("/workouts")
             if r.ok:
                 summaries = _safe_json(r).get('workouts', [])
                 translated = []
-                for w in summaries:
-                    # fetch detailed workout to include exercises
-                    wr = session.get(f"{API_BASE}/workouts/{w['id']}")
+                ids = [w['id'] for w in summaries]
+                for i, wid in enumerate(ids):
+                    # fetch detailed workout to include exercises; the next ones load in parallel
+                    for ahead in ids[i:i + MAX_INFLIGHT]:
+                        api.prefetch(f"/workouts/{ahead}")
+                    wr = api.get(f"/workouts/{wid}")
                     if not wr.ok:
                         continue
                     detail = wr.json().get('workout', {})
@@ -584,6 +898,41 @@ def export_page():
             else:
                 st.error('Chyba při získávání dat pro JSON export')
 
+def leaderboards_page():
+    """Top 10 and own rank for PRs, monthly workouts and volume per exercise."""
+    st.markdown('<div class="main-header">🏆 Žebříčky</div>', unsafe_allow_html=True)
+    r = api.get("/leaderboards", cache=None)
+    if not r.ok:
+        st.error("Nepodařilo se načíst žebříčky")
+        return
+    data = _safe_json(r)
+    available = data.get('available', [])
+    volume_boards = [b for b in available if b.startswith('volume:')]
+    month_boards = sorted((b for b in available if b.startswith('workouts:')), reverse=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        month = st.selectbox('Měsíc', month_boards or ['-'], format_func=lambda b: b.split(':', 1)[-1])
+    with col2:
+        exercise = st.selectbox('Cvik', volume_boards or ['-'], format_func=lambda b: b.split(':', 1)[-1])
+    wanted = ['prs'] + [b for b in (month, exercise) if b != '-']
+    r = api.get("/leaderboards", params={'board': wanted}, cache=None)
+    if not r.ok:
+        st.error("Nepodařilo se načíst žebříčky")
+        return
+    titles = {'prs': '🥇 Osobní rekordy', 'workouts': '📅 Tréninky v měsíci', 'volume': '🏋️ Objem (kg)'}
+    for board in _safe_json(r).get('boards', []):
+        st.subheader(titles.get(board['kind'], board['board']) +
+                     (f" — {board['subject']}" if board.get('subject') else ''))
+        if not board.get('top'):
+            st.info("Zatím žádná data.")
+            continue
+        st.table(pd.DataFrame([{'Pořadí': t['rank'], 'Uživatel': t['username'], 'Skóre': t['score']}
+                               for t in board['top']]).set_index('Pořadí'))
+        me = board.get('me')
+        if me:
+            st.caption(f"Vaše pozice: {me['rank']}. z {board['participants']} (skóre {me['score']})")
+
+
 def admin_page():
     if not st.session_state.get('user', {}).get('is_admin'):
         st.error("Nemáte oprávnění")
@@ -591,7 +940,7 @@ def admin_page():
     
     st.markdown('<div class="main-header">⚙️ Admin panel</div>', unsafe_allow_html=True)
     
-    r = session.get(f"{API_BASE}/admin/users")
+    r = api.get("/admin/users", cache=None)
     if not r.ok:
         st.error("Chyba při načítání uživatelů")
         return
@@ -663,6 +1012,7 @@ with st.sidebar:
         'new_workout': '➕ Nový trénink',
         'catalog': '📚 Katalog cviků',
         'export': '📥 Export',
+        'leaderboards': '🏆 Žebříčky',
     }
     
     if user_info.get('is_admin'):
@@ -678,12 +1028,13 @@ with st.sidebar:
     st.markdown("---")
     
     if st.button("🚪 Odhlásit se", use_container_width=True):
-        r = session.post(f"{API_BASE}/logout")
+        api.logout()
         st.session_state['logged_in'] = False
         st.session_state['user'] = None
         st.session_state['page'] = 'dashboard'
         st.session_state['edit_profile'] = False
-        session.cookies.clear()
+        st.session_state.pop('sync', None)
+        st.session_state.pop('events_last_id', None)
         st.rerun()
 
 # Render current page
@@ -702,7 +1053,7 @@ def profile_editor_main():
         if submitted:
             payload = {'age': int(age_val), 'height_cm': float(height_val), 'weight_kg': float(weight_val)}
             try:
-                r = session.post(f"{API_BASE}/profile", json=payload)
+                r = api.mutate('POST', "/profile", json=payload)
                 if r.ok:
                     st.success('Profil uložen.')
                     st.session_state['user'].update({'age': payload['age'], 'height_cm': payload['height_cm'], 'weight_kg': payload['weight_kg'], 'profile_completed': True})
@@ -722,21 +1073,43 @@ def profile_editor_main():
             st.session_state['page'] = 'dashboard'
             st.rerun()
 
-if st.session_state.get('edit_profile'):
-    profile_editor_main()
-    st.stop()
+    with st.expander("🗑️ Smazat účet"):
+        st.warning("Smaže účet včetně všech tréninků. Tuto akci nelze vrátit.")
+        with st.form('delete_account'):
+            password = st.text_input("Heslo (u účtu přes Google uživatelské jméno)", type="password")
+            if st.form_submit_button("Smazat účet natrvalo"):
+                r = api.mutate('DELETE', "/me", json={'password': password, 'confirm': password})
+                if r.ok:
+                    for key in ('sync', 'events_last_id', 'edit_profile'):
+                        st.session_state.pop(key, None)
+                    st.session_state['logged_in'] = False
+                    st.session_state['user'] = None
+                    st.session_state['page'] = 'dashboard'
+                    api.forget_login()
+                    st.rerun()
+                else:
+                    st.error(_safe_json(r).get('error', 'Účet se nepodařilo smazat'))
 
-if page == 'dashboard':
-    dashboard_page()
-elif page == 'workouts':
-    workouts_page()
-elif page == 'workout_detail':
-    workout_detail_page()
-elif page == 'new_workout':
-    new_workout_page()
-elif page == 'catalog':
-    catalog_page()
-elif page == 'export':
-    export_page()
-elif page == 'admin':
-    admin_page()
+try:
+    if st.session_state.get('edit_profile'):
+        profile_editor_main()
+    elif page == 'dashboard':
+        dashboard_page()
+    elif page == 'workouts':
+        workouts_page()
+    elif page == 'workout_detail':
+        workout_detail_page()
+    elif page == 'new_workout':
+        new_workout_page()
+    elif page == 'catalog':
+        catalog_page()
+    elif page == 'export':
+        export_page()
+    elif page == 'leaderboards':
+        leaderboards_page()
+    elif page == 'admin':
+        admin_page()
+finally:
+    # also ends renders cut short by st.rerun(), so they are counted too
+    api.end_render(page)
+show_render_stats()
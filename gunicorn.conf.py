@@ -1,7 +1,98 @@
-bind = "0.0.0.0:8000"
-workers = 2
-worker_class = "gthread"
-threads = 4
-preload_app = True
+import importlib.util
+import multiprocessing
+import os
+import sys
+import tempfile
+
+# Worker model and counts come from the environment, defaulting to values
+# derived from the CPU count:
+#   FITTRACK_WORKER_CLASS  gthread (default) | gevent | sync | auto
+#                          'auto' picks gevent when it is installed
+#   WEB_CONCURRENCY        number of worker processes
+#   FITTRACK_THREADS       threads per gthread worker (default 4)
+#   FITTRACK_WORKER_CONNECTIONS  concurrent connections per gevent worker (default 1000)
+#
+# gthread caps in-flight requests at workers * threads; slow clients and OAuth
+# callbacks (outbound HTTPS to Google) hold a thread for their whole duration.
+# gevent workers multiplex thousands of connections per process; outbound HTTP
+# and Postgres (via psycogreen) become cooperative, SQLite queries stay short
+# blocking calls on the hub.
+
+_cpus = multiprocessing.cpu_count()
+
+
+def _worker_class():
+    wc = os.getenv("FITTRACK_WORKER_CLASS", "gthread").lower()
+    if wc == "auto":
+        try:
+            import gevent  # noqa: F401
+            return "gevent"
+        except ImportError:
+            return "gthread"
+    return wc
+
+
+bind = os.getenv("FITTRACK_BIND", "0.0.0.0:8000")
+worker_class = _worker_class()
+
+if worker_class == "gevent":
+    # one process per core, concurrency comes from greenlets
+    workers = int(os.getenv("WEB_CONCURRENCY", _cpus))
+    worker_connections = int(os.getenv("FITTRACK_WORKER_CONNECTIONS", "1000"))
+    # the app must be imported after gevent monkey-patches the worker,
+    # otherwise locks and sockets created at import time stay blocking
+    preload_app = False
+else:
+    workers = int(os.getenv("WEB_CONCURRENCY", max(2, _cpus * 2)))
+    threads = int(os.getenv("FITTRACK_THREADS", "4"))
+    preload_app = True
+
 accesslog = "-"
 errorlog = "-"
+
+# The master is the only writer of instance/error.log (backend/logs.py): the
+# workers send their records to it over this socket, so rotation happens in
+# one process instead of every worker renaming the file under the others.
+os.environ.setdefault("FITTRACK_LOG_SOCKET", os.path.join(tempfile.gettempdir(), f"fittrack-log-{os.getpid()}.sock"))
+_log_server = None
+
+
+def _logs_module():
+    # without preload_app the master must not import the app (gevent), so
+    # load backend/logs.py on its own: it only needs the standard library
+    if "backend.logs" in sys.modules:
+        return sys.modules["backend.logs"]
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "logs.py")
+    spec = importlib.util.spec_from_file_location("fittrack_logs", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def on_starting(server):
+    global _log_server
+    instance = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance")
+    os.makedirs(instance, exist_ok=True)
+    _log_server = _logs_module().LogServer(os.path.join(instance, "error.log"), os.environ["FITTRACK_LOG_SOCKET"])
+
+
+def on_exit(server):
+    if _log_server is not None:
+        _log_server.close()
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+
+
+def worker_exit(server, worker):
+    # write the logged sets still buffered by this worker (backend/setlog.py)
+    import sys
+    setlog = sys.modules.get("backend.setlog")
+    if setlog is not None:
+        setlog.buffer.close()
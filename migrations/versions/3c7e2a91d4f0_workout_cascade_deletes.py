@@ -0,0 +1,48 @@
+"""ON DELETE CASCADE for workout foreign keys
+
+Revision ID: 3c7e2a91d4f0
+Revises: fbbce6714b21
+Create Date: 2026-10-19 10:12:03.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7e2a91d4f0'
+down_revision: Union[str, Sequence[str], None] = 'fbbce6714b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The original constraints were created unnamed. On SQLite batch mode
+# reflects them under these convention names; Postgres named them itself.
+NAMING = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+FOREIGN_KEYS = [
+    # table, column, referred table, sqlite name, postgres name
+    ('workout', 'user_id', 'user', 'fk_workout_user_id_user', 'workout_user_id_fkey'),
+    ('workout_exercise', 'workout_id', 'workout', 'fk_workout_exercise_workout_id_workout',
+     'workout_exercise_workout_id_fkey'),
+]
+
+
+def _replace_foreign_keys(ondelete):
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    for table, column, referred, sqlite_name, pg_name in FOREIGN_KEYS:
+        name = sqlite_name if sqlite else pg_name
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _replace_foreign_keys(None)
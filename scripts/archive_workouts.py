@@ -0,0 +1,58 @@
+"""Move old workouts into per-user cold-storage files (see backend/archive.py).
+
+    python scripts/archive_workouts.py                 # older than FITTRACK_ARCHIVE_AFTER_DAYS
+    python scripts/archive_workouts.py --days 365 --user 42
+    python scripts/archive_workouts.py --dry-run
+
+Safe to run while the app is serving requests: a user who writes during
+their run is skipped and picked up next time.
+"""
+import argparse
+import datetime
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='archive old workouts')
+    p.add_argument('--days', type=int, help='archive workouts older than this many days')
+    p.add_argument('--user', type=int, help='only this user id')
+    p.add_argument('--dry-run', action='store_true', help='only count what would be archived')
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import func
+    from backend import app, archive, db, sharding
+    from backend.models import User, Workout, WorkoutArchive
+
+    cutoff = (datetime.date.today() - datetime.timedelta(days=args.days)) if args.days is not None \
+        else archive.default_cutoff()
+    with app.app_context():
+        uids = [args.user] if args.user is not None else [u for (u,) in db.session.query(User.id).order_by(User.id)]
+        moved = skipped = 0
+        for uid in uids:
+            if args.dry_run:
+                with sharding.use_user(uid):
+                    n = (db.session.query(func.count(Workout.id))
+                         .filter(Workout.user_id == uid, Workout.date < cutoff).scalar())
+                if n:
+                    print(f'user {uid}: {n} workouts before {cutoff}')
+                moved += n
+                continue
+            n = archive.archive_user(uid, cutoff)
+            if n is None:
+                skipped += 1
+                print(f'user {uid}: changed during the run, skipped')
+            elif n:
+                moved += n
+                row = db.session.get(WorkoutArchive, uid)
+                print(f'user {uid}: archived {n} workouts ({row.workouts} in archive, {row.size_bytes} bytes)')
+        verb = 'would archive' if args.dry_run else 'archived'
+        print(f'{verb} {moved} workouts before {cutoff}' + (f', {skipped} users skipped' if skipped else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Online snapshots of the databases and the archive (backend/backup.py).
+
+    python scripts/backup.py create                   # take a snapshot (the app may keep running)
+    python scripts/backup.py list
+    python scripts/backup.py verify [NAME] [--deep]   # default: the newest snapshot
+    python scripts/backup.py restore NAME --to DIR    # extract the files into DIR
+    python scripts/backup.py restore NAME --in-place  # replace the live files (service stopped)
+    python scripts/backup.py prune --keep 7
+
+Run `create` from cron, or set FITTRACK_BACKUP_INTERVAL to let the app take
+them. `verify` exits 1 when a chunk or file does not match its checksum.
+A restore in place rebuilds and checks every file before replacing
+anything and keeps the replaced SQLite files as <file>.before-restore.
+It then clears the shared cache and moves data and leaderboard versions,
+id counters and the sync floor past those of the replaced databases
+(clients resync from a snapshot); revocations of tokens are kept.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _mb(n):
+    return f'{n / 1024 / 1024:.1f} MB'
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='online backups')
+    sub = p.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help='take a snapshot')
+    create.add_argument('--step-pages', type=int, help='SQLite pages per backup step')
+    create.add_argument('--pause-ms', type=float, help='pause between steps')
+    sub.add_parser('list', help='list snapshots')
+    verify = sub.add_parser('verify', help='check the checksums of a snapshot')
+    verify.add_argument('name', nargs='?')
+    verify.add_argument('--deep', action='store_true', help='also run integrity_check on the databases')
+    restore = sub.add_parser('restore', help='restore a snapshot')
+    restore.add_argument('name')
+    where = restore.add_mutually_exclusive_group(required=True)
+    where.add_argument('--to', help='directory to extract the files into')
+    where.add_argument('--in-place', action='store_true', help='replace the live files (stop the service first)')
+    prune = sub.add_parser('prune', help='delete old snapshots and unreferenced chunks')
+    prune.add_argument('--keep', type=int)
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from backend import backup
+
+    if args.command == 'create':
+        kwargs = {}
+        if args.step_pages:
+            kwargs['step_pages'] = args.step_pages
+        if args.pause_ms is not None:
+            kwargs['pause'] = args.pause_ms / 1000
+        m = backup.create_snapshot(**kwargs)
+        print(f"{m['name']}: {len(m['files'])} files, {_mb(m['size'])}, "
+              f"{_mb(m['bytes_written'])} new, {m['seconds']:.1f}s")
+        return 0
+    if args.command == 'list':
+        for name in backup.snapshots():
+            m = backup.load(name)
+            print(f"{name}  {len(m['files']):>5} files  {_mb(m['size']):>10}  {_mb(m['bytes_written']):>10} new")
+        return 0
+    if args.command == 'verify':
+        name = args.name or (backup.snapshots() or [None])[-1]
+        if name is None:
+            print('no snapshots')
+            return 1
+        problems = backup.verify(name, deep=args.deep)
+        for problem in problems:
+            print(problem)
+        print(f'{name}: ' + ('OK' if not problems else f'{len(problems)} problems'))
+        return 1 if problems else 0
+    if args.command == 'restore':
+        try:
+            done = backup.restore(args.name, into=args.to)
+        except backup.BackupError as e:
+            print(f'restore failed, nothing replaced: {e}')
+            return 1
+        for fname, dest in done:
+            print(f'{fname} -> {dest}')
+        return 0
+    if args.command == 'prune':
+        removed = backup.prune(args.keep if args.keep is not None else backup.KEEP)
+        print(f'{len(backup.snapshots())} snapshots kept, {removed} chunks removed')
+        return 0
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Per-process LRU vs the shared SQLite cache: hit latency and memory.
+
+    python scripts/bench_cache.py
+    python scripts/bench_cache.py --workers 8 --keys 2000
+
+Values look like the cached aggregates: a year of calendar data per key (365
+days with count and volume). Measured:
+
+  hit     p50/p99 latency of a get() that hits. For the shared cache both a
+          hit in the worker's decoded copy (l1, keys within --l1) and a read
+          from the file (store), what a value computed by another worker or
+          before a restart costs.
+  rss     memory each of --workers processes gains after reading all keys,
+          and their total.
+  cold    seconds until every worker has answered all keys from an empty
+          cache (the shared one computes each key once, in one worker).
+  warm    the same for restarted workers: the local cache recomputes
+          everything, the shared cache reads it.
+
+--compute-ms simulates the cost of computing one value on a miss.
+"""
+import argparse
+import datetime
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def payload(i):
+    rng = random.Random(i)
+    start = datetime.date(2025, 1, 1)
+    return {(start + datetime.timedelta(days=d)).isoformat(): {'count': rng.randint(0, 2),
+                                                               'volume': round(rng.random() * 20000, 1)}
+            for d in range(365)}
+
+
+def rss_kb():
+    with open('/proc/self/statm') as fh:
+        return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def make(kind, args, l1=None):
+    from backend.cache import LRUCache
+    from backend.shared_cache import SharedCache
+    if kind == 'local':
+        return LRUCache(args.keys)
+    return SharedCache(args.path, max_entries=args.keys, max_bytes=1 << 30, l1_entries=args.l1 if l1 is None else l1)
+
+
+def compute(i, args):
+    time.sleep(args.compute_ms / 1000)
+    return payload(i)
+
+
+def hit_latency(cache, args, n):
+    import benchmark
+    keys = [('calendar', i) for i in range(n)]
+    for i, k in enumerate(keys):
+        cache.get_or_compute(k, lambda: payload(i))
+    samples = []
+    rng = random.Random(0)
+    for _ in range(args.reads):
+        k = rng.choice(keys)
+        t0 = time.perf_counter()
+        cache.get(k)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return benchmark.percentile(samples, 50) * 1e6, benchmark.percentile(samples, 99) * 1e6
+
+
+def worker(kind, args, results):
+    sys.path.insert(0, ROOT)
+    cache = make(kind, args)
+    before = rss_kb()
+    t0 = time.perf_counter()
+    for i in range(args.keys):
+        cache.get_or_compute(('calendar', i), lambda: compute(i, args))
+    results.put((os.getpid(), rss_kb() - before, time.perf_counter() - t0))
+
+
+def run_workers(kind, args):
+    ctx = mp.get_context('fork')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(kind, args, results)) for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    out = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return out
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='shared vs per-process cache')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--keys', type=int, default=1000, help='distinct cached values')
+    p.add_argument('--reads', type=int, default=20000, help='get() calls timed per backend')
+    p.add_argument('--l1', type=int, default=128, help='decoded values kept per worker (shared)')
+    p.add_argument('--compute-ms', type=float, default=5.0, help='cost of one miss')
+    args = p.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='fittrack-cache-')
+    args.path = os.path.join(tmp, 'cache.sqlite3')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tmp, 'db.sqlite3'))
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+    hits = {'local': hit_latency(make('local', args), args, args.l1),
+            'shared l1': hit_latency(make('shared', args), args, args.l1),
+            'shared store': hit_latency(make('shared', args, l1=0), args, args.l1)}
+    print(f"{'hit':<14}{'p50 us':>9}{'p99 us':>9}")
+    for name, (p50, p99) in hits.items():
+        print(f"{name:<14}{p50:>9.1f}{p99:>9.1f}")
+
+    print(f"\n{'workers':<14}{'rss/worker MB':>15}{'rss total MB':>14}{'cold s':>9}{'warm s':>9}")
+    for kind in ('local', 'shared'):
+        make(kind, args).clear()
+        cold = run_workers(kind, args)     # empty cache: every key computed (once, for the shared one)
+        # restarted workers: a local cache starts empty again
+        warm = cold if kind == 'local' else run_workers(kind, args)
+        rss = [r for _, r, _ in warm]
+        print(f"{kind:<14}{sum(rss) / len(rss) / 1024:>15.1f}{sum(rss) / 1024:>14.1f}"
+              f"{max(t for _, _, t in cold):>9.2f}{max(t for _, _, t in warm):>9.2f}")
+    size = os.path.getsize(args.path) / 1024 / 1024
+    print(f'shared file: {size:.1f} MB on disk (in the page cache once for all workers)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Bytes on the wire and CPU cost of response compression per encoding and level.
+
+    python scripts/bench_compression.py --years 5
+
+Builds the real /api/workouts, /api/export/csv and /api/admin/users payloads
+on a seeded database and compresses each with gzip levels 1/6/9 and, when the
+brotli package is installed, brotli qualities 1/4/9.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='compression micro-benchmark')
+    p.add_argument('--users', type=int, default=50)
+    p.add_argument('--years', type=float, default=5)
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='fittrack-gz-'), 'bench.sqlite3')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['FITTRACK_COMPRESS'] = '0'
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    import benchmark
+    owned = benchmark.seed(benchmark.parse_args(['--users', str(args.users), '--years', str(args.years)]))
+
+    from backend import app, compression
+    user = app.test_client()
+    user.post('/api/login', json={'username': sorted(owned)[0], 'password': benchmark.BENCH_PASSWORD})
+    admin = app.test_client()
+    admin.post('/api/login', json={'username': 'admin', 'password': benchmark.ADMIN_PASSWORD})
+    payloads = {
+        'list': user.get('/api/workouts').data,
+        'export_csv': user.get('/api/export/csv').data,
+        'admin_users': admin.get('/api/admin/users').data,
+    }
+    variants = [('gzip', lvl) for lvl in (1, 6, 9)]
+    if compression.brotli is not None:
+        variants += [('br', q) for q in (1, 4, 9)]
+
+    print(f"{'payload':<12}{'encoding':<10}{'raw B':>10}{'wire B':>10}{'ratio':>8}{'cpu ms':>9}")
+    for name, data in payloads.items():
+        for enc, level in variants:
+            best = float('inf')
+            for _ in range(args.repeat):
+                t0 = time.process_time()
+                out = compression.compress(data, enc, level)
+                best = min(best, time.process_time() - t0)
+            print(f'{name:<12}{enc + str(level):<10}{len(data):>10}{len(out):>10}'
+                  f'{len(data) / len(out):>8.1f}{best * 1000:>9.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
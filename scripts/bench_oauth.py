@@ -0,0 +1,190 @@
+"""Load test of the OAuth login flow against the offline stand-in provider.
+
+    python scripts/bench_oauth.py --logins 200 --provider-latency 80
+    python scripts/bench_oauth.py --mode gunicorn -c 8 --logins 400
+
+Runs complete logins (GET /api/google/login, the provider's /authorize,
+GET /api/google/callback, GET /api/me) with FITTRACK_OAUTH_PROVIDER=local,
+so no network is needed. --provider-latency adds a delay to every
+server-side call to the provider (discovery, JWKS, token) to play a remote
+provider.
+
+In client mode (Flask test client, one process) three cache states are
+compared: cold (memory and disk copies dropped before every login, what a
+new worker without the cache paid), warm, and stale (past the TTL, served
+while refreshed in the background). Gunicorn mode drives a real server with
+--concurrency parallel logins.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ('login_url', 'authorize', 'callback', 'total')
+HEADINGS = ('url', 'authz', 'callback', 'total')
+
+
+def login_flow(get, hint):
+    """One complete login through `get(url) -> (status, headers, json or None)`; returns step timings."""
+    times = {}
+    t0 = time.perf_counter()
+    status, _, body = get('/api/google/login')
+    if status != 200:
+        raise RuntimeError(f'login url: {status} {body}')
+    t1 = time.perf_counter()
+    status, headers, _ = get(body['auth_url'] + '&' + urlencode({'login_hint': hint}))
+    if status != 302:
+        raise RuntimeError(f'authorize: {status}')
+    t2 = time.perf_counter()
+    status, headers, _ = get(headers['Location'])
+    if status != 302 or 'auth=success' not in headers['Location']:
+        raise RuntimeError(f"callback: {status} {headers.get('Location')}")
+    t3 = time.perf_counter()
+    status, _, body = get('/api/me')
+    if status != 200 or body.get('user', {}).get('username') != hint:
+        raise RuntimeError(f'me: {status} {body}')
+    times.update(login_url=t1 - t0, authorize=t2 - t1, callback=t3 - t2, total=time.perf_counter() - t0)
+    return times
+
+
+def report(label, samples, errors, wall, extra=''):
+    import benchmark
+    line = f"{label:<8}{len(samples):>7}{errors:>5}{round(len(samples) / wall, 1) if wall else 0:>9}"
+    for step in STEPS:
+        lat = sorted(s[step] for s in samples)
+        line += f"{benchmark.percentile(lat, 50) * 1000:>14.1f}{benchmark.percentile(lat, 95) * 1000:>9.1f}"
+    print(line + extra)
+
+
+def run_client(args):
+    from backend import app, oauth
+    documents = oauth.documents
+
+    def client_get(client):
+        def get(url):
+            r = client.get(url)
+            return r.status_code, r.headers, r.get_json(silent=True)
+        return get
+
+    def cold(i):
+        documents.clear(disk=True)
+
+    def warm(i):
+        pass
+
+    def stale(i):
+        if i == 0:  # the copies from the warm run, now past their TTL
+            for entry in documents._entries.values():
+                entry.fetched_at = time.time() - entry.ttl - 1
+
+    scenarios = {'cold': cold, 'warm': warm, 'stale': stale}
+    for label in args.scenarios.split(','):
+        prepare = scenarios[label]
+        client_get(app.test_client())('/api/google/login')  # warm up imports and the signing key
+        documents.stats.clear()
+        samples, errors = [], 0
+        start = time.perf_counter()
+        for i in range(args.logins):
+            prepare(i)
+            try:
+                samples.append(login_flow(client_get(app.test_client()), f'load{i % args.users}'))
+            except RuntimeError as e:
+                errors += 1
+                print(e, file=sys.stderr)
+        wall = time.perf_counter() - start
+        time.sleep(0.2)  # let background refreshes land in the stats
+        stats = documents.stats
+        report(label, samples, errors, wall,
+               f"   fetches {stats['fetches']} (background {stats['background']}), stale {stats['stale']}")
+
+
+def run_gunicorn(args, env):
+    import benchmark
+    import requests
+    port = int(env['FITTRACK_OAUTH_LOCAL_URL'].rsplit(':', 1)[1].split('/')[0])
+    base = f'http://127.0.0.1:{port}'
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '-w', str(args.workers),
+         '-b', f'127.0.0.1:{port}', '--access-logfile', '/dev/null', 'backend.wsgi:application'],
+        cwd=ROOT, env=env)
+    try:
+        if not benchmark._wait_for(base + '/'):
+            raise SystemExit('gunicorn did not start')
+        lock = threading.Lock()
+        samples, errors = [], [0]
+
+        def one(i):
+            session = requests.Session()
+
+            def get(url):
+                r = session.get(url if '://' in url else base + url, allow_redirects=False, timeout=30)
+                try:
+                    body = r.json()
+                except ValueError:
+                    body = None
+                return r.status_code, r.headers, body
+            try:
+                times = login_flow(get, f'load{i % args.users}')
+            except Exception as e:
+                with lock:
+                    errors[0] += 1
+                print(e, file=sys.stderr)
+                return
+            with lock:
+                samples.append(times)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(args.logins)))
+        report('gunicorn', samples, errors[0], time.perf_counter() - start)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='OAuth login flow load test')
+    p.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    p.add_argument('--logins', type=int, default=100, help='logins per scenario')
+    p.add_argument('--users', type=int, default=20, help='distinct identities (login_hint)')
+    p.add_argument('--provider-latency', type=float, default=50, help='ms per server-side provider call')
+    p.add_argument('--scenarios', default='cold,warm,stale', help='client mode: cold, warm, stale')
+    p.add_argument('-c', '--concurrency', type=int, default=8, help='parallel logins (gunicorn mode)')
+    p.add_argument('-w', '--workers', type=int, default=2, help='gunicorn workers')
+    args = p.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='fittrack-oauth-')
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    import benchmark
+    port = benchmark._free_port()
+    env = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}",
+        'FITTRACK_OAUTH_PROVIDER': 'local',
+        'FITTRACK_OAUTH_LOCAL_URL': f'http://127.0.0.1:{port}/oauth-local',
+        'FITTRACK_OAUTH_LOCAL_LATENCY': str(args.provider_latency),
+        'FITTRACK_OAUTH_CACHE_DIR': os.path.join(tmp, 'oauth_cache'),
+    }
+    # backend reads its configuration at import time
+    os.environ.update(env)
+
+    print(f"{'ms':<8}{'logins':>7}{'err':>5}{'login/s':>9}"
+          + ''.join(f'{name + " p50":>14}{"p95":>9}' for name in HEADINGS))
+    if args.mode == 'client':
+        run_client(args)
+    else:
+        run_gunicorn(args, dict(os.environ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Compare ORM hydration + jsonify with backend.serialization on a large workout list.
+
+    python scripts/bench_serialization.py --years 10 --per-week 5
+
+Seeds one user through scripts/benchmark.py and times both ways of building
+the /api/workouts and /api/export/csv payloads.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='serialization micro-benchmark')
+    p.add_argument('--years', type=float, default=10)
+    p.add_argument('--per-week', type=int, default=5)
+    p.add_argument('--exercises', type=int, default=5)
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args(argv)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='fittrack-ser-'), 'bench.sqlite3')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+    import benchmark
+    owned = benchmark.seed(benchmark.parse_args(['--users', '1', '--years', str(args.years),
+                                                 '--per-week', str(args.per_week),
+                                                 '--exercises', str(args.exercises)]))
+    uid = 2  # first synthetic user, admin is 1
+    print(f'{len(owned[sorted(owned)[0]])} workouts for the measured user')
+
+    from flask import jsonify
+    from backend import app, db, serialization
+    from backend.models import Workout
+
+    def orm_list():
+        items = Workout.query.filter_by(user_id=uid).order_by(Workout.date.desc()).all()
+        out = [{'id': w.id, 'date': w.date.isoformat(), 'note': w.note or '', 'exercise_count': len(w.exercises)}
+               for w in items]
+        return jsonify({'ok': True, 'workouts': out}).get_data()
+
+    def dto_list():
+        out = [w.to_dict() for w in serialization.workout_summaries(uid)]
+        return serialization.json_response({'ok': True, 'workouts': out}).get_data()
+
+    def orm_export():
+        si = io.StringIO()
+        cw = csv.writer(si)
+        for w in Workout.query.filter_by(user_id=uid).all():
+            for e in w.exercises:
+                cw.writerow([w.id, w.date.strftime('%d.%m.%Y'), w.note or '', e.name, e.sets, e.reps, e.weight or ''])
+        return jsonify({'ok': True, 'csv': si.getvalue()}).get_data()
+
+    def dto_export():
+        si = io.StringIO()
+        cw = csv.writer(si)
+        for wid, wdate, note, name, sets, reps, weight in serialization.export_rows(uid):
+            cw.writerow([wid, wdate.strftime('%d.%m.%Y'), note or '', name, sets, reps, weight or ''])
+        return serialization.json_response({'ok': True, 'csv': si.getvalue()}).get_data()
+
+    backend_name = 'orjson' if serialization.USE_ORJSON else 'stdlib json'
+    print(f'encoder: {backend_name}')
+    with app.test_request_context():
+        for label, old, new in (('list', orm_list, dto_list), ('export_csv', orm_export, dto_export)):
+            db.session.expire_all()
+            t_old = timed(lambda: (old(), db.session.expunge_all()), args.repeat)
+            t_new = timed(lambda: (new(), db.session.expunge_all()), args.repeat)
+            print(f'{label:<12} orm+jsonify {t_old:9.1f} ms   dto {t_new:9.1f} ms   x{t_old / t_new:.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,476 @@
+"""Reproducible load test / benchmark for the FitTrack API.
+
+Seeds a throwaway SQLite database with synthetic users, workouts and
+exercises (bulk inserts, fixed random seed) and then drives the real
+endpoints either in-process through the Flask test client or against a
+local gunicorn started with gunicorn.conf.py and concurrent HTTP clients.
+
+Usage (from the repository root):
+
+    python scripts/benchmark.py                       # test client
+    python scripts/benchmark.py --mode gunicorn -c 16 # real server
+    python scripts/benchmark.py --save-baseline       # store new baseline
+
+    # connection concurrency of worker models under 20 idle slow clients
+    python scripts/benchmark.py --mode gunicorn --worker-class gthread --slow-clients 20
+    python scripts/benchmark.py --mode gunicorn --worker-class gevent --slow-clients 20
+
+    # latency while the app takes online snapshots every 5 s (backend/backup.py)
+    python scripts/benchmark.py --mode gunicorn --backup-every 5
+
+Every endpoint is measured --runs times (default 3) and the run with the
+median p95 is kept. Results are printed as a table (throughput and
+p50/p95/p99 per endpoint) and compared with the JSON baseline in
+scripts/baselines/<mode>.json. A regression beyond --threshold, or a
+missing baseline file, makes the script exit with status 1.
+"""
+import argparse
+import datetime
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, 'scripts', 'baselines')
+BENCH_PASSWORD = 'benchpass123'
+ADMIN_PASSWORD = 'bench-admin-pass'
+EXERCISE_NAMES = [
+    'Bench press', 'Dřep', 'Mrtvý tah', 'Přítahy na hrazdě', 'Tlaky na ramena',
+    'Biceps zdvih', 'Triceps kliky', 'Výpady', 'Leg press', 'Veslování',
+    'Kettlebell swing', 'Plank',
+]
+NOTES = ['', 'Lehký trénink', 'Těžký den, nohy', 'Záda a biceps', 'Hrudník a triceps', 'Kardio + core']
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    p.add_argument('--users', type=int, default=20, help='synthetic users to seed')
+    p.add_argument('--years', type=float, default=2, help='years of history per user')
+    p.add_argument('--per-week', type=int, default=3, help='workouts per week per user')
+    p.add_argument('--exercises', type=int, default=5, help='exercises per workout')
+    p.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    p.add_argument('--runs', type=int, default=3, help='measure each endpoint this many times, keep the median run')
+    p.add_argument('-c', '--concurrency', type=int, default=8, help='concurrent clients (gunicorn mode)')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--timeout', type=float, default=30, help='per request timeout in seconds (gunicorn mode)')
+    p.add_argument('--database', help='SQLite file to seed (default: temp file)')
+    p.add_argument('--endpoints', help='comma separated subset of endpoint names')
+    p.add_argument('--baseline', help='baseline JSON path (default scripts/baselines/<mode>.json)')
+    p.add_argument('--save-baseline', action='store_true', help='write results as the new baseline')
+    p.add_argument('--threshold', type=float, default=0.25,
+                   help='allowed relative regression of p95 / throughput before failing')
+    p.add_argument('--json', help='also write the raw results to this file')
+    p.add_argument('--worker-class', help='gunicorn worker class (FITTRACK_WORKER_CLASS), gunicorn mode only')
+    p.add_argument('--slow-clients', type=int, default=0,
+                   help='idle connections that trickle request headers during the run (gunicorn mode)')
+    p.add_argument('--accept-encoding', default='identity',
+                   help="Accept-Encoding sent by the clients, e.g. 'gzip' or 'br, gzip'")
+    p.add_argument('--auth', choices=['cookie', 'token'], default='cookie',
+                   help='session cookie (/api/login) or bearer token (/api/token)')
+    p.add_argument('--shards', type=int, default=0,
+                   help='split workout tables across this many SQLite files (FITTRACK_SHARDS)')
+    p.add_argument('--backup-every', type=float, default=0,
+                   help='seconds between online snapshots taken by the app during the run '
+                        '(FITTRACK_BACKUP_INTERVAL), gunicorn mode only')
+    return p.parse_args(argv)
+
+
+# --- Seeding -------------------------------------------------------------
+
+def seed(args):
+    """Bulk insert the synthetic dataset and return {username: [workout ids]}."""
+    from werkzeug.security import generate_password_hash
+    from backend import app, db
+    from backend.models import User, Workout, WorkoutExercise
+
+    rng = random.Random(args.seed)
+    pw_hash = generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256')
+    admin_hash = generate_password_hash(ADMIN_PASSWORD, method='pbkdf2:sha256')
+    today = datetime.date.today()
+    days = int(args.years * 365)
+    per_user = max(1, int(days / 7 * args.per_week))
+
+    users, workouts, exercises = [], [], []
+    owned = {}
+    wid = eid = 0
+    users.append({'id': 1, 'username': 'admin', 'password': admin_hash, 'created_at': datetime.datetime.utcnow()})
+    for uid in range(2, args.users + 2):
+        username = f'bench{uid - 1:04d}'
+        users.append({'id': uid, 'username': username, 'password': pw_hash,
+                      'email': f'{username}@bench.local', 'created_at': datetime.datetime.utcnow()})
+        owned[username] = []
+        for _ in range(per_user):
+            wid += 1
+            owned[username].append(wid)
+            workouts.append({'id': wid, 'user_id': uid,
+                             'date': today - datetime.timedelta(days=rng.randrange(days)),
+                             'note': rng.choice(NOTES)})
+            for name in rng.sample(EXERCISE_NAMES, min(args.exercises, len(EXERCISE_NAMES))):
+                eid += 1
+                exercises.append({'id': eid, 'workout_id': wid, 'name': name,
+                                  'sets': rng.randint(2, 5), 'reps': rng.randint(5, 15),
+                                  'weight': rng.choice([None, rng.randint(4, 80) * 2.5])})
+
+    from backend import leaderboards, search, sharding, summaries
+    from backend.cache import cache
+    for u in users:
+        u['shard'] = sharding.hash_shard(u['id']) if sharding.enabled() else None
+    shard_of = {u['id']: u['shard'] for u in users}
+    workout_shard = {w['id']: shard_of[w['user_id']] for w in workouts}
+    with app.app_context():
+        # the FTS table and its triggers live outside the ORM metadata; drop them
+        # and rebuild the index in one pass after the bulk insert (drop_all
+        # takes the workout summary triggers along, they are backfilled the same way)
+        search.drop_search_index()
+        db.drop_all()
+        db.create_all()
+        if sharding.enabled():
+            sharding.drop_shard_tables()
+            sharding.create_shard_tables()
+        db.session.execute(User.__table__.insert(), users)
+        for shard in sharding.each_shard():
+            rows = [w for w in workouts if shard_of[w['user_id']] == shard]
+            if rows:
+                db.session.execute(Workout.__table__.insert(), rows)
+            rows = [e for e in exercises if workout_shard[e['workout_id']] == shard]
+            if rows:
+                db.session.execute(WorkoutExercise.__table__.insert(), rows)
+        db.session.commit()
+        search.ensure_search_index()
+        summaries.ensure_summaries()
+        leaderboards.rebuild()
+        cache.clear()  # shared across runs on the same database file
+    print(f'Seeded {len(users)} users, {len(workouts)} workouts, {len(exercises)} exercises')
+    return owned
+
+
+# --- Endpoint scenarios --------------------------------------------------
+
+def _new_workout(rng):
+    return {'date': (datetime.date.today() - datetime.timedelta(days=rng.randrange(30))).isoformat(),
+            'note': 'bench',
+            'exercises': [{'name': rng.choice(EXERCISE_NAMES), 'sets': 3, 'reps': 10, 'weight': 50}]}
+
+
+def _new_set(rng):
+    return {'exercise': rng.choice(EXERCISE_NAMES), 'reps': rng.choice([5, 8, 10, 12]),
+            'weight': rng.randrange(20, 120, 5), 'rpe': rng.choice([7, 8, 9]), 'rest_s': 90}
+
+
+# name -> (method, path factory, admin only, json body factory)
+ENDPOINTS = {
+    'list': ('GET', lambda ctx: '/api/workouts', False, None),
+    'list_page': ('GET', lambda ctx: f"/api/workouts?page={ctx['rng'].randrange(1, 6)}&per_page=50", False, None),
+    'detail': ('GET', lambda ctx: f"/api/workouts/{ctx['rng'].choice(ctx['wids'])}", False, None),
+    'create': ('POST', lambda ctx: '/api/workouts', False, lambda ctx: _new_workout(ctx['rng'])),
+    # one set of a live session (buffered write, compare with create and FITTRACK_SETLOG_FSYNC=0)
+    'log_set': ('POST', lambda ctx: f"/api/sessions/{ctx['session']}/sets", False, lambda ctx: _new_set(ctx['rng'])),
+    'stats': ('GET', lambda ctx: '/api/stats', False, None),
+    'export_csv': ('GET', lambda ctx: '/api/export/csv', False, None),
+    'export_stream': ('GET', lambda ctx: '/api/export/csv/stream', False, None),
+    'calendar': ('GET', lambda ctx: f"/api/calendar?year={datetime.date.today().year - ctx['rng'].randrange(2)}",
+                 False, None),
+    'search': ('GET', lambda ctx: f"/api/search?q={ctx['rng'].choice(['drep', 'bench', 'nohy', 'zada biceps'])}",
+               False, None),
+    'leaderboards': ('GET', lambda ctx: '/api/leaderboards?board=prs&board=' + quote('volume:' + ctx['rng'].choice(EXERCISE_NAMES)),
+                     False, None),
+    'progress': ('GET', lambda ctx: '/api/progress?points=300&exercise=' + quote(ctx['rng'].choice(EXERCISE_NAMES)),
+                 False, None),
+    # since=0 is the full snapshot a fresh client downloads once
+    'sync': ('GET', lambda ctx: '/api/sync?since=0', False, None),
+    # next to no work besides authentication: compare --auth cookie and token
+    'version': ('GET', lambda ctx: '/api/version', False, None),
+    'admin_users': ('GET', lambda ctx: '/api/admin/users', True, None),
+}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    k = max(0, min(len(samples) - 1, int(round(pct / 100.0 * len(samples) + 0.5)) - 1))
+    return samples[k]
+
+
+def summarize(latencies, errors, wall):
+    lat = sorted(latencies)
+    return {
+        'requests': len(lat) + errors,
+        'errors': errors,
+        'throughput': round((len(lat) + errors) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(lat, 50) * 1000, 3),
+        'p95_ms': round(percentile(lat, 95) * 1000, 3),
+        'p99_ms': round(percentile(lat, 99) * 1000, 3),
+    }
+
+
+def _login(post_json, username, password, auth):
+    """Log a client in through `post_json(path, body) -> dict`; returns the headers its requests need."""
+    body = {'username': username, 'password': password}
+    if auth == 'token':
+        return {'Authorization': f"Bearer {post_json('/api/token', body)['access_token']}"}
+    post_json('/api/login', body)
+    return {}
+
+
+def run_client(args, owned, names):
+    """Drive endpoints sequentially through the Flask test client."""
+    from backend import app
+    results = {}
+    rng = random.Random(args.seed)
+    username = sorted(owned)[0]
+    headers = {'Accept-Encoding': args.accept_encoding}
+    user = app.test_client()
+    user_auth = _login(lambda path, body: user.post(path, json=body).get_json(), username, BENCH_PASSWORD, args.auth)
+    admin = app.test_client()
+    admin_auth = _login(lambda path, body: admin.post(path, json=body).get_json(), 'admin', ADMIN_PASSWORD,
+                        args.auth)
+    ctx = {'rng': rng, 'wids': owned[username]}
+    if 'log_set' in names:
+        ctx['session'] = user.post('/api/sessions', json={}, headers=user_auth).get_json()['id']
+    for name in names:
+        method, path, admin_only, body = ENDPOINTS[name]
+        client = admin if admin_only else user
+        auth_headers = dict(headers, **(admin_auth if admin_only else user_auth))
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            kwargs = {'json': body(ctx)} if body else {}
+            t0 = time.perf_counter()
+            r = client.open(path(ctx), method=method, headers=auth_headers, **kwargs)
+            r.get_data()  # consume streamed bodies inside the timing
+            r.close()
+            dt = time.perf_counter() - t0
+            if r.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(dt)
+        results[name] = summarize(latencies, errors, time.perf_counter() - start)
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url, timeout=30):
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def _slow_client(port, stop):
+    """Hold a connection open by sending one header line per second."""
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as s:
+            s.sendall(b'GET /api/me HTTP/1.1\r\nHost: localhost\r\n')
+            while not stop.wait(1.0):
+                s.sendall(b'X-Slow: 1\r\n')
+    except OSError:
+        pass
+
+
+def run_gunicorn(args, owned, names, env):
+    """Start a local gunicorn and hit it with --concurrency parallel clients."""
+    import requests
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    if args.worker_class:
+        env = dict(env, FITTRACK_WORKER_CLASS=args.worker_class)
+    backup_dir = None
+    if args.backup_every:
+        backup_dir = tempfile.mkdtemp(prefix='fittrack-backups-')
+        env = dict(env, FITTRACK_BACKUP_INTERVAL=str(args.backup_every), FITTRACK_BACKUP_DIR=backup_dir,
+                   FITTRACK_BACKUP_KEEP='1000')  # keep all, to count them
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-b', f'127.0.0.1:{port}', '--access-logfile', '/dev/null', 'backend.wsgi:application'],
+        cwd=ROOT, env=env)
+    try:
+        if not _wait_for(base + '/'):
+            raise SystemExit('gunicorn did not start')
+        usernames = sorted(owned)
+
+        def login(username, password):
+            s = requests.Session()
+            s.headers['Accept-Encoding'] = args.accept_encoding
+            s.headers.update(_login(lambda path, body: s.post(base + path, json=body, timeout=60).json(),
+                                    username, password, args.auth))
+            return username, s
+
+        # Log every client in up front so password hashing doesn't skew the timings.
+        user_pool, admin_pool = queue.Queue(), queue.Queue()
+        for i in range(args.concurrency):
+            user_pool.put(login(usernames[i % len(usernames)], BENCH_PASSWORD))
+            admin_pool.put(login('admin', ADMIN_PASSWORD))
+        sessions = {}
+        if 'log_set' in names:
+            for username, s in list(user_pool.queue):
+                if username not in sessions:
+                    sessions[username] = s.post(base + '/api/sessions', json={}, timeout=60).json()['id']
+
+        stop_slow = threading.Event()
+        for _ in range(args.slow_clients):
+            threading.Thread(target=_slow_client, args=(port, stop_slow), daemon=True).start()
+
+        results = {}
+        for name in names:
+            method, path, admin_only, body = ENDPOINTS[name]
+            lock = threading.Lock()
+            latencies, errors = [], [0]
+
+            def one(i):
+                pool = admin_pool if admin_only else user_pool
+                username, s = pool.get()
+                try:
+                    ctx = {'rng': random.Random(args.seed + i), 'wids': owned.get(username, [1]),
+                           'session': sessions.get(username)}
+                    kwargs = {'json': body(ctx)} if body else {}
+                    t0 = time.perf_counter()
+                    try:
+                        r = s.request(method, base + path(ctx), timeout=args.timeout, **kwargs)
+                        ok = r.status_code < 400
+                    except Exception:
+                        ok = False
+                    dt = time.perf_counter() - t0
+                finally:
+                    pool.put((username, s))
+                with lock:
+                    if ok:
+                        latencies.append(dt)
+                    else:
+                        errors[0] += 1
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(one, range(args.requests)))
+            results[name] = summarize(latencies, errors[0], time.perf_counter() - start)
+        stop_slow.set()
+        if backup_dir:
+            taken = [n for n in os.listdir(os.path.join(backup_dir, 'snapshots')) if n.endswith('.json')] \
+                if os.path.isdir(os.path.join(backup_dir, 'snapshots')) else []
+            print(f'Backups: {len(taken)} snapshots taken during the run, in {backup_dir}')
+        return results
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# --- Baselines -----------------------------------------------------------
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions against the baseline."""
+    problems = []
+    for name, cur in results.items():
+        base = (baseline.get('results') or {}).get(name)
+        if not base:
+            continue
+        if cur['errors'] > base.get('errors', 0):
+            problems.append(f"{name}: {cur['errors']} errors (baseline {base.get('errors', 0)})")
+        if base.get('p95_ms') and cur['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            problems.append(f"{name}: p95 {cur['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if base.get('throughput') and cur['throughput'] < base['throughput'] * (1 - threshold):
+            problems.append(f"{name}: throughput {cur['throughput']}/s < baseline {base['throughput']}/s")
+    return problems
+
+
+def print_table(results):
+    print(f"{'endpoint':<14}{'req':>7}{'err':>5}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['requests']:>7}{r['errors']:>5}{r['throughput']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [n.strip() for n in args.endpoints.split(',')] if args.endpoints else list(ENDPOINTS)
+    unknown = [n for n in names if n not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f'unknown endpoints: {", ".join(unknown)}')
+
+    db_path = args.database or os.path.join(tempfile.mkdtemp(prefix='fittrack-bench-'), 'bench.sqlite3')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', ADMIN_PASSWORD=ADMIN_PASSWORD)
+    if args.shards:
+        base = os.path.splitext(db_path)[0]
+        env.update(FITTRACK_SHARDS=str(args.shards),
+                   FITTRACK_SHARD_URLS=','.join(f'sqlite:///{base}-shard{i}.sqlite3' for i in range(args.shards)))
+    # backend reads its configuration at import time
+    os.environ.update({k: env[k] for k in ('DATABASE_URL', 'ADMIN_PASSWORD', 'FITTRACK_SHARDS',
+                                           'FITTRACK_SHARD_URLS') if k in env})
+    sys.path.insert(0, ROOT)
+
+    owned = seed(args)
+    runs = []
+    for _ in range(max(1, args.runs)):
+        if args.mode == 'client':
+            runs.append(run_client(args, owned, names))
+        else:
+            runs.append(run_gunicorn(args, owned, names, env))
+    # one run of a sub-millisecond endpoint is too noisy to hold against a baseline
+    results = {name: sorted((r[name] for r in runs), key=lambda r: r['p95_ms'])[len(runs) // 2] for name in names}
+    print_table(results)
+
+    report = {
+        'mode': args.mode,
+        'dataset': {'users': args.users, 'years': args.years, 'per_week': args.per_week,
+                    'exercises': args.exercises, 'seed': args.seed},
+        'requests': args.requests,
+        'runs': max(1, args.runs),
+        'concurrency': args.concurrency if args.mode == 'gunicorn' else 1,
+        'accept_encoding': args.accept_encoding,
+        'auth': args.auth,
+        'worker_class': args.worker_class if args.mode == 'gunicorn' else None,
+        'slow_clients': args.slow_clients if args.mode == 'gunicorn' else 0,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f'{args.mode}.json')
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+        print(f'Baseline saved to {baseline_path}')
+        return 0
+    if not os.path.exists(baseline_path):
+        print(f'No baseline at {baseline_path}; run with --save-baseline to create one')
+        return 1
+    with open(baseline_path, encoding='utf-8') as fh:
+        baseline = json.load(fh)
+    if baseline.get('dataset') != report['dataset']:
+        print('Warning: baseline was recorded with a different dataset')
+    problems = compare(results, baseline, args.threshold)
+    if problems:
+        print('Regressions:')
+        for p in problems:
+            print('  ' + p)
+        return 1
+    print('No regressions beyond threshold')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Check that API responses are byte for byte what Flask's jsonify would send.
+
+    python scripts/check_serialization.py --workouts 200
+
+Registers a user on a throwaway SQLite database, logs random workouts through
+the API (Czech notes, weights from 0.000002 to 1e16 kg) and fetches the JSON
+endpoints. The body of every response, encoded by backend/serialization.py,
+is compared with `jsonify` of the decoded payload; the first difference is
+printed and the script exits with status 1. Run it with
+FITTRACK_JSON_BACKEND=orjson to see where orjson output differs.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ['/api/me', '/api/version', '/api/profile', '/api/workouts', '/api/workouts?page=1&per_page=20',
+             '/api/sync', '/api/catalog', '/api/export/csv', '/api/search?q=d%C5%99ep', '/api/stats',
+             '/api/calendar', '/api/progress', '/api/leaderboards']
+NOTES = ['', 'nohy', 'Dřep a mrtvý tah 💪', 'záda\nbiceps', '"uvozovky" \\ lomítko', ' \t']
+NAMES = ['Dřep', 'Bench press', 'Mrtvý tah', 'Shyby', 'Tlaky nad hlavu']
+WEIGHTS = [0, 0.5, 2.5, 0.1 + 0.2, 1 / 3, 2e-06, 1e-07, 123456789.125, 1e15, 1e16, 1.5e300, 5e-324]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='JSON encoder comparison')
+    p.add_argument('--workouts', type=int, default=100)
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fittrack-json-'), 'db.sqlite3')
+    sys.path.insert(0, ROOT)
+    from backend import app, serialization
+
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    client.post('/api/register', json={'username': 'jsoncheck', 'password': 'jsonpass123'})
+    client.post('/api/login', json={'username': 'jsoncheck', 'password': 'jsonpass123'})
+    client.post('/api/profile', json={'age': 30, 'height_cm': 181.5, 'weight_kg': 0.1 + 0.7})
+    today = datetime.date.today()
+    wids = []
+    for _ in range(args.workouts):
+        exercises = [{'name': rng.choice(NAMES), 'sets': rng.randint(1, 5), 'reps': rng.randint(1, 12),
+                      'weight': rng.choice(WEIGHTS + [round(rng.uniform(0, 200), rng.randint(0, 6))])}
+                     for _ in range(rng.randint(1, 4))]
+        r = client.post('/api/workouts', json={'date': (today - datetime.timedelta(days=rng.randrange(400))).isoformat(),
+                                               'note': rng.choice(NOTES), 'exercises': exercises})
+        wids.append(r.get_json()['id'])
+
+    bodies = [(url, client.get(url).get_data()) for url in ENDPOINTS + [f'/api/workouts/{wid}' for wid in wids[:20]]]
+    samples = {'weights': WEIGHTS + [-w for w in WEIGHTS]}
+    bodies.append(('(float samples)', serialization.dumps(samples)))
+    with app.app_context():
+        for url, body in bodies:
+            expected = app.json.response(json.loads(body)).get_data()
+            if body != expected:
+                at = next((i for i, (x, y) in enumerate(zip(body, expected)) if x != y), min(len(body), len(expected)))
+                print(f'MISMATCH {url} at byte {at}')
+                print('  served ', body[max(0, at - 40):at + 40])
+                print('  jsonify', expected[max(0, at - 40):at + 40])
+                return 1
+    print(f'OK: {len(bodies)} payloads byte for byte equal to jsonify '
+          f"({'orjson' if serialization.USE_ORJSON else 'stdlib json'})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
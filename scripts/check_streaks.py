@@ -0,0 +1,74 @@
+"""Randomized check: incrementally maintained streak stats == from-scratch recompute.
+
+    python scripts/check_streaks.py --runs 50 --ops 200
+
+Each run registers a fresh user on a throwaway SQLite database, then applies a
+random sequence of workout creates/deletes through the real API endpoints
+(dates clustered around today so runs merge and break often). After every
+operation the stored user_stats row is compared with compute_from_scratch();
+the first mismatch is printed with the seed and operation that caused it.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='streak invariant check')
+    p.add_argument('--runs', type=int, default=30)
+    p.add_argument('--ops', type=int, default=150)
+    p.add_argument('--span', type=int, default=40, help='days around today to draw dates from')
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fittrack-streaks-'), 'db.sqlite3')
+    sys.path.insert(0, ROOT)
+    from backend import app, db
+    from backend.models import UserStats
+    from backend.streaks import compute_from_scratch
+
+    fields = ['total_workouts', 'active_days', 'active_weeks', 'first_date', 'last_date',
+              'current_run', 'longest_run']
+    today = datetime.date.today()
+    for run in range(args.runs):
+        seed = args.seed + run
+        rng = random.Random(seed)
+        client = app.test_client()
+        username = f'streak{seed}'
+        client.post('/api/register', json={'username': username, 'password': 'streakpass123'})
+        client.post('/api/login', json={'username': username, 'password': 'streakpass123'})
+        client.get('/api/stats')  # creates the user_stats row
+        with app.app_context():
+            from backend.models import User
+            uid = User.query.filter_by(username=username).first().id
+        live = []
+        for op in range(args.ops):
+            if live and rng.random() < 0.4:
+                wid = live.pop(rng.randrange(len(live)))
+                client.delete(f'/api/workouts/{wid}')
+                desc = f'delete {wid}'
+            else:
+                d = today - datetime.timedelta(days=rng.randrange(args.span))
+                r = client.post('/api/workouts', json={'date': d.isoformat(), 'exercises': []})
+                live.append(r.get_json()['id'])
+                desc = f'create {d}'
+            with app.app_context():
+                row = db.session.get(UserStats, uid)
+                stored = {f: getattr(row, f) for f in fields}
+                expected = compute_from_scratch(uid)
+            if stored != expected:
+                print(f'MISMATCH seed={seed} op#{op} ({desc})')
+                print('  stored  ', stored)
+                print('  expected', expected)
+                return 1
+    print(f'OK: {args.runs} runs x {args.ops} ops, incremental == from scratch')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Verify (and repair) the workout summary columns against workout_exercise.
+
+    python scripts/check_summaries.py            # report drift, exit 1 if any
+    python scripts/check_summaries.py --repair   # recompute the drifted rows
+    python scripts/check_summaries.py --user 42  # one user
+
+The columns are maintained by triggers (backend/summaries.py), so drift
+means a database without the triggers wrote to workout_exercise, or someone
+edited `workout` by hand. The first --show mismatches are printed as stored
+vs recomputed (exercise_count, total_sets, total_volume, max_weight).
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='check workout summary columns')
+    p.add_argument('--repair', action='store_true', help='recompute the workouts that differ')
+    p.add_argument('--user', type=int, help='only check this user id')
+    p.add_argument('--show', type=int, default=10, help='mismatches to print')
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from backend import app
+    from backend import summaries
+
+    with app.app_context():
+        drift = summaries.check(repair=args.repair, user_id=args.user)
+    for wid, stored, expected in drift[:args.show]:
+        print(f'workout {wid}: stored {stored}, expected {expected}')
+    if not drift:
+        print('OK: all workout summaries match their exercises')
+        return 0
+    if args.repair:
+        print(f'Repaired {len(drift)} workouts')
+        return 0
+    print(f'{len(drift)} workouts differ; run with --repair to fix them')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+"""Delete old change-log entries used by /api/sync (see backend/changes.py).
+
+    python scripts/prune_change_log.py              # older than FITTRACK_SYNC_RETENTION_DAYS
+    python scripts/prune_change_log.py --days 7
+
+Clients whose cursor points into the pruned range get a full snapshot on
+their next sync.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='prune the sync change log')
+    p.add_argument('--days', type=int, help='keep entries from the last N days')
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from backend import app, changes
+
+    with app.app_context():
+        days = args.days if args.days is not None else changes.RETENTION_DAYS
+        print(f'{changes.prune(days)} entries older than {days} days deleted')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
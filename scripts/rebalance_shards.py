@@ -0,0 +1,139 @@
+"""Inspect and rebalance user placement across workout shards.
+
+    FITTRACK_SHARDS=4 python scripts/rebalance_shards.py                 # show distribution
+    FITTRACK_SHARDS=4 python scripts/rebalance_shards.py --rehash        # move users to hash(id) % 4
+    FITTRACK_SHARDS=4 python scripts/rebalance_shards.py --balance       # even out workout counts
+    FITTRACK_SHARDS=4 python scripts/rebalance_shards.py --user 42 --to 1
+    FITTRACK_SHARDS=4 python scripts/rebalance_shards.py --import-global # first switch to sharding
+
+--rehash is what to run after changing FITTRACK_SHARDS: existing users keep
+their stored shard until moved. --import-global copies workouts that are
+still in the main database (from before sharding was enabled) into each
+user's shard. Without --apply every command only prints the plan.
+Moves are done one user at a time while the app keeps running, see
+backend.sharding.move_user.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def distribution(db, sharding, Workout):
+    """{shard: {user_id: workout count}} gathered from every shard."""
+    from sqlalchemy import func
+    out = {}
+    for shard in sharding.each_shard():
+        out[shard] = dict(db.session.query(Workout.user_id, func.count(Workout.id)).group_by(Workout.user_id))
+    return out
+
+
+def plan_balance(dist, tolerance):
+    """Greedy moves from the heaviest to the lightest shard until sizes are within `tolerance`."""
+    loads = {s: sum(users.values()) for s, users in dist.items()}
+    users = {s: dict(u) for s, u in dist.items()}
+    moves = []
+    while True:
+        heavy = max(loads, key=loads.get)
+        light = min(loads, key=loads.get)
+        gap = loads[heavy] - loads[light]
+        if gap <= tolerance * max(1, sum(loads.values()) / len(loads)):
+            break
+        # the user whose size is closest to half the gap narrows it the most
+        candidates = [(abs(n - gap / 2), uid, n) for uid, n in users[heavy].items() if 0 < n < gap]
+        if not candidates:
+            break
+        _, uid, n = min(candidates)
+        moves.append((uid, heavy, light, n))
+        users[light][uid] = users[heavy].pop(uid)
+        loads[heavy] -= n
+        loads[light] += n
+    return moves
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='rebalance workout shards')
+    p.add_argument('--rehash', action='store_true', help='move users whose shard differs from hash(id)')
+    p.add_argument('--balance', action='store_true', help='move users to even out workout counts')
+    p.add_argument('--tolerance', type=float, default=0.1, help='allowed load gap for --balance (fraction)')
+    p.add_argument('--user', type=int, help='move a single user (with --to)')
+    p.add_argument('--to', type=int, help='target shard for --user')
+    p.add_argument('--import-global', action='store_true',
+                   help='copy workouts still in the main database into the shards')
+    p.add_argument('--grace', type=float, default=2.0, help='seconds to wait before deleting moved rows')
+    p.add_argument('--apply', action='store_true', help='perform the moves instead of printing them')
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from backend import app, db, sharding
+    from backend.models import User, Workout
+
+    if not sharding.enabled():
+        raise SystemExit('sharding is off: set FITTRACK_SHARDS')
+
+    with app.app_context():
+        if args.import_global:
+            return import_global(args, db, sharding, User)
+
+        dist = distribution(db, sharding, Workout)
+        for shard, users in sorted(dist.items()):
+            print(f'shard {shard}: {len(users)} users, {sum(users.values())} workouts')
+
+        stored = dict(db.session.query(User.id, User.shard))
+        moves = []
+        if args.user is not None:
+            if args.to is None or not 0 <= args.to < sharding.SHARD_COUNT:
+                raise SystemExit('--user needs --to <shard index>')
+            moves.append((args.user, sharding.shard_of_user_id(args.user), args.to, None))
+        elif args.rehash:
+            sizes = {uid: n for users in dist.values() for uid, n in users.items()}
+            moves = [(uid, shard, sharding.hash_shard(uid), sizes.get(uid, 0))
+                     for uid, shard in stored.items()
+                     if shard is not None and shard != sharding.hash_shard(uid)]
+        elif args.balance:
+            moves = plan_balance(dist, args.tolerance)
+
+        for uid, src, dst, n in moves:
+            print(f'user {uid}: shard {src} -> {dst}' + (f' ({n} workouts)' if n is not None else ''))
+        if not args.apply:
+            if moves:
+                print(f'{len(moves)} moves planned, run with --apply to perform them')
+            return 0
+        for uid, _src, dst, _n in moves:
+            print(sharding.move_user(uid, dst, grace=args.grace))
+    return 0
+
+
+def import_global(args, db, sharding, User):
+    """Copy workout rows left in the main database into each user's shard."""
+    from backend.models import Workout, WorkoutExercise
+    main = db.engines[None]
+    workout, exercise = Workout.__table__, WorkoutExercise.__table__
+    with main.connect() as conn:
+        workouts = [dict(r._mapping) for r in conn.execute(workout.select())]
+        exercises = [dict(r._mapping) for r in conn.execute(exercise.select())]
+    placement = dict(db.session.query(User.id, User.shard))
+    print(f'{len(workouts)} workouts, {len(exercises)} exercises in the main database')
+    if not args.apply:
+        return 0
+    shard_of_workout = {w['id']: placement.get(w['user_id']) for w in workouts}
+    for shard in sharding.each_shard():
+        rows = [w for w in workouts if shard_of_workout[w['id']] == shard]
+        if rows:
+            db.session.execute(workout.insert(), rows)
+        rows = [e for e in exercises if shard_of_workout.get(e['workout_id']) == shard]
+        if rows:
+            db.session.execute(exercise.insert(), rows)
+        db.session.commit()
+    from backend.search import ensure_search_index
+    ensure_search_index(rebuild=True)
+    with main.begin() as conn:
+        conn.execute(exercise.delete())
+        conn.execute(workout.delete())
+    print('imported; the main database copies were deleted')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""Recompute the materialized leaderboards from the workout tables.
+
+    python scripts/rebuild_leaderboards.py            # all users
+    python scripts/rebuild_leaderboards.py --user 42  # one user
+
+Meant to run periodically (cron) next to the incremental updates done by the
+API; it prints how many stored scores differed from the recomputed ones, so
+a non-zero count points at a write path that skips the hooks.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='rebuild leaderboards')
+    p.add_argument('--user', type=int, help='only recompute this user id')
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from backend import app, db
+    from backend import leaderboards
+    from backend.models import LeaderboardScore
+
+    def snapshot():
+        q = db.session.query(LeaderboardScore.board, LeaderboardScore.user_id, LeaderboardScore.score)
+        if args.user is not None:
+            q = q.filter(LeaderboardScore.user_id == args.user)
+        return {(b, u): round(s, 3) for b, u, s in q if abs(s) > 1e-6}
+
+    with app.app_context():
+        before = snapshot()
+        rows = leaderboards.rebuild(args.user)
+        after = snapshot()
+    drift = sum(1 for k in before.keys() | after.keys() if before.get(k) != after.get(k))
+    print(f'Rebuilt {rows} scores, {drift} differed from the stored values')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,3 +15,25 @@ r2 = client.post('/api/login', json={'username':'testuser_smoke','password':'tes
 print('POST /api/login =>', r2.status_code, r2.get_json())
 r3 = client.get('/api/me')
 print('GET /api/me =>', r3.status_code, r3.get_json())
+
+# A deleted account's id must not be handed to the next registration: the
+# other sessions of the deleted user (and cached aggregates keyed by the id)
+# would otherwise belong to the new account.
+import uuid
+suffix = uuid.uuid4().hex[:8]
+first, second = app.test_client(), app.test_client()
+first.post('/api/register', json={'username': f'smoke_del_{suffix}', 'password': 'testpass123'})
+for c in (first, second):
+    c.post('/api/login', json={'username': f'smoke_del_{suffix}', 'password': 'testpass123'})
+deleted_id = first.get('/api/me').get_json()['user']['id']
+first.get('/api/stats')  # leaves cached aggregates keyed by the id
+r = first.delete('/api/me', json={'password': 'testpass123'})
+print('DELETE /api/me =>', r.status_code, r.get_json())
+newcomer = app.test_client()
+newcomer.post('/api/register', json={'username': f'smoke_new_{suffix}', 'password': 'testpass123'})
+newcomer.post('/api/login', json={'username': f'smoke_new_{suffix}', 'password': 'testpass123'})
+new_id = newcomer.get('/api/me').get_json()['user']['id']
+stale = second.get('/api/me')
+print('registered after delete => id', new_id, '(deleted', deleted_id, '); old session /api/me =>', stale.status_code)
+assert new_id != deleted_id, 'id of a deleted account was reused'
+assert stale.status_code != 200, 'session of a deleted account still logged in'  # 302 to the login view